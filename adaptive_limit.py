@@ -0,0 +1,157 @@
+"""
+    Adaptive concurrency for the uploads to GeoServer.
+
+    A fixed number of upload threads either leaves throughput unused or overloads GeoServer's OSEO REST API and
+    its database. AdaptiveLimiter keeps an AIMD (additive increase, multiplicative decrease) limit on the number
+    of requests in flight: every fast, successful request raises the limit by about one per round trip, and an
+    error (429, 5xx, connection error) or a response slower than the latency target halves it, at most once per
+    round trip. A Retry-After header pauses all new requests for the given time.
+
+    The upload threads call request_with_limit(), which waits for a free slot, makes the request and retries the
+    requests the server turned away because of the load, after a random wait that doubles with every try unless the
+    server gave a Retry-After. A POST that creates a product is not idempotent: it is tried again only when it cannot
+    have been processed, i.e. the connection was never made or the server answered 429 or 503.
+"""
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+
+class AdaptiveLimiter:
+    """
+        initial: Limit of requests in flight at the start
+        minimum: The limit is never lowered below this
+        maximum: The limit is never raised above this, the number of upload threads should be the same
+        latency_target: Seconds, slower responses are taken as a sign of overload
+    """
+
+    def __init__(self, initial=2, minimum=1, maximum=16, latency_target=2.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """
+            Waits until a request can be made under the limit and no Retry-After pause is on.
+        """
+
+        with self.condition:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    self.condition.wait(pause)
+                elif self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                else:
+                    self.condition.wait()
+
+    def release(self, latency, ok=True, retry_after=None):
+        """
+            latency: Seconds the request took
+            ok: False if the request failed because of the load on the server
+            retry_after: Seconds from the Retry-After header of the response, if any
+        """
+
+        with self.condition:
+            now = time.monotonic()
+            self.in_flight -= 1
+            if ok and latency <= self.latency_target:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            elif now - latency > self.last_decrease:
+                # Only the requests started after the last decrease lower the limit again
+                self.limit = max(self.minimum, self.limit / 2)
+                self.last_decrease = now
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            self.condition.notify_all()
+
+def parse_retry_after(value):
+    """
+        value: Retry-After header, either seconds or an HTTP date
+        -> seconds to wait, None if the header is missing or not understood
+    """
+
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return int(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# Statuses that tell the request was turned away before it was processed
+not_processed = (429, 503)
+
+def backoff(attempt, base=0.5, cap=30.0):
+    """
+        attempt: Number of the try that failed, from 0
+        base: Seconds of the longest wait after the first try
+        cap: Longest wait in seconds
+        -> seconds to wait before the next try, random between 0 and base * 2 ** attempt so the threads do not retry together
+    """
+
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def reached_server(error):
+    """
+        error: Exception raised by the request
+        -> False if the connection was never made, so the server cannot have seen the request
+    """
+
+    if isinstance(error, ConnectionRefusedError):
+        return False
+
+    import requests
+    from urllib3.exceptions import NewConnectionError, ConnectTimeoutError
+
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return False
+    # requests.ConnectionError wraps the urllib3 MaxRetryError whose reason is the error of the last connection attempt
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return not isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+def request_with_limit(limiter, method, url, retries=5, idempotent=True, **kwargs):
+    """
+        limiter: AdaptiveLimiter shared by the upload threads
+        method: Function making the request, e.g. session.post
+        url: URL of the request
+        retries: How many times a request turned away because of the load is tried again
+        idempotent: False for requests that must not be repeated once the server may have processed them, e.g. the POST
+            of a new product. They are retried only after connection failures and the statuses in not_processed
+        kwargs: Passed to the method, e.g. json and headers
+        -> requests.Response of the last try
+    """
+
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        start = time.monotonic()
+        try:
+            r = method(url, **kwargs)
+        except OSError as error:
+            # Connection errors (requests.RequestException is an OSError) are taken as overload as well
+            limiter.release(time.monotonic() - start, ok=False)
+            if attempt == retries or (not idempotent and reached_server(error)):
+                raise
+            time.sleep(backoff(attempt))
+            continue
+        except BaseException:
+            # Any other error, e.g. an invalid URL, a body that cannot be serialized or KeyboardInterrupt, still frees
+            # the slot, otherwise a few of them would leave no slots for the later requests
+            limiter.release(time.monotonic() - start, ok=False)
+            raise
+
+        overloaded = r.status_code == 429 or r.status_code >= 500
+        retry_after = parse_retry_after(r.headers.get("Retry-After"))
+        limiter.release(time.monotonic() - start, ok=not overloaded, retry_after=retry_after)
+        if not overloaded or attempt == retries or (not idempotent and r.status_code not in not_processed):
+            return r
+        if not retry_after:
+            # With Retry-After the limiter holds back every request until the pause is over
+            time.sleep(backoff(attempt))
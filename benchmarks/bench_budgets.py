@@ -0,0 +1,193 @@
+"""
+    Memory, request and throughput budgets of the build and the update, checked on synthetic buckets.
+
+    create_collection() and update_catalog() are run against the local stand-ins of fake_allas.py on buckets of
+    increasing size, and the run fails (exit code 1) if any of these goes over its budget:
+
+        memory_mb_per_1k_items  Peak traced memory added per 1000 items between two sizes, so the fixed overhead does
+                                not count and memory growing faster than the number of items shows up at the larger sizes
+        s3_requests_per_safe    list_objects_v2 pages and get_object calls
+        s3_kb_per_safe          kB of metadata XML read from the objects
+        http_requests_per_safe  Images opened with rasterio and uploads to GeoServer
+        items_per_second        Minimum, measured in a separate run without tracemalloc
+
+    Run from anywhere, with the dependencies of the scripts installed:
+
+        $ python benchmarks/bench_budgets.py --sizes 200 500 1000
+"""
+import io
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+from unittest import mock
+from contextlib import redirect_stdout
+
+repo_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repo_dir))
+
+from fake_allas import synthetic_safes, FakeS3Client, FakeRasterio, FakeSession
+
+budgets = {
+    'build': {
+        'memory_mb_per_1k_items': 250,
+        's3_requests_per_safe': 3.2,
+        's3_kb_per_safe': 64,
+        'http_requests_per_safe': 1.1,
+        'items_per_second': 25,
+    },
+    'update': {
+        'memory_mb_per_1k_items': 250,
+        's3_requests_per_safe': 3.2,
+        's3_kb_per_safe': 64,
+        'http_requests_per_safe': 3.1,
+        'items_per_second': 10,
+    },
+}
+
+def make_buckets(size, count=4):
+    """
+        size: Number of SAFEs in all the buckets together
+        count: Number of buckets the SAFEs are spread over
+        -> dict of the SAFE names by bucket name
+    """
+
+    safes = synthetic_safes(size)
+    return {f"Sentinel2-bench-{i}": safes[i::count] for i in range(count)}
+
+def run_build(buckets):
+    """
+        buckets: dict from make_buckets()
+        -> (S3 requests, HTTP requests, S3 bytes) made by create_collection()
+    """
+
+    import sentinel_to_stac
+
+    client = FakeS3Client(buckets)
+    fake_rasterio = FakeRasterio()
+    with tempfile.TemporaryDirectory() as workdir, mock.patch.object(sentinel_to_stac, 'rasterio', fake_rasterio):
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            # Built in the main process so that the memory of the items is traced
+            sentinel_to_stac.create_collection(client, list(buckets), processes=0, tile_cache_path=None)
+        finally:
+            os.chdir(cwd)
+
+    return client.requests(), sum(fake_rasterio.calls.values()), client.bytes_sent
+
+def run_update(buckets):
+    """
+        buckets: dict from make_buckets()
+        -> (S3 requests, HTTP requests, S3 bytes) made by update_catalog()
+    """
+
+    import update_allas_sentinel
+    from sentinel_to_stac import make_root_collection
+
+    client = FakeS3Client(buckets)
+    fake_rasterio = FakeRasterio()
+    FakeSession.calls.clear()
+    with mock.patch.object(update_allas_sentinel, 'init_client', lambda: client), \
+            mock.patch.object(update_allas_sentinel, 'get_buckets', lambda c: list(buckets)), \
+            mock.patch.object(update_allas_sentinel, 'rasterio', fake_rasterio), \
+            mock.patch.object(update_allas_sentinel.requests, 'Session', FakeSession):
+        update_allas_sentinel.update_catalog('http://localhost/geoserver/rest/oseo/', make_root_collection(), 'bench', tile_cache_path=None)
+
+    return client.requests(), sum(fake_rasterio.calls.values()) + sum(FakeSession.calls.values()), client.bytes_sent
+
+def measure(run, buckets, trace):
+    """
+        run: run_build or run_update
+        buckets: dict from make_buckets()
+        trace: Whether the memory is traced
+        -> dict with the seconds, peak memory in bytes (None without trace), the request counts and S3 bytes of the run
+    """
+
+    gc.collect()
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    # The scripts print a line per item
+    with redirect_stdout(io.StringIO()):
+        s3_requests, http_requests, s3_bytes = run(buckets)
+    elapsed = time.perf_counter() - start
+    peak = None
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {'seconds': elapsed, 'peak': peak, 's3': s3_requests, 'http': http_requests, 's3_bytes': s3_bytes}
+
+def check(name, sizes, run, budget):
+    """
+        name: Name of the run for the output
+        sizes: Increasing numbers of SAFEs
+        run: run_build or run_update
+        budget: dict of the budgets of the run
+        -> list of the budgets that were exceeded
+    """
+
+    failures = []
+    previous = None
+    for size in sizes:
+        buckets = make_buckets(size)
+        timed = measure(run, buckets, trace=False)
+        traced = measure(run, buckets, trace=True)
+
+        values = {
+            's3_requests_per_safe': timed['s3'] / size,
+            's3_kb_per_safe': timed['s3_bytes'] / size / 1024,
+            'http_requests_per_safe': timed['http'] / size,
+            'items_per_second': size / timed['seconds'],
+        }
+        if previous:
+            values['memory_mb_per_1k_items'] = (traced['peak'] - previous[1]) / (size - previous[0]) * 1000 / 2**20
+        previous = (size, traced['peak'])
+
+        print(f"{name} {size} SAFEs: peak {traced['peak'] / 2**20:.1f} MB, " + ", ".join(f"{k} {v:.2f}" for k, v in values.items()))
+
+        for key, value in values.items():
+            # The throughput is a minimum, everything else a maximum
+            over = value < budget[key] if key == 'items_per_second' else value > budget[key]
+            if over:
+                failures.append(f"{name} {size} SAFEs: {key} {value:.2f}, budget {budget[key]}")
+
+    return failures
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[200, 500, 1000], help="Numbers of SAFEs in the synthetic buckets")
+    parser.add_argument("--budgets", type=str, default=None, help="JSON file with budgets replacing the defaults, same layout as budgets")
+    parser.add_argument("--only", choices=["build", "update"], default=None, help="Check only the build or the update")
+    args = parser.parse_args()
+
+    if args.budgets:
+        with open(args.budgets) as f:
+            for name, values in json.load(f).items():
+                budgets[name].update(values)
+
+    sizes = sorted(args.sizes)
+    failures = []
+    if args.only in (None, 'build'):
+        failures += check('build', sizes, run_build, budgets['build'])
+    if args.only in (None, 'update'):
+        failures += check('update', sizes, run_update, budgets['update'])
+
+    if failures:
+        print("Budgets exceeded:")
+        for failure in failures:
+            print(" -", failure)
+        sys.exit(1)
+
+    print("All budgets met")
+
+if __name__ == "__main__":
+
+    main()
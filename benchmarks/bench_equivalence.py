@@ -0,0 +1,169 @@
+"""
+    Differential check of the item and payload code against the frozen reference in reference_ingest.py.
+
+    Every synthetic SAFE of fake_allas.py is made into an item by the reference and by the current code paths:
+
+        build       sentinel_to_stac.fetch_safe() + build_item(), with the tile geometry cache
+        update      update_allas_sentinel.add_safe_items(), with the tile geometry cache
+
+    and the items, the OSEO payloads of update_allas_sentinel.json_convert() and the payloads of
+    stac_to_geoserver.json_convert() are compared field by field. bbox, geometry and proj:transform are compared with
+    a numeric tolerance, everything else exactly. The run fails (exit code 1) if anything differs:
+
+        $ python benchmarks/bench_equivalence.py --safes 50
+"""
+import io
+import sys
+import json
+import argparse
+import tempfile
+from pathlib import Path
+from unittest import mock
+from contextlib import redirect_stdout, ExitStack
+
+repo_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repo_dir))
+
+from fake_allas import synthetic_safes, safe_keys, FakeS3Client, FakeRasterio
+
+# Numbers under these keys are compared with the tolerance
+tolerant_keys = {'bbox', 'geometry', 'proj:transform'}
+
+def normalize(content):
+    """
+        content: JSON-like dict
+        -> the dict as it would be read back from JSON, tuples become lists and datetimes strings
+    """
+
+    return json.loads(json.dumps(content, default=str))
+
+def diff(reference, current, tolerance, path='', tolerant=False):
+    """
+        reference: JSON value from the reference
+        current: JSON value from the current code
+        tolerance: Largest allowed absolute difference of the numbers under tolerant_keys
+        path: Path of the values in the document, for the messages
+        tolerant: Whether the values are under one of tolerant_keys
+        -> list of the differences as strings
+    """
+
+    if isinstance(reference, dict) and isinstance(current, dict):
+        differences = []
+        for key in sorted(set(reference) | set(current)):
+            if key not in current:
+                differences.append(f"{path}/{key}: missing")
+            elif key not in reference:
+                differences.append(f"{path}/{key}: not in the reference")
+            else:
+                differences += diff(reference[key], current[key], tolerance, f"{path}/{key}", tolerant or key in tolerant_keys)
+        return differences
+
+    if isinstance(reference, list) and isinstance(current, list):
+        if len(reference) != len(current):
+            return [f"{path}: {len(reference)} values in the reference, {len(current)} now"]
+        differences = []
+        for i, (a, b) in enumerate(zip(reference, current)):
+            differences += diff(a, b, tolerance, f"{path}/{i}", tolerant)
+        return differences
+
+    numbers = (int, float)
+    if tolerant and isinstance(reference, numbers) and isinstance(current, numbers) and not isinstance(reference, bool):
+        return [] if abs(reference - current) <= tolerance else [f"{path}: {reference} != {current}"]
+
+    return [] if reference == current else [f"{path}: {reference!r} != {current!r}"]
+
+def compare(name, safe, reference, current, tolerance):
+    """
+        name: Name of the compared output for the messages
+        safe: SAFE the outputs were made from
+        reference: dict made by the reference
+        current: dict made by the current code
+        tolerance: See diff()
+        -> list of the differences as strings
+    """
+
+    return [f"{name} {safe}{difference}" for difference in diff(normalize(reference), normalize(current), tolerance)]
+
+def item_content(item_dict, collection_id):
+    """
+        item_dict: STAC Item dict
+        collection_id: Id of the collection the item is in
+        -> the dict without the links, which depend on where the item is saved, and with the collection set
+    """
+
+    return {**{k: v for k, v in item_dict.items() if k != 'links'}, 'collection': collection_id}
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--safes", type=int, default=50, help="Number of synthetic SAFEs compared")
+    parser.add_argument("--tolerance", type=float, default=1e-9, help="Largest allowed difference of bbox, geometry and proj:transform numbers")
+    parser.add_argument("--show", type=int, default=20, help="Number of differences printed")
+    args = parser.parse_args()
+
+    import reference_ingest
+    import sentinel_to_stac
+    import update_allas_sentinel
+    import stac_to_geoserver
+    from sentinel_to_stac import make_root_collection
+
+    bucket = 'Sentinel2-equivalence'
+    client = FakeS3Client({bucket: synthetic_safes(args.safes)})
+    fake_rasterio = FakeRasterio()
+    collection = make_root_collection()
+    build_cache = {}
+    update_cache = {}
+
+    differences = []
+    compared = 0
+    with ExitStack() as stack, tempfile.TemporaryDirectory() as workdir:
+        for module in (reference_ingest, sentinel_to_stac, update_allas_sentinel):
+            stack.enter_context(mock.patch.object(module, 'rasterio', fake_rasterio))
+        # The scripts print a line per item
+        stack.enter_context(redirect_stdout(io.StringIO()))
+
+        for safe in client.buckets[bucket]:
+            keys = safe_keys(safe)
+
+            reference = reference_ingest.reference_safe_item(client, bucket, safe, keys)
+            record = sentinel_to_stac.fetch_safe(client, bucket, safe, keys, build_cache)
+            update_items = {}
+            update_allas_sentinel.add_safe_items(update_items, collection, client, bucket, safe, keys, update_cache)
+
+            if reference is None or record is None or not update_items:
+                differences.append(f"{safe}: skipped by reference {reference is None}, build {record is None}, update {not update_items}")
+                continue
+
+            reference_item = item_content(reference.to_dict(include_self_link=False, transform_hrefs=False), collection.id)
+            build_item = item_content(sentinel_to_stac.build_item(record), collection.id)
+            update_item = item_content(list(update_items.values())[0].to_dict(include_self_link=False, transform_hrefs=False), collection.id)
+            # The item of the update stays in the collection otherwise
+            collection.remove_item(reference.id)
+
+            differences += compare('build item', safe, reference_item, build_item, args.tolerance)
+            differences += compare('update item', safe, reference_item, update_item, args.tolerance)
+            differences += compare('update payload', safe, reference_ingest.json_convert(reference_item),
+                update_allas_sentinel.json_convert(update_item), args.tolerance)
+
+            # stac_to_geoserver converts the item files of the saved catalog
+            reference_file = Path(workdir) / 'reference.json'
+            build_file = Path(workdir) / 'build.json'
+            reference_file.write_text(json.dumps(normalize(reference_item)))
+            build_file.write_text(json.dumps(normalize(build_item)))
+            differences += compare('publish payload', safe, reference_ingest.json_convert_file(reference_file),
+                stac_to_geoserver.json_convert(build_file), args.tolerance)
+
+            compared += 1
+
+    print(f"Compared {compared} SAFEs on the build, update and publish paths")
+    if differences:
+        print(f"{len(differences)} differences to the reference:")
+        for difference in differences[:args.show]:
+            print(" -", difference)
+        sys.exit(1)
+
+    print("No differences to the reference")
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,58 @@
+"""
+    Listing time of one large bucket by the number of listing threads.
+
+    The SAFEs of a synthetic bucket are listed with safe_listing.iter_safes() against the stand-in of fake_allas.py,
+    with a fixed latency added to every list_objects_v2 page like the round trip to Allas, with 1 and more threads:
+
+        $ python benchmarks/bench_listing.py --safes 2000 --workers 1 2 4 8 --latency 0.05
+"""
+import sys
+import time
+import argparse
+from pathlib import Path
+
+repo_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repo_dir))
+
+from fake_allas import synthetic_safes, FakeS3Client
+from safe_listing import iter_safes
+
+class SlowS3Client(FakeS3Client):
+    """
+        FakeS3Client whose every listing page takes latency seconds
+    """
+
+    def __init__(self, buckets, latency):
+        super().__init__(buckets)
+        self.latency = latency
+
+    def page(self, entries):
+        time.sleep(self.latency)
+        return super().page(entries)
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--safes", type=int, default=2000, help="Number of SAFEs in the bucket")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="Numbers of listing threads compared")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds every listing page takes")
+    parser.add_argument("--years", action="store_true", help="Put the SAFEs into year pseudofolders, like the buckets of project 2000290")
+    args = parser.parse_args()
+
+    safes = synthetic_safes(args.safes)
+    if args.years:
+        safes = [f"{safe.split('_')[2][:4]}/{safe}" for safe in safes]
+
+    for discovery in ('delimiter', 'list'):
+        baseline = None
+        for workers in args.workers:
+            client = SlowS3Client({'Sentinel2-listing': safes}, args.latency)
+            start = time.perf_counter()
+            count = sum(1 for _ in iter_safes(client, 'Sentinel2-listing', discovery, list_workers=workers))
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(f"{discovery:9} {workers:2} workers: {count} SAFEs in {elapsed:.2f} s, {client.calls['list_objects_v2']} pages, {baseline / elapsed:.1f}x")
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,63 @@
+"""
+    Start up time of the s2stac subcommands compared to the imports the scripts used to do at load time.
+
+    Every measurement is a fresh interpreter, so the numbers are cold imports as on the batch nodes.
+    Run from anywhere:
+
+        $ python benchmarks/bench_startup.py --repeat 5
+"""
+import sys
+import time
+import argparse
+import statistics
+import importlib.util
+import subprocess
+from pathlib import Path
+
+repo_dir = Path(__file__).resolve().parent.parent
+
+# The imports every script did at module load before the s2stac entry point, pandas is no longer a requirement
+legacy_modules = ["boto3", "pandas", "pystac", "rasterio", "shapely", "pystac_client", "requests"]
+
+def time_command(code, repeat):
+    """
+        code: Python code run with `python -c` in the repository folder
+        repeat: Number of fresh interpreters to time
+        -> median wall time in seconds
+    """
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=repo_dir, check=True)
+        times.append(time.perf_counter() - start)
+
+    return statistics.median(times)
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs per measurement")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(repo_dir))
+    from s2stac import COMMANDS
+
+    # Only the installed modules are imported, so the legacy line runs also without pandas
+    installed = [x for x in legacy_modules if importlib.util.find_spec(x)]
+    missing = sorted(set(legacy_modules) - set(installed))
+    if missing:
+        print(f"Not installed, left out of the legacy imports: {', '.join(missing)}")
+
+    baseline = time_command(f"import {', '.join(installed)}" if installed else "pass", args.repeat)
+    print(f"{'legacy imports':<20} {baseline:8.3f} s")
+    print(f"{'s2stac --help':<20} {time_command('import s2stac; s2stac.build_parser()', args.repeat):8.3f} s")
+
+    for command, module in COMMANDS.items():
+        # Importing the command module is everything a subcommand loads before it starts working
+        elapsed = time_command(f"import s2stac, importlib; importlib.import_module(s2stac.COMMANDS['{command}'])", args.repeat)
+        print(f"{'s2stac ' + command:<20} {elapsed:8.3f} s  ({baseline / elapsed:.1f}x faster than legacy)")
+
+if __name__ == "__main__":
+
+    main()
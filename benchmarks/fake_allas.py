@@ -0,0 +1,321 @@
+"""
+    Local stand-ins for Allas, the images and GeoServer, for running the scripts on synthetic buckets.
+
+    FakeS3Client answers list_buckets, list_objects_v2 (through get_paginator, with Prefix, Delimiter and pages of
+    1000 like S3) and get_object (with Range requests, counting the bytes sent). The buckets are made of SAFE names only: the keys and the metadata XML of every SAFE
+    are generated when they are listed or read, so the stand-in itself takes next to no memory and does not distort
+    the memory measurements of the scripts.
+
+    FakeRasterio replaces the rasterio module where the scripts open the images over HTTP, and FakeSession replaces
+    requests.Session for the uploads. Every stand-in counts the requests it gets.
+"""
+import io
+import re
+import bisect
+from collections import Counter
+
+# MGRS tiles over Finland and their UTM zones, with the lower left corner of the tile in UTM coordinates
+tiles = {
+    '34VEM': (32634, 499980, 6690240),
+    '34VFN': (32634, 600000, 6790200),
+    '35VLG': (32635, 300000, 6890200),
+    '35VNL': (32635, 499980, 7190200),
+    '35WMP': (32635, 399960, 7490200),
+}
+
+# The band images of an L2A SAFE by resolution
+band_images = {
+    '10': ['AOT', 'B02', 'B03', 'B04', 'B08', 'TCI', 'WVP'],
+    '20': ['AOT', 'B01', 'B02', 'B03', 'B04', 'B05', 'B06', 'B07', 'B11', 'B12', 'B8A', 'SCL', 'TCI', 'WVP'],
+    '60': ['AOT', 'B01', 'B02', 'B03', 'B04', 'B05', 'B06', 'B07', 'B09', 'B11', 'B12', 'B8A', 'SCL', 'TCI', 'WVP'],
+}
+
+# Rows and columns of a tile by resolution
+tile_shapes = {'10': 10980, '20': 5490, '60': 1830}
+
+safe_tile_pattern = re.compile(r"_T(\d{2}[A-Z]{3})_")
+image_pattern = re.compile(r"T(\d{2}[A-Z]{3})_\d{8}T\d{6}_(?:[A-Z0-9]{3}_(\d+)m|PVI)")
+
+def synthetic_safes(count, start=0, missions=('S2A', 'S2B'), baselines=('0208', '0509')):
+    """
+        count: Number of SAFE names
+        start: Number of the first SAFE, so that several buckets can have different SAFEs
+        missions: Missions the SAFEs are spread over
+        baselines: Processing baselines the SAFEs are spread over
+        -> sorted list of SAFE folder names, e.g. 'S2A_MSIL2A_20180705T095031_N0208_R079_T34VEM_20180705T120000.SAFE'
+    """
+
+    safes = []
+    for i in range(start, start + count):
+        tile = list(tiles)[i % len(tiles)]
+        # One SAFE per tile and day from the summer of 2016 on
+        day = i // len(tiles)
+        year = 2016 + day // 120
+        month = 5 + (day % 120) // 30
+        sensing = f"{year}{month:02d}{day % 30 + 1:02d}T{9 + i % 3:02d}{i % 60:02d}31"
+        safes.append(
+            f"{missions[i % len(missions)]}_MSIL2A_{sensing}_N{baselines[i % len(baselines)]}_R{i % 143 + 1:03d}_T{tile}_{sensing[:8]}T120000.SAFE"
+        )
+
+    return sorted(safes)
+
+def safe_keys(safe, folder=''):
+    """
+        safe: SAFE folder name from synthetic_safes()
+        folder: Pseudofolder of the SAFE, e.g. '2018/'
+        -> sorted list of the keys of the SAFE
+    """
+
+    tile = safe_tile_pattern.search(safe).group(1)
+    sensing = safe.split('_')[2]
+    granule = f"{folder}{safe}/GRANULE/L2A_T{tile}_A000000_{sensing}"
+
+    keys = [
+        f"{folder}{safe}/MTD_MSIL2A.xml",
+        f"{folder}{safe}/manifest.safe",
+        f"{granule}/MTD_TL.xml",
+        f"{granule}/QI_DATA/T{tile}_{sensing}_PVI.jp2",
+    ]
+    for resolution, bands in band_images.items():
+        keys.extend(f"{granule}/IMG_DATA/R{resolution}m/T{tile}_{sensing}_{band}_{resolution}m.jp2" for band in bands)
+
+    return sorted(keys)
+
+# The sun and viewing angle grids that follow Tile_Geocoding in MTD_TL.xml and make up most of its 500 kB or so
+angle_grid = '<Values_List>' + ('<VALUES>' + ' '.join(['8.12345'] * 23) + '</VALUES>') * 23 + '</Values_List>'
+tile_angles = '<Tile_Angles>' + ''.join(
+    f'<Viewing_Incidence_Angles_Grids bandId="{band}" detectorId="{detector}"><Zenith>{angle_grid}</Zenith><Azimuth>{angle_grid}</Azimuth></Viewing_Incidence_Angles_Grids>'
+    for band in range(13) for detector in range(1, 6)
+) + '</Tile_Angles>'
+
+def tile_metadata(tile):
+    """
+        tile: MGRS tile id
+        -> MTD_TL.xml content with the CRS, the sizes and the angle grids of the tile
+    """
+
+    epsg, left, bottom = tiles[tile]
+    sizes = ''.join(
+        f'<Size resolution="{resolution}"><NROWS>{size}</NROWS><NCOLS>{size}</NCOLS></Size>' for resolution, size in tile_shapes.items()
+    )
+    positions = ''.join(
+        f'<Geoposition resolution="{resolution}"><ULX>{left}</ULX><ULY>{bottom + 109800}</ULY><XDIM>{resolution}</XDIM><YDIM>-{resolution}</YDIM></Geoposition>'
+        for resolution in tile_shapes
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n<n1:Level-2A_Tile_ID xmlns:n1="https://psd-14.sentinel2.eo.esa.int/PSD/S2_PDI_Level-2A_Tile_Metadata.xsd">'
+        f'<n1:Geometric_Info><Tile_Geocoding metadataLevel="Brief"><HORIZONTAL_CS_NAME>WGS84 / UTM</HORIZONTAL_CS_NAME><HORIZONTAL_CS_CODE>EPSG:{epsg}</HORIZONTAL_CS_CODE>{sizes}{positions}</Tile_Geocoding>'
+        f'{tile_angles}</n1:Geometric_Info></n1:Level-2A_Tile_ID>'
+    )
+
+def product_metadata(safe):
+    """
+        safe: SAFE folder name from synthetic_safes()
+        -> MTD_MSIL2A.xml content with the tags the scripts read
+    """
+
+    parts = safe.split('.')[0].split('_')
+    sensing = parts[2]
+    start = f"{sensing[0:4]}-{sensing[4:6]}-{sensing[6:8]}T{sensing[9:11]}:{sensing[11:13]}:{sensing[13:15]}.024Z"
+    return (
+        '<Level-2A_User_Product><General_Info><Product_Info>'
+        f'<PRODUCT_START_TIME>{start}</PRODUCT_START_TIME><PRODUCT_STOP_TIME>{start}</PRODUCT_STOP_TIME>'
+        f'<PROCESSING_BASELINE>{parts[3][1:3]}.{parts[3][3:5]}</PROCESSING_BASELINE>'
+        f'<Datatake><SENSING_ORBIT_NUMBER>{int(parts[4][1:])}</SENSING_ORBIT_NUMBER></Datatake>'
+        '</Product_Info></General_Info><Quality_Indicators_Info>'
+        f'<Cloud_Coverage_Assessment>{len(safe) % 40}.5</Cloud_Coverage_Assessment>'
+        '<Image_Content_QI><NODATA_PIXEL_PERCENTAGE>12.25</NODATA_PIXEL_PERCENTAGE></Image_Content_QI>'
+        '</Quality_Indicators_Info></Level-2A_User_Product>'
+    )
+
+class FakeBody:
+    """
+        Streaming body of get_object with the read and iter_chunks methods of botocore's StreamingBody
+    """
+
+    def __init__(self, content):
+        self.stream = io.BytesIO(content)
+
+    def read(self, amt=None):
+        return self.stream.read(amt)
+
+    def iter_chunks(self, chunk_size=1024):
+        while True:
+            chunk = self.stream.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+class FakePaginator:
+    """
+        Paginator of list_objects_v2 over the generated keys
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, Bucket, Prefix='', Delimiter=None, PaginationConfig=None):
+        page_size = 1000
+        page = []
+        pages = 0
+        seen_prefixes = set()
+        for key in self.client.iter_bucket_keys(Bucket, Prefix):
+            if Delimiter:
+                rest = key[len(Prefix):]
+                if Delimiter in rest:
+                    common = Prefix + rest.split(Delimiter)[0] + Delimiter
+                    if common in seen_prefixes:
+                        continue
+                    seen_prefixes.add(common)
+                    page.append(('CommonPrefixes', {'Prefix': common}))
+                else:
+                    page.append(('Contents', {'Key': key}))
+            else:
+                page.append(('Contents', {'Key': key}))
+
+            if len(page) == page_size:
+                pages += 1
+                yield self.client.page(page)
+                page = []
+
+        # An empty listing is still one page
+        if page or not pages:
+            yield self.client.page(page)
+
+class FakeS3Client:
+    """
+        buckets: dict of the SAFE folder names by bucket name. A SAFE name may start with a year pseudofolder, e.g. '2018/S2A_...'
+        corrupt: Keys whose get_object gives broken XML, to test the handling of malformed SAFEs
+    """
+
+    def __init__(self, buckets, corrupt=()):
+        self.buckets = {bucket: sorted(safes) for bucket, safes in buckets.items()}
+        self.corrupt = set(corrupt)
+        self.calls = Counter()
+        self.bytes_sent = 0
+
+    def iter_bucket_keys(self, bucket, prefix=''):
+        safes = self.buckets[bucket]
+        # Only the SAFEs that can have keys under the prefix are generated, they are next to each other in the sorted list
+        for safe in safes[bisect.bisect_left(safes, prefix.rstrip('/')):]:
+            folder, _, name = safe.rpartition('/')
+            safeprefix = f"{folder}/{name}/" if folder else f"{name}/"
+            if not (safeprefix.startswith(prefix) or prefix.startswith(safeprefix)):
+                if safeprefix > prefix:
+                    break
+                continue
+            for key in safe_keys(name, f"{folder}/" if folder else ''):
+                if key.startswith(prefix):
+                    yield key
+
+    def page(self, entries):
+        self.calls['list_objects_v2'] += 1
+        page = {}
+        for kind, entry in entries:
+            page.setdefault(kind, []).append(entry)
+        return page
+
+    def get_paginator(self, operation):
+        return FakePaginator(self)
+
+    def list_buckets(self):
+        self.calls['list_buckets'] += 1
+        return {'Buckets': [{'Name': bucket} for bucket in self.buckets]}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self.calls['get_object'] += 1
+        name = Key.split('/')[-1]
+        if Key in self.corrupt:
+            content = '<broken'
+        elif name == 'MTD_TL.xml':
+            content = tile_metadata(safe_tile_pattern.search(Key).group(1))
+        elif name == 'MTD_MSIL2A.xml':
+            content = product_metadata(next(part for part in Key.split('/') if part.endswith('.SAFE')))
+        else:
+            content = ''
+        data = content.encode()
+        response = {}
+        if 'Range' in kwargs:
+            # 'bytes=0-16383', the end may be past the end of the object like in S3
+            start, end = (int(x) for x in kwargs['Range'].split('=')[1].split('-'))
+            response['ContentRange'] = f"bytes {start}-{min(end, len(data) - 1)}/{len(data)}"
+            data = data[start:end + 1]
+        self.bytes_sent += len(data)
+        return {**response, 'Body': FakeBody(data)}
+
+    def requests(self):
+        return sum(self.calls.values())
+
+class FakeDataset:
+    """
+        Opened image with the bounds, transform and shape rasterio would give
+    """
+
+    def __init__(self, uri):
+        name = uri.split('/')[-1]
+        match = image_pattern.search(name)
+        tile, resolution = match.group(1), match.group(2)
+        _, left, bottom = tiles[tile]
+        size = tile_shapes[resolution] if resolution else 343
+        pixel = 109800 / size
+        self.bounds = (left, bottom, left + 109800, bottom + 109800)
+        self.transform = [pixel, 0.0, float(left), 0.0, -pixel, float(bottom + 109800), 0.0, 0.0, 1.0]
+        self.shape = (size, size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class FakeRasterio:
+    """
+        Stand-in for the rasterio module where the scripts open images from URLs
+    """
+
+    def __init__(self):
+        self.calls = Counter()
+
+    def open(self, uri, *args, **kwargs):
+        self.calls['open'] += 1
+        return FakeDataset(uri)
+
+class FakeResponse:
+
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.headers = {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise OSError(f"HTTP {self.status_code}")
+
+    def json(self):
+        return {}
+
+class FakeSession:
+    """
+        Stand-in for requests.Session, the requests of every session made are counted in FakeSession.calls
+    """
+
+    calls = Counter()
+
+    def __init__(self):
+        self.auth = None
+        self.headers = {}
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def request(self, method, url, **kwargs):
+        FakeSession.calls[method] += 1
+        return FakeResponse(201 if method == 'POST' else 200)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
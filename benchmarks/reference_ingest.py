@@ -0,0 +1,575 @@
+"""
+    Frozen reference of the item and payload code as it was before the optimizations, for bench_equivalence.py.
+
+    The functions are copied unchanged from the baseline versions of sentinel_to_stac.py (make_item, add_asset,
+    transform_crs, get_crs and the metadata functions), update_allas_sentinel.py (json_convert of dicts) and
+    stac_to_geoserver.py (json_convert of files, here json_convert_file). reference_safe_item() is the loop body of
+    the baseline create_collection() for one SAFE. Do not optimize this file, it is what the fast paths are compared to.
+"""
+import re
+import json
+import rasterio
+import pystac as stac
+from datetime import datetime
+from xml.dom import minidom
+from shapely.geometry import box, mapping
+from pystac.extensions.eo import EOExtension, Band
+from pystac.extensions.projection import ProjectionExtension
+from rasterio.warp import transform_bounds
+from rasterio.crs import CRS
+
+# Band information in Band objects and as a dict
+s2_bands = {
+    "B01": {
+        "band": Band.create(name='B01', description='Coastal: 400 - 450 nm', common_name='coastal')
+    },
+    "B02": {
+        "band": Band.create(name='B02', description='Blue: 450 - 500 nm', common_name='blue')
+    },
+    "B03": {
+        "band": Band.create(name='B03', description='Green: 500 - 600 nm', common_name='green'),
+    },
+    "B04": {
+        "band": Band.create(name='B04', description='Red: 600 - 700 nm', common_name='red'),
+    },
+    "B05": {
+        "band": Band.create(name='B05', description='Vegetation Red Edge: 705 nm', common_name='rededge')
+    },
+    "B06": {
+        "band": Band.create(name='B06', description='Vegetation Red Edge: 740 nm', common_name='rededge')
+    },
+    "B07": {
+        "band": Band.create(name='B07', description='Vegetation Red Edge: 783 nm', common_name='rededge')
+    },
+    "B08": {
+        "band": Band.create(name='B08', description='Near-IR: 750 - 1000 nm', common_name='nir')
+    },
+    "B8A": {
+        "band": Band.create(name='B8A', description='Near-IR: 750 - 900 nm', common_name='nir08')
+    },
+    "B09": {
+        "band": Band.create(name='B09', description='Water vapour: 850 - 1050 nm', common_name='nir09')
+    },
+    "B10": {
+        "band": Band.create(name='B10', description='SWIR-Cirrus: 1350 - 1400 nm', common_name='cirrus')
+    },
+    "B11": {
+        "band": Band.create(name='B11', description='SWIR16: 1550 - 1750 nm', common_name='swir16')
+    },
+    "B12": {
+        "band": Band.create(name='B12', description='SWIR22: 2100 - 2300 nm', common_name='swir22')
+    }
+}
+
+s2_bands_as_dict = {
+    "B01": {
+        'name': 'B01', 
+        'description': 'Coastal: 400 - 450 nm', 
+        'common_name': 'coastal'
+    },
+    "B02": {
+        'name': 'B02', 
+        'description': 'Blue: 450 - 500 nm', 
+        'common_name': 'blue'
+    },
+    "B03": {
+        'name': 'B03', 
+        'description': 'Green: 500 - 600 nm', 
+        'common_name': 'green'
+    },
+    "B04": {
+        'name': 'B04', 
+        'description': 'Red: 600 - 700 nm', 
+        'common_name': 'red'
+    },
+    "B05": {
+        'name': 'B05', 
+        'description': 'Vegetation Red Edge: 705 nm', 
+        'common_name': 'rededge'
+    },
+    "B06": {
+        'name': 'B06', 
+        'description': 'Vegetation Red Edge: 740 nm', 
+        'common_name': 'rededge'
+    },
+    "B07": {
+        'name': 'B07', 
+        'description': 'Vegetation Red Edge: 783 nm',
+        'common_name': 'rededge'
+    },
+    "B08": {
+        'name': 'B08', 
+        'description': 'Near-IR: 750 - 1000 nm',
+        'common_name': 'nir'
+    },
+    "B8A": {
+        'name': 'B8A', 
+        'description': 'Near-IR: 750 - 900 nm',
+        'common_name': 'nir08'
+    },
+    "B09": {
+        'name': 'B09', 
+        'description': 'Water vapour: 850 - 1050 nm',
+        'common_name': 'nir09'
+    },
+    "B10": {
+        'name': 'B10', 
+        'description': 'SWIR-Cirrus: 1350 - 1400 nm',
+        'common_name': 'cirrus'
+    },
+    "B11": {
+        'name': 'B11', 
+        'description': 'SWIR16: 1550 - 1750 nm',
+        'common_name': 'swir16'
+    },
+    "B12": {
+        'name': 'B12', 
+        'description': 'SWIR22: 2100 - 2300 nm',
+        'common_name': 'swir22'
+    }
+}
+
+def make_item(uri, metadatacontent, crs_metadata):
+    """
+        uri: The SAFE ID of the item (currently URL of the image, could be changes to SAFE later)
+        metadatacontent: Metadata dict got from get_metadata_content()
+        crs_metadata: CRS metadata dict containing CRS string and shapes for different resolutions from get_crs()
+    """
+
+    params = {}
+
+    if re.match(r".+?\d{4}/S2(A|B)", uri):
+        params['id'] = uri.split("/")[5].split('.')[0]
+    else:
+        params['id'] = uri.split('/')[4].split('.')[0]
+    
+    with rasterio.open(uri) as src:
+        item_transform = src.transform
+        # as lat,lon
+        params['bbox'] = transform_crs(list([src.bounds]),crs_metadata['CRS'])
+        params['geometry'] = mapping(box(*params['bbox']))
+            
+    mtddict = get_metadata_from_xml(metadatacontent)
+
+    # Datetime from filename
+    params['datetime'] = datetime.strptime(uri.split('_')[2][0:8], '%Y%m%d')
+
+    params['properties'] = {}
+    params['properties']['eo:cloud_cover'] = mtddict['cc_perc']
+    #following are not part of eo extension
+    params['properties']['data_cover'] = mtddict['data_cover']
+    params['properties']['orbit'] = mtddict['orbit']
+    params['properties']['baseline'] = mtddict['baseline']
+    # following are part of general metadata hardcoded for Sentinel-2
+    params['properties']['platform'] = 'sentinel-2'
+    params['properties']['instrument'] = 'msi'
+    params['properties']['constellation'] = 'sentinel-2'
+    params['properties']['mission'] = 'copernicus'
+    params['properties']['proj:epsg'] = int(crs_metadata['CRS'])
+    params['properties']['gsd'] = 10
+
+    stacItem = stac.Item(**params)
+
+    # Adding the EO and Projecting Extensions to the item
+    eo_ext = EOExtension.ext(stacItem, add_if_missing=True)
+    eo_ext.bands = [s2_bands[band]['band'] for band in s2_bands]
+    proj_ext = ProjectionExtension.ext(stacItem, add_if_missing=True)
+    proj_ext.apply(epsg = int(crs_metadata['CRS']), transform = item_transform)
+
+    print('Item made:', params['id'])
+
+    return stacItem
+
+def add_asset(stacItem, uri, crsmetadata=None, thumbnail=False):
+
+    """ 
+        Adds an asset to the STAC Item based on whether the asset is a thumbnail or an image. 
+        stacItem: stac.Item object
+        uri: Image URL
+        crsmetadata: CRS metadata dict containing CRS string and shapes for different resolutions from get_crs()
+        thumbnail: Boolean value indicating if the asset is a thumbnail or not
+    """
+
+    if uri.endswith('geo.jp2'): # A few special cases where there were differently named image files that contained different metadata
+        splitter = uri.split('/')[-1].split('.')[0].split('_')
+        full_bandname = '_'.join(splitter[-3:-1])
+        band = splitter[-3]
+        resolution = splitter[-2].split('m')[0]
+        asset = stac.Asset(
+            href=uri,
+            title=full_bandname,
+            media_type=stac.MediaType.JPEG2000,
+            roles=["data"],
+            extra_fields= {
+                'gsd': int(resolution),
+                'proj:shape': crsmetadata['shapes'][resolution],
+            }
+        )
+        if band in s2_bands:
+            asset_eo_ext = EOExtension.ext(asset)
+            asset_eo_ext.bands = [s2_bands[band]["band"]]
+        stacItem.add_asset(
+            key=full_bandname,
+            asset=asset
+        )
+        
+        return stacItem
+
+    if not thumbnail: # If the asset is a standard image
+        splitter = uri.split('/')[-1].split('.')[0].split('_')
+        full_bandname = '_'.join(splitter[-2:])
+        band = splitter[-2]
+        resolution = splitter[-1].split('m')[0]
+        asset = stac.Asset(
+                href=uri,
+                title=full_bandname,
+                media_type=stac.MediaType.JPEG2000,
+                roles=["data"],
+                extra_fields= {
+                    'gsd': int(resolution),
+                    'proj:shape': crsmetadata['shapes'][resolution],
+                }
+        )
+        if band in s2_bands:
+            asset_eo_ext = EOExtension.ext(asset)
+            asset_eo_ext.bands = [s2_bands[band]["band"]]
+        stacItem.add_asset(
+            key=full_bandname, 
+            asset=asset
+        )
+
+    else: # If the asset is a thumbnail image
+        with rasterio.open(uri) as src:
+            shape = src.shape
+
+        full_bandname = uri.split('/')[-1].split('_')[-1].split('.')[0]
+        asset = stac.Asset(
+                href=uri,
+                title="Thumbnail image",
+                media_type=stac.MediaType.JPEG2000,
+                roles=["thumbnail"],
+                extra_fields= {
+                    'proj:shape': shape,
+                }
+        )
+        stacItem.add_asset(
+            key="thumbnail", 
+            asset=asset
+        )
+
+    return stacItem
+
+def transform_crs(bounds, crs_string):
+    
+    """
+        bounds: Bounding Box bounds from rasterio.open()
+        crs_string: CRS string from CRS metadata
+    """
+
+    # Transform the bounds according to the CRS
+    crs = CRS.from_epsg(4326)
+    safecrs = CRS.from_epsg(int(crs_string))
+    bounds_transformed = transform_bounds(safecrs, crs, bounds[0][0], bounds[0][1], bounds[0][2], bounds[0][3])
+        
+    return bounds_transformed
+
+def get_crs(crsmetadatafile):
+
+    """
+        crsmetadatafile: The decoded content from the SAFEs CRS metadatafile
+    """
+
+    # Get CRS and resolution sizes from crsmetadatafile
+    with minidom.parseString(crsmetadatafile) as doc:
+        crsstring = get_xml_content(doc, 'HORIZONTAL_CS_CODE').split(':')[-1]
+        sizes = doc.getElementsByTagName('Size')
+        crsmetadata = { 
+            'CRS': crsstring,
+            'shapes': {}
+        }
+        for size in sizes:
+            resolution = size.getAttribute('resolution')
+            crsmetadata['shapes'][resolution] = (int(get_xml_content(size, 'NROWS')), int(get_xml_content(size, 'NCOLS')))
+
+    return crsmetadata
+
+def get_xml_content(doc, tagname):
+
+    """
+        doc: Parsed xml metadata file
+        tagname: The wanted tag to be searched from the xml file
+    """
+
+    content = doc.getElementsByTagName(tagname)[0].firstChild.data
+    return content
+
+def get_metadata_content(bucket, metadatafile, client):
+
+    """
+        bucket: The bucket where the metadatafile is located
+        metadatafile: The name of the metadatafile
+        client: boto3.client
+    """
+
+    obj = client.get_object(Bucket = bucket, Key = metadatafile)['Body']
+    metadatacontent = obj.read().decode()
+    return metadatacontent
+
+def get_metadata_from_xml(metadatabody):
+
+    """
+        metadatabody: The metadata content from boto3.client get_object call
+    """
+
+    with minidom.parseString(str(metadatabody)) as doc:
+        metadatadict = {}
+        metadatadict['cc_perc'] = int(float(get_xml_content(doc,'Cloud_Coverage_Assessment')))
+        metadatadict['data_cover'] = 100 - int(float(get_xml_content(doc,'NODATA_PIXEL_PERCENTAGE')))
+        metadatadict['start_time'] = get_xml_content(doc,'PRODUCT_START_TIME')
+        metadatadict['end_time'] = get_xml_content(doc,'PRODUCT_STOP_TIME')
+        metadatadict['orbit'] = get_xml_content(doc,'SENSING_ORBIT_NUMBER')
+        metadatadict['baseline'] = get_xml_content(doc,'PROCESSING_BASELINE')
+
+    return metadatadict
+
+def json_convert(content):
+
+    """ 
+    A function to map the STAC dictionaries into the GeoServer database layout.
+    There are different json layouts for Collections and Items. The function checks if the dictionary is of type "Collection",
+    or of type "Feature" (=Item).
+
+    content - STAC dictionary from where the modified JSON will be made
+    """
+    
+    if content["type"] == "Collection":
+
+        new_json = {
+            "type": "Feature",
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [
+                    [
+                        [
+                            content["extent"]["spatial"]["bbox"][0][2],
+                            content["extent"]["spatial"]["bbox"][0][1]
+                        ],
+                        [
+                            content["extent"]["spatial"]["bbox"][0][2],
+                            content["extent"]["spatial"]["bbox"][0][3]
+                        ],
+                        [
+                            content["extent"]["spatial"]["bbox"][0][0],
+                            content["extent"]["spatial"]["bbox"][0][3]
+                        ],
+                        [
+                            content["extent"]["spatial"]["bbox"][0][0],
+                            content["extent"]["spatial"]["bbox"][0][1]
+                        ],
+                        [
+                            content["extent"]["spatial"]["bbox"][0][2],
+                            content["extent"]["spatial"]["bbox"][0][1]
+                        ]
+
+                    ]
+                ]
+            },
+            "properties": {
+                "name": content["id"],
+                "title": content["title"],
+                "eo:identifier": content["id"],
+                "description": content["description"],
+                "timeStart": content["extent"]["temporal"]["interval"][0][0],
+                "timeEnd": content["extent"]["temporal"]["interval"][0][1],
+                "primary": True,
+                "license": content["license"],
+                # "providers": content["providers"],
+                "licenseLink": None,
+                # "summaries": content["summaries"],
+                "queryables": [
+                    "eo:identifier",
+                    "eo:cloud_cover"
+                ]
+            }
+        }
+
+        if "assets" in content:
+            new_json["properties"]["assets"] = content["assets"]
+
+        for link in content["links"]:
+            if link["rel"] == "license":
+                new_json["properties"]["licenseLink"] = { #New License URL link
+                    "href": link["href"],
+                    "rel": "license",
+                    "type": "application/json"
+                }
+            elif link["rel"] == "derived_from":
+                derived_href = link["href"]
+                new_json["properties"]["derivedFrom"] = {
+                    "href": derived_href,
+                    "rel": "derived_from",
+                    "type": "application/json"
+                }
+
+    if content["type"] == "Feature":
+
+        new_json = {
+            "type": "Feature",
+            "geometry": content["geometry"],
+            "properties": {
+                "eop:identifier": content["id"],
+                "eop:parentIdentifier": content["collection"],
+                "timeStart": content["properties"]["datetime"],
+                "timeEnd": content["properties"]["datetime"],
+                # "eop:resolution": content["gsd"],
+                "opt:cloudCover": int(content["properties"]["eo:cloud_cover"]),
+                "crs": content["properties"]["proj:epsg"],
+                # "projTransform": content["properties"]["proj:transform"],
+                # "thumbnailURL": content["links"]["thumbnail"]["href"],
+                "assets": content["assets"]
+            }
+        }
+
+    return new_json
+
+def json_convert_file(jsonfile):
+
+    """
+        jsonfile: json file in dict format
+        
+        A function to map the Sentinel-2 STAC jsonfiles into the GeoServer database layout.
+        There are different json layouts for Collections and Items. The function checks if the jsonfile is of type "Collection",
+        or of type "Feature" (=Item). A number of properties are hardcoded into Sentinel-2 metadata as these are not collected in the STAC jsonfiles.
+    """
+
+    with open(jsonfile) as f:
+        content = json.load(f)
+    
+    if content["type"] == "Collection":
+
+        new_json = {
+            "type": "Feature",
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [
+                    [
+                        [
+                            content["extent"]["spatial"]["bbox"][0][2],
+                            content["extent"]["spatial"]["bbox"][0][1]
+                        ],
+                        [
+                            content["extent"]["spatial"]["bbox"][0][2],
+                            content["extent"]["spatial"]["bbox"][0][3]
+                        ],
+                        [
+                            content["extent"]["spatial"]["bbox"][0][0],
+                            content["extent"]["spatial"]["bbox"][0][3]
+                        ],
+                        [
+                            content["extent"]["spatial"]["bbox"][0][0],
+                            content["extent"]["spatial"]["bbox"][0][1]
+                        ],
+                        [
+                            content["extent"]["spatial"]["bbox"][0][2],
+                            content["extent"]["spatial"]["bbox"][0][1]
+                        ]
+
+                    ]
+                ]
+            },
+            "properties": {
+                "name": content["id"],
+                "title": content["title"],
+                "eo:identifier": content["id"],
+                "description": content["description"],
+                "timeStart": content["extent"]["temporal"]["interval"][0][0],
+                "timeEnd": content["extent"]["temporal"]["interval"][0][1],
+                "primary": True,
+                "license": content["license"],
+                "licenseLink" : {
+                    "href" : "https://sentinel.esa.int/documents/247904/690755/Sentinel_Data_Legal_Notice",
+                    "rel" : "license",
+                    "type" : "application/json"
+                },
+                "assets": content["assets"],
+                "licenseLink": None,
+                "summaries": content["summaries"],
+                "queryables": [
+                    "eo:identifier",
+                    "eo:cloud_cover"
+                ]
+            }
+        }
+
+        if "assets" in content:
+            new_json["properties"]["assets"] = content["assets"]
+
+        for link in content["links"]:
+            if link["rel"] == "license":
+                new_json["properties"]["licenseLink"] = {
+                    "href": link["href"],
+                    "rel": "license",
+                    "type": "application/json"
+                } # New License URL link
+
+    if content["type"] == "Feature":
+
+        new_json = {
+            "type": "Feature",
+            "geometry": content["geometry"],
+            "properties": {
+                "eop:identifier": content["id"],
+                "eop:parentIdentifier": content["collection"],
+                "timeStart": content["properties"]["datetime"],
+                "timeEnd": content["properties"]["datetime"],
+                "opt:cloudCover": int(content["properties"]["eo:cloud_cover"]),
+                "crs": content["properties"]["proj:epsg"],
+                #"thumbnailURL": content["assets"]["thumbnail"]["href"],
+                "assets": content["assets"]
+            }
+        }
+
+    return json.loads(json.dumps(new_json))
+
+def reference_safe_item(client, bucket, safe, safecontents):
+    """
+        client: boto3.client
+        bucket: The bucket where the SAFE is located
+        safe: SAFE folder name
+        safecontents: list of the keys of the SAFE
+        -> stac.Item made like the baseline create_collection() made it, None if the SAFE was skipped
+    """
+
+    bucketcontent_jp2 = [x for x in safecontents if x.endswith('jp2')]
+    bucketcontent_mtd = [x for x in safecontents if x.endswith('MTD_MSIL2A.xml')]
+    bucketcontent_crs = [x for x in safecontents if x.endswith('MTD_TL.xml')]
+
+    # SAFE-filename without the subfix
+    safename = str(safe.split('.')[0])
+
+    metadatafile = ''.join((x for x in bucketcontent_mtd if safename in x))
+    crsmetadatafile = ''.join((x for x in bucketcontent_crs if safename in x))
+    if not metadatafile or not crsmetadatafile:
+        return None
+    safecrs_metadata = get_crs(get_metadata_content(bucket, crsmetadatafile, client))
+
+    jp2images = [x for x in bucketcontent_jp2 if safe in x and 'IMG_DATA' in x]
+    if not jp2images:
+        return None
+    previewimage = next(x for x in bucketcontent_jp2 if safe in x and 'PVI' in x)
+
+    metadatacontent = get_metadata_content(bucket, metadatafile, client)
+
+    item = None
+    for image in jp2images:
+
+        uri = 'https://a3s.fi/' + bucket + '/' + image
+
+        if item is None:
+            item = make_item(uri, metadatacontent, safecrs_metadata)
+            # add preview image
+            add_asset(item, 'https://a3s.fi/' + bucket + '/' + previewimage, None, True)
+        else:
+            add_asset(item, uri, safecrs_metadata)
+
+    return item
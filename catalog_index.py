@@ -0,0 +1,289 @@
+"""
+    SQLite index of the items of the catalog, for answering questions about the catalog without reading its files.
+
+    The build writes the index next to the catalog (Sentinel2-index.sqlite by default) with a row per item:
+
+        items       id, datetime, cloud cover, relative orbit, MGRS tile, mission, baseline, bbox and the path of
+                    the item file in the catalog folder, with B-tree indexes on datetime, cloud_cover, orbit and tile
+        items_bbox  R-tree of the bboxes, joined to items by rowid
+        metadata    what the items are the items of: source 'build' with the catalog folder, or source 'geoserver'
+                    with the host and collection of the published items
+
+    The index is written into a temporary file that replaces the old one when it is complete. The update can use an
+    index of its own instead of reading all the items from GeoServer to find out which SAFEs are already published,
+    and adds the items it uploads into it. The index of the build lists the built items, not the published ones, so
+    the update does not take it (see check_published_index()).
+
+    `s2stac query` answers e.g. "which SAFEs cover this area with under 20% cloud in June 2023":
+
+        $ python s2stac.py query --bbox 24.5 60.1 25.2 60.4 --since 2023-06-01 --until 2023-06-30 --max-cloud 20
+"""
+import os
+import json
+import sqlite3
+from safe_names import parse_safe_name
+
+schema = """
+CREATE TABLE IF NOT EXISTS items (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    datetime TEXT,
+    cloud_cover REAL,
+    orbit INTEGER,
+    tile TEXT,
+    mission TEXT,
+    baseline TEXT,
+    bbox TEXT,
+    href TEXT
+);
+CREATE INDEX IF NOT EXISTS items_datetime ON items (datetime);
+CREATE INDEX IF NOT EXISTS items_cloud_cover ON items (cloud_cover);
+CREATE INDEX IF NOT EXISTS items_orbit ON items (orbit);
+CREATE INDEX IF NOT EXISTS items_tile ON items (tile);
+CREATE VIRTUAL TABLE IF NOT EXISTS items_bbox USING rtree (rowid, min_lon, max_lon, min_lat, max_lat);
+CREATE TABLE IF NOT EXISTS metadata (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+columns = ['id', 'datetime', 'cloud_cover', 'orbit', 'tile', 'mission', 'baseline', 'bbox', 'href']
+
+def open_index(path):
+    """
+        path: SQLite file of the index, made if it does not exist
+        -> sqlite3.Connection with the tables of the index
+    """
+
+    connection = sqlite3.connect(path)
+    connection.executescript(schema)
+
+    return connection
+
+def index_row(item_dict, href=None):
+    """
+        item_dict: STAC Item dict
+        href: Path of the item file in the catalog folder, None for items that are not in a local catalog
+        -> tuple of the values of the columns
+    """
+
+    properties = item_dict['properties']
+    safe = parse_safe_name(item_dict['id'])
+    orbit = properties.get('orbit')
+
+    return (
+        item_dict['id'],
+        properties.get('datetime'),
+        properties.get('eo:cloud_cover'),
+        int(orbit) if orbit is not None else (safe.orbit if safe else None),
+        safe.tile if safe else None,
+        safe.mission if safe else None,
+        properties.get('baseline'),
+        json.dumps(item_dict['bbox']),
+        href,
+    )
+
+def add_items(connection, rows):
+    """
+        connection: sqlite3.Connection from open_index()
+        rows: Iterable of index_row() tuples, an item already in the index is replaced
+    """
+
+    with connection:
+        for row in rows:
+            connection.execute(
+                f"INSERT INTO items ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                f"ON CONFLICT (id) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in columns[1:])}",
+                row,
+            )
+            rowid = connection.execute("SELECT rowid FROM items WHERE id = ?", (row[0],)).fetchone()[0]
+            min_lon, min_lat, max_lon, max_lat = json.loads(row[columns.index('bbox')])
+            connection.execute("INSERT OR REPLACE INTO items_bbox VALUES (?, ?, ?, ?, ?)", (rowid, min_lon, max_lon, min_lat, max_lat))
+
+def write_metadata(connection, metadata):
+    """
+        connection: sqlite3.Connection from open_index()
+        metadata: dict of the metadata values, e.g. {'source': 'build'}
+    """
+
+    with connection:
+        connection.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?)", [(key, str(value)) for key, value in metadata.items()])
+
+def read_metadata(path):
+    """
+        path: SQLite file of the index
+        -> dict of the metadata values, empty for an index written before the metadata was added
+    """
+
+    connection = open_index(path)
+    metadata = dict(connection.execute("SELECT key, value FROM metadata"))
+    connection.close()
+
+    return metadata
+
+def published_metadata(host, collection):
+    """
+        host: URL of the GeoServer the items are published in
+        collection: Id of the collection
+        -> metadata dict of an index of the published items
+    """
+
+    return {'source': 'geoserver', 'host': host.rstrip('/'), 'collection': collection}
+
+def check_published_index(path, host, collection):
+    """
+        path: SQLite file of the index
+        host: URL of the GeoServer the update publishes to
+        collection: Id of the collection the update publishes to
+
+        Raises ValueError if the index is not an index of the items published in the collection of the host, e.g. the
+        index written by the build, which would make the update skip every SAFE that was built but not published.
+    """
+
+    metadata = read_metadata(path)
+    if metadata == published_metadata(host, collection):
+        return
+
+    if metadata.get('source') == 'build':
+        made = f"by the build of {metadata.get('catalog')}"
+    elif metadata.get('source') == 'geoserver':
+        made = f"for collection {metadata.get('collection')} of {metadata.get('host')}"
+    else:
+        made = "without a record of where its items are from"
+    raise ValueError(
+        f"The index {path} was made {made}, not for the published items of collection {collection} of {host}. "
+        f"Give another --index file or use --rebuild-index to make it again from GeoServer"
+    )
+
+def write_index(path, items, catalog_dir, gzip_items=False):
+    """
+        path: SQLite file of the index, nothing is written if None
+        items: list of the stac.Items of the catalog with their self hrefs set
+        catalog_dir: Folder of the catalog, the hrefs are saved relative to it
+        gzip_items: If True, the item files were written gzipped
+
+        The index is written into <path>.tmp first and moved in place when it is complete.
+    """
+
+    if not path:
+        return
+
+    temporary = f"{path}.tmp"
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    connection = open_index(temporary)
+    write_metadata(connection, {'source': 'build', 'catalog': catalog_dir})
+    suffix = '.gz' if gzip_items else ''
+    add_items(connection, (
+        index_row(item.to_dict(include_self_link=False, transform_hrefs=False), os.path.relpath(item.get_self_href(), catalog_dir) + suffix)
+        for item in items
+    ))
+    connection.close()
+    os.replace(temporary, path)
+
+    print(f'Index of {len(items)} items saved to {path}')
+
+def index_item_dicts(path, item_dicts, metadata=None):
+    """
+        path: SQLite file of the index, nothing is done if None
+        item_dicts: list of STAC Item dicts to add to the index, e.g. the items uploaded by the update
+        metadata: Optional dict of the metadata of a new index, e.g. from published_metadata()
+    """
+
+    if not path:
+        return
+
+    connection = open_index(path)
+    if metadata:
+        write_metadata(connection, metadata)
+    add_items(connection, (index_row(item_dict) for item_dict in item_dicts))
+    connection.close()
+
+def indexed_ids(path):
+    """
+        path: SQLite file of the index
+        -> set of the ids of the items in the index
+    """
+
+    connection = open_index(path)
+    ids = {row[0] for row in connection.execute("SELECT id FROM items")}
+    connection.close()
+
+    return ids
+
+def query_index(connection, bbox=None, since=None, until=None, tiles=None, max_cloud=None, orbits=None, ids=None, limit=None):
+    """
+        connection: sqlite3.Connection from open_index()
+        bbox: (min_lon, min_lat, max_lon, max_lat), only the items whose bbox intersects it
+        since: datetime.date, only the items sensed on or after it
+        until: datetime.date, only the items sensed on or before it
+        tiles: list of MGRS tiles
+        max_cloud: Largest cloud cover percentage
+        orbits: list of relative orbits
+        ids: list of item ids
+        limit: Largest number of rows returned
+        -> list of dicts of the matching items by datetime, newest first
+    """
+
+    tables = "items"
+    conditions = []
+    values = []
+    if bbox:
+        tables += " JOIN items_bbox ON items_bbox.rowid = items.rowid"
+        conditions.append("items_bbox.max_lon >= ? AND items_bbox.min_lon <= ? AND items_bbox.max_lat >= ? AND items_bbox.min_lat <= ?")
+        values += [bbox[0], bbox[2], bbox[1], bbox[3]]
+    if since:
+        conditions.append("items.datetime >= ?")
+        values.append(since.isoformat())
+    if until:
+        # The datetimes have a time part, so everything before the next day is included
+        conditions.append("items.datetime < date(?, '+1 day')")
+        values.append(until.isoformat())
+    for column, allowed in (('tile', tiles), ('orbit', orbits), ('id', ids)):
+        if allowed:
+            conditions.append(f"items.{column} IN ({', '.join('?' * len(allowed))})")
+            values += list(allowed)
+    if max_cloud is not None:
+        conditions.append("items.cloud_cover <= ?")
+        values.append(max_cloud)
+
+    sql = f"SELECT {', '.join(f'items.{c}' for c in columns)} FROM {tables}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY items.datetime DESC"
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+
+    return [
+        {**dict(zip(columns, row)), 'bbox': json.loads(row[columns.index('bbox')])}
+        for row in connection.execute(sql, values)
+    ]
+
+def main(args):
+    """
+        args: Parsed arguments of the query command from s2stac.build_parser()
+    """
+
+    if not os.path.exists(args.index):
+        raise SystemExit(f"No index at {args.index}, it is written by `s2stac build`")
+
+    connection = open_index(args.index)
+    tiles = [tile.upper().lstrip('T') for tile in args.tiles] if args.tiles else None
+    rows = query_index(connection, args.bbox, args.since, args.until, tiles, args.max_cloud, args.orbit, args.id, args.limit)
+    connection.close()
+
+    if args.format == 'json':
+        print(json.dumps(rows, indent=2))
+    elif args.format == 'ids':
+        for row in rows:
+            print(row['id'])
+    else:
+        for row in rows:
+            cloud = f"{row['cloud_cover']:.1f}" if row['cloud_cover'] is not None else '-'
+            print(f"{row['id']}  {row['datetime']}  cloud {cloud}  {row['href'] or ''}")
+        print(f"{len(rows)} items")
+
+if __name__ == "__main__":
+
+    from s2stac import parse_args, call_main
+    call_main(main, parse_args("query"))
@@ -0,0 +1,50 @@
+"""
+    Layout of the catalog saved by sentinel_to_stac.py.
+
+        flat        Sentinel2-tileless/sentinel2-l2a/<id>/<id>.json, all the item links are in collection.json
+        tile        Sentinel2-tileless/sentinel2-l2a/<tile>/<id>/<id>.json
+        year        Sentinel2-tileless/sentinel2-l2a/<year>/<id>/<id>.json
+        tile-year   Sentinel2-tileless/sentinel2-l2a/<tile>/<year>/<id>/<id>.json
+
+    With the tile and year layouts the items are in small sub-catalogs (<tile>/catalog.json, <tile>/<year>/catalog.json),
+    so collection.json only links to the sub-catalogs and each sub-catalog can be read and written on its own.
+"""
+from pathlib import Path
+from stac_io import read_json
+
+layouts = ['flat', 'tile', 'year', 'tile-year']
+
+def layout_levels(layout, tile, year):
+    """
+        layout: One of the layouts
+        tile: MGRS tile of the item, e.g. '34VEM', None if unknown
+        year: Year of the item
+        -> list of (catalog id, folder, description) of the sub-catalogs from the collection down to the item
+    """
+
+    tile = tile or 'unknown-tile'
+    levels = []
+    if layout in ('tile', 'tile-year'):
+        levels.append((tile, tile, f'Sentinel-2 L2A items of the MGRS tile {tile}'))
+    if layout == 'year':
+        levels.append((str(year), str(year), f'Sentinel-2 L2A items of {year}'))
+    if layout == 'tile-year':
+        levels.append((f'{tile}-{year}', str(year), f'Sentinel-2 L2A items of the MGRS tile {tile} from {year}'))
+
+    return levels
+
+def iter_item_files(stac_file):
+    """
+        stac_file: Path of a collection.json or catalog.json
+        -> yields the paths of the item files linked from the file and from its sub-catalogs, for every layout.
+            The item files may be gzipped (see stac_io)
+    """
+
+    stac_file = Path(stac_file)
+    content = read_json(stac_file)
+
+    for link in content["links"]:
+        if link["rel"] == "item":
+            yield stac_file.parent / link["href"]
+        elif link["rel"] == "child":
+            yield from iter_item_files(stac_file.parent / link["href"])
@@ -0,0 +1,151 @@
+"""
+    Writing the catalog to disk in parallel and swapping it into place atomically.
+
+    pystac's Catalog.save() writes the JSON files one at a time, and a run that dies in the middle leaves a
+    half written catalog behind. Here the files are serialized and written by a thread pool into a new version
+    folder next to the catalog (e.g. Sentinel2-tileless.20240101T120000-3f2a9c1e), and when everything is written the
+    catalog path is switched to it by replacing a symlink, which is atomic. Readers such as stac_to_geoserver.py
+    see either the old or the new catalog, never a partial one.
+
+    The previous versions are not removed at the switch, as readers may still be walking them. The newest
+    keep_versions versions are kept and the older ones are removed when the next version is switched in.
+
+    The catalog must have the hrefs of all its objects set under the catalog folder (see make_root_catalog()).
+"""
+import os
+import re
+import time
+import uuid
+import errno
+import ctypes
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pystac import CatalogType, Item
+from stac_io import write_json, compact_item, gzip_links
+
+# Number of catalog versions kept, the one the catalog path points to included
+keep_versions = 3
+
+def write_catalog(rootcatalog, workers=16, compact=False, gzip_items=False):
+    """
+        rootcatalog: pystac.Catalog whose self href is <catalog folder>/catalog.json
+        workers: Number of threads writing the files
+        compact: If True, the items are written without the band definitions and all files without indentation (see stac_io)
+        gzip_items: If True, the item files are written gzipped as <id>.json.gz
+        -> Path of the version folder the catalog was written into
+
+        The catalog is written as CatalogType.RELATIVE_PUBLISHED, like with rootcatalog.save().
+    """
+
+    catalog_dir = os.path.dirname(rootcatalog.get_self_href())
+    # The random suffix keeps apart the versions of runs started in the same second
+    version_dir = f"{catalog_dir}.{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    rootcatalog.catalog_type = CatalogType.RELATIVE_PUBLISHED
+
+    def write(stacobject):
+        # Only the root catalog has a self link in a relative published catalog
+        content = stacobject.to_dict(include_self_link=stacobject is rootcatalog)
+        path = os.path.join(version_dir, os.path.relpath(stacobject.get_self_href(), catalog_dir))
+        if isinstance(stacobject, Item):
+            if compact:
+                content = compact_item(content)
+            if gzip_items:
+                path += '.gz'
+        elif gzip_items:
+            content = gzip_links(content)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_json(content, path, compact)
+
+    catalogs = []
+    with ThreadPoolExecutor(workers) as pool:
+        # Items are written while the walk goes on, the catalogs after them
+        writes = []
+        for catalog, _, items in rootcatalog.walk():
+            catalogs.append(catalog)
+            writes.extend(pool.submit(write, item) for item in items)
+        for future in writes:
+            future.result()
+        for future in [pool.submit(write, catalog) for catalog in catalogs]:
+            future.result()
+
+    swap_into_place(version_dir, catalog_dir)
+    print(f'Catalog written to {version_dir} and linked to {catalog_dir}')
+
+    return version_dir
+
+def swap_into_place(version_dir, catalog_dir, keep=keep_versions):
+    """
+        version_dir: Folder where the new version of the catalog was written
+        catalog_dir: Path the readers use, made into a symlink pointing to version_dir
+        keep: Number of the newest versions kept, the older ones are removed after the switch
+    """
+
+    link = catalog_dir + '.link'
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(version_dir), link)
+
+    if os.path.isdir(catalog_dir) and not os.path.islink(catalog_dir):
+        # A catalog saved as a plain folder (by catalog.save()) is kept as the oldest version. Where the folder and the
+        # link can be exchanged in one step there is no moment without a catalog, elsewhere the two renames follow each other
+        previous = catalog_dir + '.previous'
+        if exchange_paths(link, catalog_dir):
+            os.rename(link, previous)
+        else:
+            os.rename(catalog_dir, previous)
+            os.replace(link, catalog_dir)
+    else:
+        # Replacing the symlink with rename is atomic
+        os.replace(link, catalog_dir)
+
+    prune_versions(catalog_dir, keep)
+
+def exchange_paths(first, second):
+    """
+        first: Path
+        second: Path
+        -> True if the two paths were exchanged atomically, False if the system cannot do it (not Linux, old C library or filesystem)
+    """
+
+    try:
+        renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (OSError, AttributeError):
+        return False
+
+    # AT_FDCWD, RENAME_EXCHANGE
+    at_fdcwd = -100
+    rename_exchange = 2
+    if renameat2(at_fdcwd, os.fsencode(first), at_fdcwd, os.fsencode(second), rename_exchange) != 0:
+        error = ctypes.get_errno()
+        if error in (errno.EINVAL, errno.ENOSYS, errno.ENOTSUP):
+            return False
+        raise OSError(error, os.strerror(error), first)
+
+    return True
+
+def catalog_versions(catalog_dir):
+    """
+        catalog_dir: Path the readers use
+        -> list of the version folders of the catalog, newest first
+    """
+
+    parent = os.path.dirname(os.path.abspath(catalog_dir))
+    name = re.compile(re.escape(os.path.basename(catalog_dir)) + r"\.(\d{8}T\d{6}(-[0-9a-f]+)?|previous)$")
+    versions = [
+        os.path.join(parent, x) for x in os.listdir(parent)
+        if name.match(x) and os.path.isdir(os.path.join(parent, x)) and not os.path.islink(os.path.join(parent, x))
+    ]
+
+    # The plain folder of catalog.save() is the oldest, the rest sort by their timestamps
+    return sorted(versions, key=lambda x: (not x.endswith('.previous'), os.path.basename(x)), reverse=True)
+
+def prune_versions(catalog_dir, keep=keep_versions):
+    """
+        catalog_dir: Path the readers use, a symlink to the current version
+        keep: Number of the newest versions kept, the current version is always kept
+    """
+
+    current = os.path.realpath(catalog_dir)
+    for version in catalog_versions(catalog_dir)[keep:]:
+        if os.path.realpath(version) != current:
+            shutil.rmtree(version)
@@ -0,0 +1,114 @@
+"""
+    Checkpoints of the catalog build, so that a run that stops in the middle can be continued from where it was.
+
+    When every SAFE of a bucket has been processed, the items made from them are written into
+    <checkpoint_dir>/buckets/<bucket>.json together with the SAFEs of the bucket that failed:
+
+        {"bucket": "Sentinel2-...", "count": 120, "items": [...], "quarantine": [{"safe": "S2A_...", "error": "..."}]}
+
+    A SAFE that fails (e.g. has no preview image or a tag is missing from its metadata) is put in the quarantine of its
+    bucket instead of stopping the run, and all the quarantined SAFEs are listed in <checkpoint_dir>/quarantine.json.
+    With --resume the buckets that have a checkpoint are not read again. To retry the quarantined SAFEs of a bucket,
+    remove its checkpoint file.
+"""
+import os
+import json
+import shutil
+from pathlib import Path
+
+def bucket_checkpoint(checkpoint_dir, bucket):
+    """
+        checkpoint_dir: Folder of the checkpoints
+        bucket: Name of the bucket
+        -> Path of the checkpoint file of the bucket
+    """
+
+    return Path(checkpoint_dir) / "buckets" / f"{bucket}.json"
+
+def clear_checkpoints(checkpoint_dir):
+    """
+        checkpoint_dir: Folder of the checkpoints, nothing is done if None
+
+        Removes the checkpoints of an earlier run, so a run that is not resumed does not leave old buckets behind.
+    """
+
+    if checkpoint_dir and os.path.isdir(checkpoint_dir):
+        shutil.rmtree(checkpoint_dir)
+
+def write_bucket_checkpoint(checkpoint_dir, bucket, item_dicts, quarantine):
+    """
+        checkpoint_dir: Folder of the checkpoints, nothing is written if None
+        bucket: Name of the bucket that was finished
+        item_dicts: list of the STAC Item dicts made from the bucket
+        quarantine: list of {"safe", "error"} dicts of the SAFEs of the bucket that failed
+
+        The file is written to a temporary file and renamed, so a checkpoint is either complete or missing.
+    """
+
+    if not checkpoint_dir:
+        return
+
+    path = bucket_checkpoint(checkpoint_dir, bucket)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    checkpoint = {
+        "bucket": bucket,
+        "count": len(item_dicts),
+        "items": item_dicts,
+        "quarantine": quarantine,
+    }
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(f"{path}.tmp", path)
+
+def load_checkpoints(checkpoint_dir):
+    """
+        checkpoint_dir: Folder of the checkpoints, None for no checkpoints
+        -> dict of the checkpoint dicts by bucket name
+    """
+
+    if not checkpoint_dir:
+        return {}
+
+    checkpoints = {}
+    for path in sorted((Path(checkpoint_dir) / "buckets").glob("*.json")):
+        with open(path) as f:
+            checkpoint = json.load(f)
+        checkpoints[checkpoint["bucket"]] = checkpoint
+
+    return checkpoints
+
+def write_quarantine(checkpoint_dir):
+    """
+        checkpoint_dir: Folder of the checkpoints, nothing is written if None
+        -> list of {"bucket", "safe", "error"} dicts of all the quarantined SAFEs
+
+        Collects the quarantines of all the bucket checkpoints into quarantine.json.
+    """
+
+    if not checkpoint_dir:
+        return []
+
+    quarantine = [
+        {"bucket": bucket, **entry}
+        for bucket, checkpoint in load_checkpoints(checkpoint_dir).items()
+        for entry in checkpoint["quarantine"]
+    ]
+    save_quarantine(Path(checkpoint_dir) / "quarantine.json", quarantine)
+
+    return quarantine
+
+def save_quarantine(path, quarantine):
+    """
+        path: JSON file of the quarantined SAFEs, nothing is written if None
+        quarantine: list of {"bucket", "safe", "error"} dicts
+
+        Also used by the update, which has no checkpoints. The folder is made if no bucket checkpoint has made it,
+        e.g. for a shard that got no buckets.
+    """
+
+    if not path:
+        return
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(quarantine, f, indent=2)
@@ -0,0 +1,95 @@
+"""
+    Executor that keeps the network I/O in threads and runs the CPU-bound work in processes.
+
+    Fetching a SAFE is mostly waiting for Allas, so it is done in a thread pool. Parsing the XML, transforming
+    the bounds and making the pystac objects holds the GIL, so the records from the fetches are sent to a
+    process pool where every core can work on them. The records and results passed between the two must be
+    picklable (plain dicts, strings, tuples), and the build function must be a module level function.
+
+    The process pool is made once with make_process_pool() and passed to every run_hybrid() call, so the workers are
+    started only once per run. They are started by a forkserver (spawn where there is none) instead of forking the
+    calling process, whose I/O and listing threads may hold locks that would stay locked in the forked children.
+"""
+import multiprocessing
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+def make_process_pool(cpu_workers=None):
+    """
+        cpu_workers: Number of processes, os.cpu_count() if None
+        -> ProcessPoolExecutor for run_hybrid(), or with 0 a context manager giving None to build in the calling process
+    """
+
+    if cpu_workers == 0:
+        return nullcontext()
+
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+    return ProcessPoolExecutor(cpu_workers, mp_context=context)
+
+def run_hybrid(fetch, build, jobs, io_workers=8, processes=None, max_pending=None, on_error=None):
+    """
+        fetch: Function run in the I/O threads as fetch(*job), returns a record for build or None to skip the job
+        build: Module level function run in the worker processes as build(record)
+        jobs: Iterable of argument tuples for fetch, consumed only as fast as the work progresses
+        io_workers: Number of threads for fetch
+        processes: ProcessPoolExecutor from make_process_pool() for build, None to run build in the calling thread
+        max_pending: Maximum number of jobs fetched or built at the same time, 4 * io_workers if None
+        on_error: Optional function called as on_error(job, exception) when fetch or build of a job fails, the job is then
+            skipped. Without it the first failure is raised
+        -> yields (job, result of build) in the order the jobs are finished, with None for the jobs fetch skipped
+    """
+
+    jobs = iter(jobs)
+    max_pending = max_pending or 4 * io_workers
+
+    with ThreadPoolExecutor(io_workers) as threads:
+
+        # The job of every future, for on_error
+        fetching = {}
+        building = {}
+        more_jobs = True
+
+        while True:
+            # Keep the pools busy, but only take as many jobs as can be worked on so the memory use stays bounded
+            while more_jobs and len(fetching) + len(building) < max_pending:
+                job = next(jobs, None)
+                if job is None:
+                    more_jobs = False
+                    break
+                fetching[threads.submit(fetch, *job)] = job
+
+            if not fetching and not building:
+                break
+
+            done, _ = wait([*fetching, *building], return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in fetching:
+                    job = fetching.pop(future)
+                    try:
+                        record = future.result()
+                        if record is None:
+                            yield job, None
+                            continue
+                        if processes is None:
+                            result = build(record)
+                        else:
+                            building[processes.submit(build, record)] = job
+                            continue
+                    except Exception as error:
+                        if on_error is None:
+                            raise
+                        on_error(job, error)
+                        continue
+                    yield job, result
+                else:
+                    job = building.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as error:
+                        if on_error is None:
+                            raise
+                        on_error(job, error)
+                        continue
+                    yield job, result
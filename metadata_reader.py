@@ -0,0 +1,101 @@
+"""
+    Reading only the start of the metadata XML files of the SAFEs from Allas.
+
+    The scripts need a handful of tags from MTD_TL.xml and MTD_MSIL2A.xml. HORIZONTAL_CS_CODE and the Size elements
+    are in Tile_Geocoding near the start of MTD_TL.xml, which is followed by the sun and viewing angle grids that make
+    up most of the file. read_xml_head() fetches a file with growing Range requests (16 kB, 32 kB, ...), feeds the bytes
+    to an incremental parser and stops as soon as all the wanted elements have ended. The part read is returned
+    with the elements still open closed, so it is a well-formed document for get_crs() and get_metadata_from_xml().
+
+    If a file ends before all the wanted elements were seen, the whole file is returned and the parsing fails where
+    it did before.
+"""
+from xml.parsers import expat
+
+# Tile_Geocoding ends after HORIZONTAL_CS_CODE, the Size elements of every resolution and the Geoposition elements
+crs_tags = ('HORIZONTAL_CS_CODE', 'Tile_Geocoding')
+product_tags = (
+    'PRODUCT_START_TIME', 'PRODUCT_STOP_TIME', 'PROCESSING_BASELINE', 'SENSING_ORBIT_NUMBER',
+    'Cloud_Coverage_Assessment', 'NODATA_PIXEL_PERCENTAGE',
+)
+
+# First Range request, MTD_TL.xml has Tile_Geocoding in its first few kB, MTD_MSIL2A.xml has the cloud cover near its end
+crs_range = 16384
+product_range = 131072
+
+class XmlHead:
+    """
+        tags: Names of the elements that are needed, without namespace prefixes
+
+        Incremental parser that finds where the last of the wanted elements ends.
+    """
+
+    def __init__(self, tags):
+        self.missing = set(tags)
+        self.data = bytearray()
+        self.open = []
+        self.end = None
+        self.closing = None
+        self.parser = expat.ParserCreate()
+        self.parser.StartElementHandler = self.start_element
+        self.parser.EndElementHandler = self.end_element
+
+    def start_element(self, name, attributes):
+        self.open.append(name)
+
+    def end_element(self, name):
+        self.open.pop()
+        self.missing.discard(name.split(':')[-1])
+        if not self.missing and self.end is None:
+            # The byte index is at the start of the end tag, the head ends after its '>'
+            self.end = self.data.index(b'>', self.parser.CurrentByteIndex) + 1
+            self.closing = ''.join(f'</{x}>' for x in reversed(self.open))
+
+    def feed(self, chunk):
+        """
+            chunk: Next bytes of the document
+            -> True when all the wanted elements have ended
+        """
+
+        self.data += chunk
+        if self.end is None:
+            self.parser.Parse(bytes(chunk), False)
+
+        return self.end is not None
+
+    def head(self):
+        """
+            -> the document up to the end of the last wanted element with the open elements closed, the whole document if not all were found
+        """
+
+        if self.end is None:
+            return self.data.decode()
+
+        return self.data[:self.end].decode() + self.closing
+
+def read_xml_head(client, bucket, key, tags, first_range=crs_range):
+    """
+        client: boto3.client
+        bucket: The bucket where the file is located
+        key: Key of the XML file
+        tags: Names of the elements that are needed from the file
+        first_range: Number of bytes asked in the first Range request, every further request asks for twice as many
+        -> the start of the document with all the wanted elements as str (see XmlHead.head())
+    """
+
+    xmlhead = XmlHead(tags)
+    offset = 0
+    size = first_range
+    while True:
+        response = client.get_object(Bucket=bucket, Key=key, Range=f'bytes={offset}-{offset + size - 1}')
+        chunk = response['Body'].read()
+        if xmlhead.feed(chunk):
+            break
+        # 'bytes 0-16383/612345', without a Content-Range the whole file was sent
+        content_range = response.get('ContentRange')
+        if not content_range or offset + len(chunk) >= int(content_range.split('/')[-1]) or not chunk:
+            break
+        offset += len(chunk)
+        size *= 2
+
+    return xmlhead.head()
@@ -8,27 +8,68 @@ import time
 from pathlib import Path
 from urllib.parse import urljoin
 from requests.auth import HTTPBasicAuth
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from catalog_layout import iter_item_files
+from stac_io import read_json
+from sync_state import content_hash, load_sync_state, save_sync_state, plan_sync
+from stage_profiler import stage
 
 workingdir = Path(__file__).parent
 sentinel_data = (workingdir / "Sentinel2-tileless" / "sentinel2_full_test")
 
 app_host = "http://86.50.229.158:8082/"
 
-def post_or_put(url: str, data: dict):
-    """Post or put data to url."""
-    r = requests.post(url, json=data)
+def make_session(workers: int) -> requests.Session:
+    """Session with a connection pool large enough for the workers."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def post_or_put(url: str, data: dict, session=requests):
+    """Post or put data to url.
+
+    Returns when the object is stored, raises requests.HTTPError otherwise.
+    """
+    r = session.post(url, json=data)
     if r.status_code == 409:
         new_url = url if data["type"] == "Collection" else url + f"/{data['id']}"
         # Exists, so update
-        r = requests.put(new_url, json=data)
-        # Unchanged may throw a 404
-        if not r.status_code == 404:
-            r.raise_for_status()
-    else:
-        r.raise_for_status()
+        r = session.put(new_url, json=data)
+        # Unchanged may throw a 404, the object is there as it is
+        if r.status_code == 404:
+            return
+    r.raise_for_status()
+
+
+def post_bulk(url: str, items: list, session=requests) -> bool:
+    """Upsert a batch of items to the bulk items endpoint of the Transactions extension.
+
+    Returns False if the API does not have the endpoint.
+    """
+    r = session.post(url, json={"items": {item["id"]: item for item in items}, "method": "upsert"})
+    if r.status_code in (404, 405):
+        return False
+    r.raise_for_status()
+    return True
 
 
-def ingest_sentinel_data(app_host: str = app_host, data_dir: Path = sentinel_data):
+def load_items(files: list) -> list:
+    """Read the item json files, plain or gzipped."""
+    return [read_json(file) for file in files]
+
+
+def ingest_sentinel_data(app_host: str = app_host, data_dir: Path = sentinel_data, batch_size: int = 500, workers: int = 8, bulk: bool = True, sync_state: str = "sync_state.json"):
+    """Upload the items of the collection in data_dir to STAC FastAPI.
+
+    The items are sent in batches of batch_size to the bulk items endpoint by workers threads.
+    If bulk is False or the API has no bulk endpoint, every item is upserted on its own, also by workers threads.
+    Only the items that are new or changed since they were last sent with the sync_state file are uploaded,
+    with sync_state None every item is.
+    """
 
     with open(data_dir / "collection.json") as f:
         rootcollection = json.load(f)
@@ -36,26 +77,87 @@ def ingest_sentinel_data(app_host: str = app_host, data_dir: Path = sentinel_dat
     # post_or_put(urljoin(app_host, "/collections"), rootcollection)
     # print("Collection POSTed")
 
-    items = [x['href'] for x in rootcollection["links"] if x["rel"] == "item"]
+    items_url = urljoin(app_host, f"collections/{rootcollection['id']}/items")
+    bulk_url = urljoin(app_host, f"collections/{rootcollection['id']}/bulk_items")
 
-    print("POSTing items: ", end='')
+    files = {}
+    hashes = {}
+    with stage('convert'):
+        for file in iter_item_files(data_dir / "collection.json"):
+            payload = load_items([file])[0]
+            files[payload["id"]] = file
+            hashes[payload["id"]] = content_hash(payload)
 
-    for i, item in enumerate(items):
-        if i < (len(items) / 2):
-            continue
-            with open(data_dir / item) as f:
-                payload = json.load(f)
-                post_or_put(urljoin(app_host, f"collections/{rootcollection['id']}/items"), payload)
-                print("/", end='', flush=True)
-        else:
-            # continue
-            with open(data_dir / item) as f:
-                payload = json.load(f)
-                post_or_put(urljoin(app_host, f"collections/{rootcollection['id']}/items"), payload)
+    sent = load_sync_state(sync_state, items_url)
+    new, changed, unchanged = plan_sync(hashes, sent)
+    print(f"New items: {len(new)}, changed items: {len(changed)}, unchanged items: {len(unchanged)}")
+
+    items = [files[x] for x in new + changed]
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    session = make_session(workers)
+
+    def mark_sent(payloads: list):
+        for payload in payloads:
+            sent[payload["id"]] = hashes[payload["id"]]
+
+    print(f"POSTing {len(items)} items: ", end='', flush=True)
+
+    with stage('upload'):
+        try:
+            if bulk and batches:
+                # The first batch tells if the API supports bulk loading
+                payloads = load_items(batches[0])
+                bulk = post_bulk(bulk_url, payloads, session)
+                if bulk:
+                    mark_sent(payloads)
+
+            if bulk:
                 print("/", end='', flush=True)
-    
-    print("",flush=True)
+
+                def send_batch(batch: list):
+                    payloads = load_items(batch)
+                    if post_bulk(bulk_url, payloads, session):
+                        mark_sent(payloads)
+                    else:
+                        # The bulk endpoint went away after the first batch, the batch is sent item by item
+                        for payload in payloads:
+                            post_or_put(items_url, payload, session)
+                            mark_sent([payload])
+                    print("/", end='', flush=True)
+
+                with ThreadPoolExecutor(workers) as pool:
+                    list(pool.map(send_batch, batches[1:]))
+            else:
+
+                def send_item(item: Path):
+                    payloads = load_items([item])
+                    # Only the items the API stored are recorded as sent, post_or_put raises for the others
+                    post_or_put(items_url, payloads[0], session)
+                    mark_sent(payloads)
+                    print("/", end='', flush=True)
+
+                with ThreadPoolExecutor(workers) as pool:
+                    list(pool.map(send_item, items))
+        finally:
+            # What was sent is saved also when the upload fails, so the next run continues from there
+            save_sync_state(sync_state, items_url, sent)
+
+    print("", flush=True)
+
+
+def main(args):
+    """Ingest the local catalog with the arguments of the ingest-fastapi command."""
+    ingest_sentinel_data(
+        app_host=args.host or app_host,
+        data_dir=Path(args.data_dir) if args.data_dir else sentinel_data,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        bulk=not args.no_bulk,
+        sync_state=args.sync_state or None
+    )
+
 
 if __name__ == "__main__":
 
-    ingest_sentinel_data()
\ No newline at end of file
+    from s2stac import parse_args, call_main
+    call_main(main, parse_args("ingest-fastapi"))
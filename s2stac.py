@@ -0,0 +1,289 @@
+"""
+    Command line entry point for the Sentinel-2 to STAC scripts.
+
+        s2stac build            Create the STAC catalog from the Allas buckets (sentinel_to_stac.py)
+        s2stac merge            Combine the outputs of `s2stac build --shard i/N` runs into one catalog (sentinel_to_stac.py)
+        s2stac update           Add new SAFEs from Allas to the GeoServer catalog (update_allas_sentinel.py)
+        s2stac publish          Upload the local catalog to GeoServer (stac_to_geoserver.py)
+        s2stac ingest-fastapi   Upload the local catalog to STAC FastAPI (post_stac.py)
+        s2stac query            Find items from the SQLite index of the catalog (catalog_index.py)
+
+    Only argparse is imported at start up. The module of a subcommand, and with it boto3, pystac, rasterio etc.,
+    is imported when the subcommand is run, so commands that only need requests do not pay for the rest.
+"""
+import sys
+import argparse
+import importlib
+from datetime import date
+
+# Subcommand -> module that implements it. Every module has a main(args) function taking the parsed arguments
+COMMANDS = {
+    "build": "sentinel_to_stac",
+    "merge": "sentinel_to_stac",
+    "update": "update_allas_sentinel",
+    "publish": "stac_to_geoserver",
+    "ingest-fastapi": "post_stac",
+    "query": "catalog_index",
+}
+
+def shard_type(text):
+    """
+        text: Shard given as 'i/N', e.g. '0/8'. Slurm array jobs can use $SLURM_ARRAY_TASK_ID/$SLURM_ARRAY_TASK_COUNT
+        -> (index, count) tuple
+    """
+
+    index, _, count = text.partition("/")
+    if not (index.isdigit() and count.isdigit() and int(index) < int(count)):
+        raise argparse.ArgumentTypeError(f"shard must be given as i/N with 0 <= i < N, not {text!r}")
+
+    return int(index), int(count)
+
+def date_type(text):
+    """
+        text: Date given as YYYY-MM-DD
+        -> datetime.date
+    """
+
+    try:
+        return date.fromisoformat(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"date must be given as YYYY-MM-DD, not {text!r}")
+
+def add_filter_arguments(parser):
+    """
+        parser: Subparser of a command that reads the SAFEs from the Allas buckets
+
+        The filters are applied to the SAFE names while listing (see safe_names.safe_filter).
+    """
+
+    parser.add_argument("--since", type=date_type, default=None, help="Only the SAFEs sensed on or after the date (YYYY-MM-DD)")
+    parser.add_argument("--until", type=date_type, default=None, help="Only the SAFEs sensed on or before the date (YYYY-MM-DD)")
+    parser.add_argument("--tiles", nargs="+", default=None, metavar="TILE", help="Only the SAFEs of the MGRS tiles, e.g. 34VEM 35VLG")
+    parser.add_argument("--missions", nargs="+", default=None, metavar="MISSION", help="Only the SAFEs of the missions, e.g. S2A")
+    parser.add_argument("--baseline", nargs="+", default=None, metavar="BASELINE",
+        help="Only the SAFEs of the processing baselines, e.g. N0208 or 02.08")
+
+def add_listing_arguments(parser):
+    """
+        parser: Subparser of a command that reads the SAFEs from the Allas buckets
+    """
+
+    parser.add_argument("--discovery", choices=["auto", "delimiter", "list"], default="auto",
+        help="Find the SAFEs with delimiter listing of the bucket prefixes or by listing every key of the bucket. "
+             "auto (default) uses the delimiter listing when SAFEs are skipped, e.g. the published ones or by the filters")
+    parser.add_argument("--list-workers", type=int, default=4,
+        help="Number of threads listing one bucket, by year pseudofolders and SAFEs or by key partitions like S2A_ and S2B_")
+    parser.add_argument("--bucket-precedence", nargs="+", default=None, metavar="PATTERN",
+        help="Regular expressions of bucket names, a SAFE found in several buckets is taken from the bucket matching the earliest one. "
+             "By default it is taken from the first bucket: the Sentinel2 buckets, then 2000290_buckets.csv, then 2001106_buckets.csv")
+    parser.add_argument("--keep-duplicates", action="store_true",
+        help="Read a SAFE found in several buckets from all of them and merge their assets into one item, like before")
+    parser.add_argument("--tile-cache", type=str, default="tile_geometry_cache.json",
+        help="JSON file where the geometries of the MGRS tiles are cached between runs, empty to not use the cache")
+    add_filter_arguments(parser)
+
+def add_sync_arguments(parser):
+    """
+        parser: Subparser of a command that uploads the local catalog
+    """
+
+    parser.add_argument("--sync-state", type=str, default="sync_state.json",
+        help="JSON file of the hashes of the items sent earlier, only new and changed items are sent. Empty to send every item")
+
+def add_output_arguments(parser):
+    """
+        parser: Subparser of a command that writes the local catalog
+    """
+
+    parser.add_argument("--compact", action="store_true",
+        help="Leave the band definitions out of the items (they are in the collection summaries) and write the JSON without indentation")
+    parser.add_argument("--gzip", action="store_true", help="Write the item files gzipped as <id>.json.gz")
+
+def add_index_argument(parser, default, help):
+    """
+        parser: Subparser of a command that uses the SQLite index of the catalog
+        default: Default path of the index
+        help: Help text of the option
+    """
+
+    parser.add_argument("--index", type=str, default=default, help=help)
+
+def add_upload_arguments(parser):
+    """
+        parser: Subparser of a command that uploads items to GeoServer
+    """
+
+    parser.add_argument("--max-workers", type=int, default=16,
+        help="Maximum number of uploads in flight, the actual number adapts to how fast GeoServer answers")
+    parser.add_argument("--latency-target", type=float, default=2.0,
+        help="Seconds, slower GeoServer responses lower the number of uploads in flight")
+    parser.add_argument("--gzip-upload", action="store_true",
+        help="Send the request bodies gzipped with Content-Encoding: gzip, GeoServer must be set up to accept them")
+
+def add_archive_arguments(parser):
+    """
+        parser: Subparser of any command
+    """
+
+    archive = parser.add_mutually_exclusive_group()
+    archive.add_argument("--record", type=str, default=None, metavar="DIR",
+        help="Record the S3, image and HTTP traffic of the run into the folder (see traffic_archive.py)")
+    archive.add_argument("--replay", type=str, default=None, metavar="DIR",
+        help="Answer the S3, image and HTTP requests from a folder written with --record, without network")
+    parser.add_argument("--replay-latency", action="store_true", help="With --replay, wait as long as every recorded request took")
+
+def add_profile_arguments(parser):
+    """
+        parser: Subparser of any command
+    """
+
+    parser.add_argument("--profile", type=str, default=None, metavar="DIR",
+        help="Profile the stages of the run and write the collapsed stacks and a summary into the folder (see stage_profiler.py)")
+    parser.add_argument("--profile-mode", choices=["sample", "cprofile"], default="sample",
+        help="Sample the stacks of all threads (default), or trace every call of the main thread with cProfile")
+    parser.add_argument("--profile-interval", type=float, default=0.005, help="Seconds between the stack samples")
+    parser.add_argument("--profile-top", type=int, default=25, help="Number of the hottest functions listed per stage")
+
+def build_parser():
+    """
+        -> argparse.ArgumentParser with one subparser per command
+    """
+
+    parser = argparse.ArgumentParser(prog="s2stac", description="Sentinel-2 L2A data in Allas to STAC and GeoServer")
+    subparsers = parser.add_subparsers(dest="command", metavar="command", required=True)
+
+    build = subparsers.add_parser("build", help="Create the STAC catalog from the Allas buckets")
+    add_listing_arguments(build)
+    build.add_argument("--shard", type=shard_type, default=None,
+        help="Process only the shard i of N (0-based) and write it into --shard-dir for `s2stac merge`")
+    build.add_argument("--shard-by", choices=["bucket", "safe"], default="bucket",
+        help="Split the shards by bucket names (default) or by SAFE names")
+    build.add_argument("--shard-dir", type=str, default="Sentinel2-shards", help="Folder of the shard outputs")
+    build.add_argument("--layout", choices=["flat", "tile", "year", "tile-year"], default="flat",
+        help="Save the items directly under the collection (default) or in sub-catalogs by MGRS tile and/or year")
+    build.add_argument("--write-workers", type=int, default=16, help="Number of threads writing the catalog files")
+    add_output_arguments(build)
+    add_index_argument(build, "Sentinel2-index.sqlite", "SQLite file where the index of the items is written for `s2stac query`, empty to not write it")
+    build.add_argument("--io-workers", type=int, default=8, help="Number of threads fetching the SAFEs from Allas")
+    build.add_argument("--processes", type=int, default=None,
+        help="Number of processes building the items, all cores by default and 0 to build in the main process")
+    build.add_argument("--checkpoint-dir", type=str, default="Sentinel2-checkpoints",
+        help="Folder where the items of every finished bucket and the quarantined SAFEs are saved, empty to not save them")
+    build.add_argument("--resume", action="store_true",
+        help="Continue a run that stopped: the buckets with a checkpoint are not read again. Use the same options as in the run")
+
+    merge = subparsers.add_parser("merge", help="Combine the shard outputs of `build --shard` into one catalog")
+    merge.add_argument("--shard-dir", type=str, default="Sentinel2-shards", help="Folder of the shard outputs")
+    merge.add_argument("--layout", choices=["flat", "tile", "year", "tile-year"], default="flat",
+        help="Save the items directly under the collection (default) or in sub-catalogs by MGRS tile and/or year")
+    merge.add_argument("--write-workers", type=int, default=16, help="Number of threads writing the catalog files")
+    add_output_arguments(merge)
+    add_index_argument(merge, "Sentinel2-index.sqlite", "SQLite file where the index of the items is written for `s2stac query`, empty to not write it")
+
+    update = subparsers.add_parser("update", help="Add new SAFEs from Allas to the GeoServer catalog")
+    update.add_argument("--host", type=str, help="Hostname of the selected STAC API", required=True)
+    add_listing_arguments(update)
+    add_upload_arguments(update)
+    update.add_argument("--compact", action="store_true",
+        help="Leave the band definitions out of the uploaded items, they are in the collection summaries")
+    add_index_argument(update, None,
+        "SQLite index of the published items, read instead of listing the items from GeoServer and updated with the uploaded items")
+    update.add_argument("--rebuild-index", action="store_true",
+        help="Make the --index again from the items listed from GeoServer, e.g. after items were published with `publish`")
+    update.add_argument("--schedule", choices=["newest", "oldest", "listing"], default="newest",
+        help="Order in which the new SAFEs of all the buckets are made and uploaded: latest sensing time first (default), earliest first or as listed")
+    update.add_argument("--quarantine", type=str, default="update_quarantine.json",
+        help="JSON file where the SAFEs that failed are listed, empty to not write it")
+    update.add_argument("--watch", action="store_true", help="Keep running and publish new SAFEs as they appear in the buckets")
+    update.add_argument("--interval", type=float, default=600, help="Seconds between the polls of the buckets with --watch")
+    update.add_argument("--max-failures", type=int, default=3,
+        help="With --watch, a SAFE that fails in this many polls is quarantined into --quarantine and not tried again")
+    update.add_argument("--watch-state", type=str, default="watch_state.json",
+        help="JSON file of the listing state of the buckets with --watch, empty to keep it only in memory")
+    update.add_argument("--latency-log", type=str, default="watch_latency.csv",
+        help="CSV file where the arrival-to-visible latency of every SAFE published with --watch is appended, empty to not log")
+
+    publish = subparsers.add_parser("publish", help="Upload the local catalog to GeoServer")
+    publish.add_argument("--host", type=str, help="Hostname of the selected STAC API", required=True)
+    add_sync_arguments(publish)
+    add_upload_arguments(publish)
+
+    ingest = subparsers.add_parser("ingest-fastapi", help="Upload the local catalog to STAC FastAPI")
+    ingest.add_argument("--host", type=str, help="Address of the STAC FastAPI", default=None)
+    ingest.add_argument("--data-dir", type=str, help="Folder of the collection.json to upload", default=None)
+    ingest.add_argument("--batch-size", type=int, default=500, help="Number of items in one bulk request")
+    ingest.add_argument("--workers", type=int, default=8, help="Number of requests sent at the same time")
+    ingest.add_argument("--no-bulk", action="store_true", help="Upsert every item on its own instead of using the bulk items endpoint")
+    add_sync_arguments(ingest)
+
+    query = subparsers.add_parser("query", help="Find items from the SQLite index written by `s2stac build`")
+    add_index_argument(query, "Sentinel2-index.sqlite", "SQLite index of the catalog")
+    query.add_argument("--bbox", type=float, nargs=4, default=None, metavar=("MIN_LON", "MIN_LAT", "MAX_LON", "MAX_LAT"),
+        help="Only the items whose bbox intersects the area")
+    query.add_argument("--since", type=date_type, default=None, help="Only the items sensed on or after the date (YYYY-MM-DD)")
+    query.add_argument("--until", type=date_type, default=None, help="Only the items sensed on or before the date (YYYY-MM-DD)")
+    query.add_argument("--tiles", nargs="+", default=None, metavar="TILE", help="Only the items of the MGRS tiles, e.g. 34VEM 35VLG")
+    query.add_argument("--max-cloud", type=float, default=None, help="Only the items with at most this cloud cover percentage")
+    query.add_argument("--orbit", type=int, nargs="+", default=None, help="Only the items of the relative orbits")
+    query.add_argument("--id", nargs="+", default=None, help="Only the items with the ids, e.g. to check if a SAFE is in the catalog")
+    query.add_argument("--limit", type=int, default=None, help="Largest number of items listed")
+    query.add_argument("--format", choices=["text", "json", "ids"], default="text", help="Output as lines of text (default), JSON or ids only")
+
+    for subparser in subparsers.choices.values():
+        add_archive_arguments(subparser)
+        add_profile_arguments(subparser)
+
+    return parser
+
+def parse_args(command, argv=None):
+    """
+        command: Name of the subcommand the arguments are parsed for
+        argv: List of arguments without the subcommand, sys.argv[1:] if not given
+
+        Used by the scripts themselves so that running e.g. `python sentinel_to_stac.py` takes the same arguments as `s2stac build`.
+    """
+
+    if argv is None:
+        argv = sys.argv[1:]
+
+    return build_parser().parse_args([command, *argv])
+
+def run(args):
+    """
+        args: Parsed arguments from build_parser()
+    """
+
+    # The import is done here so only the dependencies of the selected command are loaded
+    module = importlib.import_module(COMMANDS[args.command])
+    return call_main(module.main, args)
+
+def call_main(main, args):
+    """
+        main: main(args) function of a script
+        args: Parsed arguments from build_parser()
+        -> what main returns
+
+        The traffic of the run is recorded or replayed around main if --record or --replay was given, and the run is
+        profiled if --profile was given.
+    """
+
+    from traffic_archive import start_archive
+    from stage_profiler import start_profiler, stop_profiler
+
+    archive = start_archive(args)
+    profiler = start_profiler(args)
+    try:
+        return main(args)
+    finally:
+        stop_profiler(profiler)
+        if archive:
+            archive.uninstall()
+
+def main(argv=None):
+
+    args = build_parser().parse_args(argv)
+    run(args)
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,365 @@
+"""
+    Finding the SAFEs and their files from the Allas buckets.
+
+    The buckets either have the SAFEs at the top level (S2A_MSIL2A_....SAFE/...) or inside pseudofolders
+    of the years (2018/S2A_MSIL2A_....SAFE/...). With the delimiter discovery the SAFEs are found from the
+    common prefixes of the bucket and only the SAFEs that are going to be processed have their keys listed.
+
+    Everything is streamed: the SAFEs are handed on as the listing pages arrive, so the processing starts with
+    the first page and only the keys of one SAFE are kept in memory at a time.
+
+    A single list_objects_v2 pagination of a large bucket takes minutes, as every page waits for the one before it.
+    With list_workers > 1 the listing of one bucket is split between threads: the delimiter discovery lists the year
+    pseudofolders and the keys of the next SAFEs at the same time, and the full listing splits the bucket into
+    partitions by the part of the keys before the first underscore (e.g. 'S2A_', 'S2B_' or '2018/S2A_', found with
+    one delimiter query), lists them concurrently and merges them back into one stream in key order.
+"""
+import re
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Pseudofolder of a year, e.g. '2018/'
+year_folder = re.compile(r"\d{4}/")
+
+def iter_objects(client, bucket, prefix=''):
+    """
+        client: boto3.client
+        bucket: Name of the bucket
+        prefix: Only the objects whose keys start with the prefix are listed
+        -> yields the object dicts of list_objects_v2 (Key, LastModified, Size, ...) in lexicographic order of the keys
+    """
+
+    # Usual list_objects_v2 function only lists up to 1000 objects so pagination is needed when using a client
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        yield from page.get('Contents', [])
+
+def iter_keys(client, bucket, prefix=''):
+    """
+        client: boto3.client
+        bucket: Name of the bucket
+        prefix: Only the keys starting with the prefix are listed
+        -> yields the keys in lexicographic order, page by page as they are listed
+    """
+
+    for x in iter_objects(client, bucket, prefix):
+        yield x['Key']
+
+def list_keys(client, bucket, prefix=''):
+    """
+        client: boto3.client
+        bucket: Name of the bucket
+        prefix: Only the keys starting with the prefix are listed
+        -> list of keys
+    """
+
+    return list(iter_keys(client, bucket, prefix))
+
+def list_prefixes(client, bucket, prefix=''):
+    """
+        client: boto3.client
+        bucket: Name of the bucket
+        prefix: Prefix of the pseudofolder whose subfolders are listed
+        -> list of the common prefixes one level below the prefix, e.g. ['2018/', '2019/']
+    """
+
+    paginator = client.get_paginator('list_objects_v2')
+    pages = paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/')
+    return [x['Prefix'] for page in pages for x in page.get('CommonPrefixes', [])]
+
+def ordered_map(function, items, workers):
+    """
+        function: Function taking one item
+        items: Iterable of items
+        workers: Number of threads calling the function, 1 to call it in the calling thread
+        -> yields function(item) for the items in their order, with at most 2 * workers calls ahead of the caller
+    """
+
+    if workers <= 1:
+        yield from map(function, items)
+        return
+
+    with ThreadPoolExecutor(workers) as pool:
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(pool.submit(function, item))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # If the caller stops early, the calls that have not started are not made
+            pool.shutdown(wait=False, cancel_futures=True)
+
+def discover_safes(client, bucket, skip_year=None, list_workers=1):
+    """
+        client: boto3.client
+        bucket: Name of the bucket
+        skip_year: Optional function taking a year, returning True if the pseudofolder of the year is not listed
+        list_workers: Number of year pseudofolders listed at the same time
+        -> yields the SAFE prefixes, e.g. 'S2A_MSIL2A_20180705T095031_N0208_R079_T34VEM_20180705T120000.SAFE/'
+    """
+
+    def safe_prefixes(prefix):
+        # One project includes pseudofolders in the path representing the years, the SAFEs are one level below them
+        if not year_folder.match(prefix):
+            return [prefix]
+        if skip_year and skip_year(int(prefix[:4])):
+            return []
+        return list_prefixes(client, bucket, prefix)
+
+    for prefixes in ordered_map(safe_prefixes, list_prefixes(client, bucket), list_workers):
+        yield from prefixes
+
+def list_partitions(client, bucket, skip_year=None):
+    """
+        client: boto3.client
+        bucket: Name of the bucket
+        skip_year: Optional function taking a year, returning True if the pseudofolder of the year is not listed
+        -> sorted list of the prefixes up to the first underscore of the keys, e.g. ['S2A_', 'S2B_'] or ['2018/S2A_', '2018/S2B_', ...]
+
+        No partition is a prefix of another, so the keys of the partitions listed one after another are in key order.
+        Keys without an underscore are in no partition, they cannot be in a SAFE.
+    """
+
+    paginator = client.get_paginator('list_objects_v2')
+    partitions = []
+    for page in paginator.paginate(Bucket=bucket, Delimiter='_'):
+        for x in page.get('CommonPrefixes', []):
+            prefix = x['Prefix']
+            if skip_year and year_folder.match(prefix) and skip_year(int(prefix[:4])):
+                continue
+            partitions.append(prefix)
+
+    return partitions
+
+def iter_partitioned_keys(client, bucket, partitions, list_workers, buffer_pages=50, objects=False):
+    """
+        client: boto3.client
+        bucket: Name of the bucket
+        partitions: Sorted prefixes from list_partitions()
+        list_workers: Number of partitions listed at the same time
+        buffer_pages: Number of pages a partition can be listed ahead of the caller
+        objects: If True, the object dicts of list_objects_v2 are yielded instead of the keys
+        -> yields the keys (or object dicts) of all the partitions in key order
+
+        A listing error in a thread is raised to the caller when its partition is reached.
+    """
+
+    done = object()
+    stop = threading.Event()
+    buffers = [queue.Queue(buffer_pages) for _ in partitions]
+
+    def put(buffer, value):
+        # The caller may stop reading, then the threads waiting for room in the buffers give up
+        while not stop.is_set():
+            try:
+                buffer.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def list_partition(prefix, buffer):
+        try:
+            for page in client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+                if not put(buffer, page.get('Contents', []) if objects else [x['Key'] for x in page.get('Contents', [])]):
+                    return
+        except Exception as error:
+            put(buffer, error)
+            return
+        put(buffer, done)
+
+    with ThreadPoolExecutor(list_workers) as pool:
+        # The partitions are started in order, so the one the caller is waiting for is always being listed
+        for prefix, buffer in zip(partitions, buffers):
+            pool.submit(list_partition, prefix, buffer)
+        try:
+            for buffer in buffers:
+                while True:
+                    page = buffer.get()
+                    if page is done:
+                        break
+                    if isinstance(page, Exception):
+                        raise page
+                    yield from page
+        finally:
+            # If the caller stops early, the partitions that have not started are not listed
+            stop.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+
+def duplicate_safes(client, buckets, ranks, skip_year=None, list_workers=1):
+    """
+        client: boto3.client
+        buckets: list of bucket names
+        ranks: dict of sort keys by bucket name from safe_names.bucket_ranks(), the smallest wins
+        skip_year: Optional function taking a year, returning True if the pseudofolder of the year is not listed
+        list_workers: Number of threads listing a bucket
+        -> dict of the bucket the SAFE is taken from by SAFE name (without .SAFE), for the SAFEs found in several buckets
+
+        Only the SAFE prefixes of the buckets are listed, not their keys.
+    """
+
+    found = {}
+    duplicates = {}
+    for bucket in buckets:
+        for prefix in discover_safes(client, bucket, skip_year, list_workers):
+            safename = prefix.rstrip('/').split('/')[-1].split('.')[0]
+            if safename in found:
+                if ranks[bucket] < ranks[found[safename]]:
+                    found[safename] = bucket
+                duplicates[safename] = found[safename]
+            else:
+                found[safename] = bucket
+
+    return duplicates
+
+def group_safes(keys, get_key=None):
+    """
+        keys: Iterable of keys in lexicographic order, as list_objects_v2 returns them
+        get_key: Optional function giving the key of an entry, to group e.g. the object dicts of iter_objects()
+        -> yields (safe, safecontents) with the SAFE folder name and its keys (or entries), as soon as the next SAFE starts
+
+        The keys of a SAFE come one after another in the listing, so a SAFE is complete when a key of another one is seen.
+    """
+
+    current = None
+    safecontents = []
+    for entry in keys:
+        key = get_key(entry) if get_key else entry
+        parts = key.split('/')
+        # One project includes pseudofolders in the path representing the years, the SAFEs are one level below them
+        depth = 1 if year_folder.match(key) else 0
+        # Files next to the SAFEs (e.g. index.html) are not part of any SAFE
+        if len(parts) <= depth + 1:
+            continue
+        safeprefix = '/'.join(parts[:depth + 1])
+        if safeprefix != current:
+            if current:
+                yield current.split('/')[-1], safecontents
+            current = safeprefix
+            safecontents = []
+        safecontents.append(entry)
+
+    if current:
+        yield current.split('/')[-1], safecontents
+
+def choose_discovery(discovery, skip):
+    """
+        discovery: 'auto', 'delimiter' or 'list'
+        skip: Skip function of iter_safes(), or None
+        -> 'delimiter' or 'list'
+
+        The delimiter discovery lists the keys of every SAFE with its own list_objects_v2 call, which pays off only
+        when SAFEs are skipped: without a skip function the whole bucket is listed in pages of 1000 keys instead.
+    """
+
+    if discovery != 'auto':
+        return discovery
+
+    return 'delimiter' if skip else 'list'
+
+def safe_of_prefix(prefix):
+    """
+        prefix: SAFE prefix from discover_safes(), e.g. '2018/S2A_MSIL2A_20180705T095031_N0208_R079_T34VEM_20180705T120000.SAFE/'
+        -> the SAFE folder name, e.g. 'S2A_MSIL2A_20180705T095031_N0208_R079_T34VEM_20180705T120000.SAFE'
+    """
+
+    return prefix.rstrip('/').split('/')[-1]
+
+def unskipped_prefixes(client, bucket, skip=None, skip_year=None, list_workers=1):
+    """
+        The arguments are described in iter_safes().
+        -> yields the prefixes of the SAFEs that are not skipped
+    """
+
+    for prefix in discover_safes(client, bucket, skip_year, list_workers):
+        if not (skip and skip(safe_of_prefix(prefix).split('.')[0])):
+            yield prefix
+
+def iter_safes(client, bucket, discovery='auto', skip=None, skip_year=None, list_workers=1):
+    """
+        client: boto3.client
+        bucket: Name of the bucket
+        discovery: 'delimiter' to find the SAFEs with common prefix listing, 'list' to list every key of the bucket,
+            'auto' for delimiter when there is a skip function and list otherwise (see choose_discovery())
+        skip: Optional function taking a SAFE name (without .SAFE), returning True if the SAFE is not needed
+        skip_year: Optional function taking a year, returning True if the SAFEs in the pseudofolder of the year are not needed.
+            Only the delimiter discovery and the partitioned listing can leave the pseudofolders unlisted, skip has to
+            exclude their SAFEs as well
+        list_workers: Number of threads listing the bucket, 1 to list it in the calling thread
+        -> yields (safe, safecontents) with the SAFE folder name and the keys under it, in key order
+    """
+
+    if choose_discovery(discovery, skip) == 'delimiter':
+        prefixes = unskipped_prefixes(client, bucket, skip, skip_year, list_workers)
+        # Only the keys of the SAFEs that are not skipped are listed, the next ones while the caller handles the current one
+        for prefix, safecontents in ordered_map(lambda prefix: (prefix, list_keys(client, bucket, prefix)), prefixes, list_workers):
+            yield safe_of_prefix(prefix), safecontents
+        return
+
+    if list_workers > 1:
+        keys = iter_partitioned_keys(client, bucket, list_partitions(client, bucket, skip_year), list_workers)
+    else:
+        keys = iter_keys(client, bucket)
+
+    # Every key of the bucket is listed, but each SAFE is handed on as soon as its keys have been listed
+    for safe, safecontents in group_safes(keys):
+        if skip and skip(safe.split('.')[0]):
+            continue
+        yield safe, safecontents
+
+def list_safes(client, bucket, discovery='auto', skip=None, skip_year=None, list_workers=1):
+    """
+        The arguments are described in iter_safes().
+        -> yields (safe, listing) with the SAFE folder name and, with the delimiter discovery, the SAFE prefix whose keys
+            are listed only when they are needed (see safe_contents()), with the 'list' discovery the keys of the SAFE
+
+        Unlike iter_safes(), the delimiter discovery does not list the keys of the SAFEs, so the SAFEs of many buckets
+        can be collected and ordered before any of them is read.
+    """
+
+    if choose_discovery(discovery, skip) == 'delimiter':
+        for prefix in unskipped_prefixes(client, bucket, skip, skip_year, list_workers):
+            yield safe_of_prefix(prefix), prefix
+        return
+
+    yield from iter_safes(client, bucket, 'list', skip, skip_year, list_workers)
+
+def safe_contents(client, bucket, listing):
+    """
+        client: boto3.client
+        bucket: Name of the bucket
+        listing: SAFE prefix or list of keys from list_safes()
+        -> list of the keys of the SAFE
+    """
+
+    if isinstance(listing, str):
+        return list_keys(client, bucket, listing)
+    return listing
+
+def iter_safe_objects(client, bucket, discovery='auto', skip=None, skip_year=None, list_workers=1):
+    """
+        The arguments are described in iter_safes().
+        -> yields (safe, objects) with the SAFE folder name and the object dicts of list_objects_v2 (Key, LastModified,
+            Size, ...) of its files, in key order
+    """
+
+    if choose_discovery(discovery, skip) == 'delimiter':
+        prefixes = unskipped_prefixes(client, bucket, skip, skip_year, list_workers)
+        for prefix, objects in ordered_map(lambda prefix: (prefix, list(iter_objects(client, bucket, prefix))), prefixes, list_workers):
+            yield safe_of_prefix(prefix), objects
+        return
+
+    if list_workers > 1:
+        entries = iter_partitioned_keys(client, bucket, list_partitions(client, bucket, skip_year), list_workers, objects=True)
+    else:
+        entries = iter_objects(client, bucket)
+
+    for safe, objects in group_safes(entries, lambda x: x['Key']):
+        if skip and skip(safe.split('.')[0]):
+            continue
+        yield safe, objects
@@ -0,0 +1,230 @@
+"""
+    Parsing the Sentinel-2 SAFE and image names and filtering the SAFEs by them.
+
+    The name of a SAFE tells the mission, processing level, sensing time, processing baseline, relative orbit
+    and MGRS tile of the product, and the name of an image its band and resolution, e.g.
+
+        S2A_MSIL2A_20180705T095031_N0208_R079_T34VEM_20180705T120000.SAFE
+        T34VEM_20180705T095031_B02_10m.jp2 (or T34VEM_20180705T095031_B02_10m_geo.jp2 in a few SAFEs)
+
+    The names are parsed once with precompiled patterns into named tuples, instead of splitting the URLs
+    where they are used, so e.g. an underscore in a bucket name does not break the parsing.
+
+    The filters are evaluated on the names while the buckets are listed, so the SAFEs that are not wanted
+    cost no metadata or image requests.
+"""
+import re
+from datetime import date
+from collections import namedtuple
+
+safe_pattern = re.compile(
+    r"(?P<mission>S2[A-D])_MSI(?P<level>L[12][AC])_(?P<sensing>\d{8}T\d{6})_N(?P<baseline>\d{4})"
+    r"_R(?P<orbit>\d{3})_T(?P<tile>\d{2}[A-Z]{3})_(?P<product>\d{8}T\d{6})(?:\.SAFE)?/?$"
+)
+
+# The band and resolution at the end of an image name, the few _geo.jp2 images have different metadata
+band_pattern = re.compile(r"_(?P<band>[A-Z0-9]{3})_(?P<resolution>\d+)m(?P<geo>_geo)?\.jp2$")
+
+SafeName = namedtuple('SafeName', ['name', 'mission', 'level', 'sensing', 'baseline', 'orbit', 'tile', 'product'])
+BandFile = namedtuple('BandFile', ['key', 'band', 'resolution', 'geo'])
+
+def parse_safe_name(name):
+    """
+        name: SAFE name with or without .SAFE, e.g. 'S2A_MSIL2A_20180705T095031_N0208_R079_T34VEM_20180705T120000'
+        -> SafeName, or None if the name is not a Sentinel-2 SAFE name
+    """
+
+    match = safe_pattern.match(name)
+    if not match:
+        return None
+
+    return SafeName(
+        name=name.split('.')[0],
+        mission=match['mission'],
+        level=match['level'],
+        sensing=match['sensing'],
+        baseline=match['baseline'],
+        orbit=int(match['orbit']),
+        tile=match['tile'],
+        product=match['product'],
+    )
+
+def safe_of_uri(uri):
+    """
+        uri: URL or key of a file in a SAFE
+        -> SafeName of the SAFE folder in the path, or None if there is none
+    """
+
+    for part in uri.split('/'):
+        if part.endswith('.SAFE'):
+            return parse_safe_name(part)
+
+    return None
+
+def parse_band_file(uri):
+    """
+        uri: URL or key of an image, e.g. '.../IMG_DATA/R10m/T34VEM_20180705T095031_B02_10m.jp2'
+        -> BandFile with the asset key ('B02_10m'), band ('B02'), resolution ('10') and whether it is a _geo.jp2 image,
+            or None if the name has no band and resolution
+    """
+
+    match = band_pattern.search(uri)
+    if not match:
+        return None
+
+    return BandFile(
+        key=f"{match['band']}_{match['resolution']}m",
+        band=match['band'],
+        resolution=match['resolution'],
+        geo=bool(match['geo']),
+    )
+
+def baseline_version(safe):
+    """
+        safe: SafeName
+        -> processing baseline as in the metadata, e.g. '02.08'
+    """
+
+    return f"{safe.baseline[:2]}.{safe.baseline[2:]}"
+
+def sensing_date(safe):
+    """
+        safe: SafeName
+        -> datetime.date of the sensing time
+    """
+
+    return date(int(safe.sensing[0:4]), int(safe.sensing[4:6]), int(safe.sensing[6:8]))
+
+def normalize_baseline(baseline):
+    """
+        baseline: Processing baseline as in the SAFE name (N0208), without the N (0208) or as a version (02.08)
+        -> the four digits of the baseline, e.g. '0208'
+    """
+
+    digits = baseline.upper().lstrip('N').replace('.', '')
+    if not (digits.isdigit() and len(digits) == 4):
+        raise ValueError(f"processing baseline must be given like N0208, 0208 or 02.08, not {baseline!r}")
+
+    return digits
+
+def safe_filter(since=None, until=None, tiles=None, missions=None, baselines=None):
+    """
+        since: datetime.date, SAFEs sensed before it are skipped
+        until: datetime.date, SAFEs sensed after it are skipped
+        tiles: list of MGRS tiles to keep, e.g. ['34VEM'], with or without the leading T
+        missions: list of missions to keep, e.g. ['S2A']
+        baselines: list of processing baselines to keep, e.g. ['N0208'] (see normalize_baseline())
+        -> skip function for safe_listing.iter_safes() taking a SAFE name and returning True for the SAFEs to skip,
+            None if no filter is given
+
+        With any filter given, the names that can not be parsed are skipped as well.
+    """
+
+    if not any((since, until, tiles, missions, baselines)):
+        return None
+
+    tiles = {x.upper().lstrip('T') for x in tiles} if tiles else None
+    missions = {x.upper() for x in missions} if missions else None
+    baselines = {normalize_baseline(x) for x in baselines} if baselines else None
+
+    def skip(safename):
+        safe = parse_safe_name(safename)
+        if safe is None:
+            return True
+        if since and sensing_date(safe) < since:
+            return True
+        if until and sensing_date(safe) > until:
+            return True
+        if tiles and safe.tile not in tiles:
+            return True
+        if missions and safe.mission not in missions:
+            return True
+        if baselines and safe.baseline not in baselines:
+            return True
+        return False
+
+    return skip
+
+def year_filter(since=None, until=None):
+    """
+        since: datetime.date or None
+        until: datetime.date or None
+        -> function taking a year and returning True if the year pseudofolder can be skipped, None without dates
+    """
+
+    if not (since or until):
+        return None
+
+    return lambda year: (since is not None and year < since.year) or (until is not None and year > until.year)
+
+def combine_skips(*skips):
+    """
+        skips: Skip functions, or None
+        -> skip function that skips what any of them skips, None if all are None
+    """
+
+    skips = [x for x in skips if x]
+    if not skips:
+        return None
+    if len(skips) == 1:
+        return skips[0]
+
+    return lambda safename: any(skip(safename) for skip in skips)
+
+# Orders in which schedule_safes() can put the SAFEs
+schedule_policies = ('newest', 'oldest', 'listing')
+
+def schedule_safes(candidates, policy='newest'):
+    """
+        candidates: list of tuples with the SAFE folder name second, e.g. (bucket, safe, safecontents)
+        policy: 'newest' for the latest sensing time first, 'oldest' for the earliest first, 'listing' to keep the listing order
+        -> list of the candidates in the order they are processed
+
+        The sort is stable, so a SAFE found in several buckets stays in the bucket order. Names that are not
+        SAFE names go last.
+    """
+
+    if policy not in schedule_policies:
+        raise ValueError(f"schedule policy must be one of {', '.join(schedule_policies)}, not {policy!r}")
+    if policy == 'listing':
+        return list(candidates)
+
+    def sensing(candidate):
+        safe = parse_safe_name(candidate[1])
+        if policy == 'newest':
+            return (safe is not None, safe.sensing if safe else '')
+        return (safe is None, safe.sensing if safe else '')
+
+    return sorted(candidates, key=sensing, reverse=policy == 'newest')
+
+def bucket_ranks(buckets, precedence=None):
+    """
+        buckets: list of bucket names in the order they are processed
+        precedence: list of regular expressions of bucket names, a SAFE found in several buckets is taken from a bucket
+            matching an earlier pattern. None or empty to take it from the first bucket
+        -> dict of sort keys by bucket name, the SAFE is taken from the bucket with the smallest key
+    """
+
+    patterns = [re.compile(pattern) for pattern in precedence or []]
+
+    def rank(position, bucket):
+        matching = next((i for i, pattern in enumerate(patterns) if pattern.search(bucket)), len(patterns))
+        return (matching, position)
+
+    return {bucket: rank(position, bucket) for position, bucket in enumerate(buckets)}
+
+def dedupe_safes(candidates, ranks):
+    """
+        candidates: list of tuples with the bucket first and the SAFE folder name second, e.g. (bucket, safe, safecontents)
+        ranks: dict from bucket_ranks()
+        -> list of the candidates with every SAFE once, from the bucket with the best rank, in the order of the candidates
+    """
+
+    best = {}
+    for candidate in candidates:
+        safename = candidate[1].split('.')[0]
+        if safename not in best or ranks[candidate[0]] < ranks[best[safename][0]]:
+            best[safename] = candidate
+    chosen = {id(candidate) for candidate in best.values()}
+
+    return [candidate for candidate in candidates if id(candidate) in chosen]
@@ -2,9 +2,9 @@ import boto3
 import pystac as stac
 import rasterio
 import re
-import pandas as pd
-from itertools import chain
+import os
 from datetime import datetime
+from collections import Counter
 from xml.dom import minidom
 from shapely.geometry import box, mapping, GeometryCollection, shape
 from pystac.extensions.eo import EOExtension, Band
@@ -12,11 +12,22 @@ from pystac.extensions.projection import ProjectionExtension
 from pystac import (Catalog, CatalogType)
 
 from rasterio.warp import transform_bounds
-from rasterio.crs import CRS
 
 from botocore import UNSIGNED
 from botocore.client import Config
 
+from safe_listing import iter_safes, duplicate_safes, choose_discovery
+from safe_names import safe_filter, year_filter, combine_skips, parse_safe_name, safe_of_uri, parse_band_file, baseline_version, bucket_ranks
+from hybrid_executor import run_hybrid, make_process_pool
+from shards import in_shard, shard_folder, clear_shard, write_shard, read_shard_extents, merge_extents, iter_shard_items
+from checkpoints import clear_checkpoints, write_bucket_checkpoint, load_checkpoints, write_quarantine
+from tile_cache import epsg_crs, tile_of, load_tile_cache, save_tile_cache, tile_lock, lookup_tile_geometry, remember_tile_geometry
+from catalog_layout import layout_levels
+from catalog_writer import write_catalog
+from catalog_index import write_index
+from metadata_reader import read_xml_head, crs_tags, crs_range, product_tags, product_range
+from stage_profiler import stage
+
 # Band information in Band objects and as a dict
 s2_bands = {
     "B01": {
@@ -160,98 +171,373 @@ def get_buckets(client):
     bucket_information = client.list_buckets()
     buckets = [x['Name'] for x in bucket_information['Buckets'] if re.match(r"Sentinel2(?!.*segments)", x['Name'])]
 
-    first_csv = pd.read_table("2000290_buckets.csv", header=None)
-    first_buckets = list(chain.from_iterable(first_csv.to_numpy()))
-    second_csv = pd.read_table("2001106_buckets.csv", header=None)
-    second_buckets = list(chain.from_iterable(second_csv.to_numpy()))
+    with open("2000290_buckets.csv") as f:
+        first_buckets = [line.strip() for line in f if line.strip()]
+    with open("2001106_buckets.csv") as f:
+        second_buckets = [line.strip() for line in f if line.strip()]
     
     buckets = [*buckets, *first_buckets, *second_buckets]
 
     return buckets
 
-def create_collection(client, buckets):
+def create_collection(client, buckets, discovery='auto', shard=None, shard_by='bucket', shard_dir='Sentinel2-shards', io_workers=8, processes=None, tile_cache_path='tile_geometry_cache.json', layout='flat', write_workers=16, name_filter=None, skip_year=None, checkpoint_dir='Sentinel2-checkpoints', resume=False, compact=False, gzip_items=False, index_path='Sentinel2-index.sqlite', list_workers=4, dedupe=True, precedence=None):
     """
         client: boto3.client
         buckets: list of bucket names where data will be found
+        discovery: How the SAFEs are found from the buckets, 'auto', 'delimiter' or 'list' (see safe_listing.iter_safes)
+        shard: Optional (index, count) tuple. If given, only the shard's part of the data is processed and
+            written into shard_dir, to be combined later with merge_shards()
+        shard_by: Whether the data is split into shards by 'bucket' or by 'safe'
+        shard_dir: Folder where the shard outputs are written
+        io_workers: Number of threads fetching the SAFEs from Allas
+        processes: Number of processes building the items, all cores if None and the main process only if 0
+        tile_cache_path: JSON file of the tile geometry cache (see tile_cache), None to not use the cache
+        layout: Layout of the saved catalog, one of catalog_layout.layouts
+        write_workers: Number of threads writing the catalog files
+        name_filter: Optional function taking a SAFE name, returning True for the SAFEs to skip (see safe_names.safe_filter)
+        skip_year: Optional function taking a year, returning True for the year pseudofolders to skip (see safe_names.year_filter)
+        checkpoint_dir: Folder where the items of every finished bucket are saved (see checkpoints), None to not save them
+        resume: If True, the buckets saved in checkpoint_dir by an earlier run are not read again
+        compact: If True, the catalog is written with the compact profile (see stac_io)
+        gzip_items: If True, the item files are written gzipped
+        index_path: SQLite file where the index of the items is written (see catalog_index), None to not write it
+        list_workers: Number of threads listing a bucket (see safe_listing.iter_safes)
+        dedupe: If True, a SAFE found in several buckets is made only from one of them, chosen by the precedence
+        precedence: list of regular expressions of bucket names, the SAFEs found in several buckets are taken from the
+            bucket matching the earliest pattern, and from the first such bucket in the list (see safe_names.bucket_ranks)
+
+        SAFEs that fail are quarantined (see checkpoints) and the run goes on with the rest.
+    """
+
+    # The duplicates are found from all the buckets, so every SAFE is made once even when the shards split the buckets
+    duplicates = {}
+    with stage('duplicates'):
+        if dedupe and len(buckets) > 1:
+            duplicates = duplicate_safes(client, buckets, bucket_ranks(buckets, precedence), skip_year, list_workers)
+            print(f'{len(duplicates)} SAFEs found in several buckets, each is made from one bucket only')
+
+    skip = None
+    if shard and shard_by == 'bucket':
+        buckets = [x for x in buckets if in_shard(x, shard)]
+    elif shard:
+        # The same SAFE name always goes to the same shard, even when it is found from several buckets
+        skip = lambda safename: not in_shard(safename, shard)
+    # The SAFEs left out by the filters are skipped before any of their files are read
+    skip = combine_skips(name_filter, skip)
+    # The few SAFEs taken from another bucket do not make the listing SAFE by SAFE worth it, only the filters and shards do
+    discovery = choose_discovery(discovery, skip)
+
+    tilecache = load_tile_cache(tile_cache_path)
+
+    if shard:
+        # The output of an earlier run of the shard is not merged while the shard is made again
+        clear_shard(shard_dir, shard)
+    if shard and checkpoint_dir:
+        # Shards split by SAFE read the same buckets, so every shard has its own checkpoints
+        checkpoint_dir = shard_folder(checkpoint_dir, shard)
+    if not resume:
+        clear_checkpoints(checkpoint_dir)
+    checkpoints = load_checkpoints(checkpoint_dir)
+
+    # Item dicts and quarantined SAFEs by bucket, and the number of SAFEs of each bucket not made yet
+    bucket_items = {}
+    quarantine = {}
+    unfinished = Counter()
+    listed = set()
+
+    def finish_buckets():
+        # A bucket is finished when all of its SAFEs have been listed and made
+        for bucket in [x for x in listed if not unfinished[x]]:
+            listed.discard(bucket)
+            write_bucket_checkpoint(checkpoint_dir, bucket, bucket_items[bucket], quarantine[bucket])
+            save_tile_cache(tile_cache_path, tilecache)
+
+    def safes():
+        for bucket in buckets:
+            if bucket in checkpoints:
+                print('Bucket from the checkpoint:', bucket)
+                bucket_items[bucket] = checkpoints[bucket]['items']
+                continue
+
+            print('Bucket:', bucket)
+            bucket_items[bucket] = []
+            quarantine[bucket] = []
+
+            # The SAFEs taken from another bucket are skipped before their keys are listed
+            bucket_skip = combine_skips(skip, (lambda safename, bucket=bucket: duplicates.get(safename, bucket) != bucket) if duplicates else None)
+
+            for safe, safecontents in iter_safes(client, bucket, discovery, bucket_skip, skip_year, list_workers):
+                unfinished[bucket] += 1
+                yield client, bucket, safe, safecontents, tilecache
+
+            listed.add(bucket)
+            finish_buckets()
+
+    def quarantine_safe(job, error):
+        print('SAFE failed, quarantined:', job[2], repr(error))
+        quarantine[job[1]].append({'safe': job[2], 'error': repr(error)})
+        unfinished[job[1]] -= 1
+        finish_buckets()
+
+    # The SAFEs are fetched in threads and the items are built in worker processes. The SAFEs of all the buckets go
+    # through the same pools, so they are kept busy when one bucket ends and the next one starts
+    with stage('items'), make_process_pool(processes) as processpool:
+        for job, item_dict in run_hybrid(fetch_safe, build_item, safes(), io_workers, processpool, on_error=quarantine_safe):
+            if item_dict is not None:
+                bucket_items[job[1]].append(item_dict)
+            unfinished[job[1]] -= 1
+            finish_buckets()
+
+    # The items are added in the order of the buckets, so a SAFE found in several buckets gets its assets the same way on every run
+    items = {}
+    for bucket in buckets:
+        for item_dict in bucket_items.get(bucket, []):
+            add_item(items, stac.Item.from_dict(item_dict))
+
+    quarantined = write_quarantine(checkpoint_dir)
+    if quarantined:
+        print(f'{len(quarantined)} SAFEs quarantined, listed in {checkpoint_dir}/quarantine.json')
+
+    # The items are finished in whatever order the workers get them done, sort them so the catalog is the same on every run
+    items = [items[safename] for safename in sorted(items)]
+
+    if shard:
+        # The links are made when the shards are merged
+        item_dicts = [{**item.to_dict(include_self_link=False, transform_hrefs=False), 'links': []} for item in items]
+        write_shard(shard_dir, shard, item_dicts, items_extent(items))
+        return
+
+    rootcatalog, rootcollection = make_root_catalog()
+    subcatalogs = {}
+    with stage('layout'):
+        for item in items:
+            add_to_layout(rootcollection, item, layout, subcatalogs)
+
+    save_catalog(rootcatalog, rootcollection, items_extent(items), write_workers, compact, gzip_items, index_path)
+
+def merge_shards(shard_dir='Sentinel2-shards', layout='flat', write_workers=16, compact=False, gzip_items=False, index_path='Sentinel2-index.sqlite'):
+    """
+        shard_dir: Folder where the shards were written by create_collection()
+        layout: Layout of the saved catalog, one of catalog_layout.layouts
+        write_workers: Number of threads writing the catalog files
+        compact: If True, the catalog is written with the compact profile (see stac_io)
+        gzip_items: If True, the item files are written gzipped
+        index_path: SQLite file where the index of the items is written (see catalog_index), None to not write it
+
+        Combines the items of all the shards into one catalog. The collection extent is combined from the extents of the shards.
+    """
+
+    extents = read_shard_extents(shard_dir)
+
+    # With bucket sharding the same SAFE can come from several shards
+    items = {}
+    with stage('shards'):
+        for item_dict in iter_shard_items(shard_dir, extents):
+            add_item(items, stac.Item.from_dict(item_dict))
+
+    rootcatalog, rootcollection = make_root_catalog()
+    subcatalogs = {}
+    with stage('layout'):
+        for safename in sorted(items):
+            add_to_layout(rootcollection, items[safename], layout, subcatalogs)
+
+    print(f'Merged {len(items)} items from {len(extents)} shards')
+
+    save_catalog(rootcatalog, rootcollection, merge_extents(extents), write_workers, compact, gzip_items, index_path)
+
+def fetch_safe(client, bucket, safe, safecontents, tilecache=None):
+    """
+        client: boto3.client
+        bucket: The bucket where the SAFE is located
+        safe: SAFE folder name
+        safecontents: list of the keys of the SAFE
+        tilecache: Tile geometry cache dict, the first image is read only for the first SAFE of a tile and the cache is filled from it. None to read it for every SAFE
+        -> record dict for build_item() or None if the SAFE does not include data relevant to the script
+
+        The network part of making an item, run in the I/O threads of run_hybrid().
+    """
+
+    # The id, date, orbit and baseline of the item come from the SAFE name
+    safeinfo = parse_safe_name(safe)
+    if safeinfo is None:
+        print('Not a Sentinel-2 SAFE name, skipped:', safe)
+        return None
+    safename = safeinfo.name
+
+    # Gather needed contents into different lists containing filenames
+    safecontent_jp2 = [x for x in safecontents if x.endswith('jp2')]
+    safecontent_mtd = [x for x in safecontents if x.endswith('MTD_MSIL2A.xml')]
+    safecontent_crs = [x for x in safecontents if x.endswith('MTD_TL.xml')]
+
+    metadatafile = ''.join((x for x in safecontent_mtd if safename in x))
+    crsmetadatafile = ''.join((x for x in safecontent_crs if safename in x))
+    if not metadatafile or not crsmetadatafile:
+        # If there is no metadatafile or CRS-metadatafile, the SAFE does not include data relevant to the script
+        return None
+    # THIS FAILS WITH FOLDER BUCKETS
+    crsmetadatacontent = get_metadata_content(bucket, crsmetadatafile, client, crs_tags, crs_range)
+
+    # only jp2 that are image bands
+    jp2images = [x for x in safecontent_jp2 if safe in x and 'IMG_DATA' in x]
+    # if there are no jp2 imagefiles in the SAFE, continue to the next SAFE
+    if not jp2images:
+        return None
+    # jp2 that are preview images
+    previewimage = next((x for x in safecontent_jp2 if safe in x and 'PVI' in x), None)
+    if previewimage is None:
+        raise ValueError(f'No preview image (PVI) in {safe}')
+
+    metadatacontent = get_metadata_content(bucket, metadatafile, client, product_tags, product_range)
+
+    uris = ['https://a3s.fi/' + bucket + '/' + image for image in jp2images]
+    previewuri = 'https://a3s.fi/' + bucket + '/' + previewimage
+    tilegeometry = None
+    rasterinfo = None
+    if tilecache is None:
+        rasterinfo = read_raster_info(uris[0])
+    else:
+        # The first SAFE of a tile reads the image and fills the cache while the other SAFEs of the tile wait for it
+        with tile_lock(safename):
+            tilegeometry = lookup_tile_geometry(tilecache, safename, uris[0])
+            if tilegeometry is None:
+                rasterinfo = read_raster_info(uris[0])
+                remember_tile_geometry(tilecache, raster_footprint(safename, get_crs(crsmetadatacontent)['CRS'], rasterinfo))
+
+    return {
+        'safe': safeinfo,
+        'uris': uris,
+        'previewuri': previewuri,
+        'metadatacontent': metadatacontent,
+        'crsmetadatacontent': crsmetadatacontent,
+        'tilegeometry': tilegeometry,
+        'rasterinfo': rasterinfo,
+        'previewinfo': read_raster_info(previewuri),
+    }
+
+def build_item(record):
+    """
+        record: Record dict from fetch_safe()
+        -> STAC Item dict without links
+
+        The CPU part of making an item, run in the worker processes of run_hybrid(). Only picklable
+        dicts go in and out, the pystac objects are made again from the dict in the main process.
+    """
+
+    safecrs_metadata = get_crs(record['crsmetadatacontent'])
+
+    item = make_item(record['uris'][0], record['metadatacontent'], safecrs_metadata, record['rasterinfo'], record['tilegeometry'], record['safe'])
+    # add preview image
+    add_asset(item, record['previewuri'], None, True, record['previewinfo']['shape'])
+    # The item was made from the first image, the rest are added as assets
+    for uri in record['uris'][1:]:
+        add_asset(item, uri, safecrs_metadata)
+
+    item.validate()
+
+    return {**item.to_dict(include_self_link=False, transform_hrefs=False), 'links': []}
+
+def add_item(items, item):
+    """
+        items: dict of the items made so far by their ids
+        item: stac.Item to add
+
+        If the same SAFE was already made from another bucket, the assets it did not have are added to it.
+    """
+
+    if item.id not in items:
+        items[item.id] = item
+        return
+
+    for key, asset in item.assets.items():
+        if key not in items[item.id].assets:
+            items[item.id].add_asset(key, asset)
+
+def items_extent(items):
+    """
+        items: list of stac.Items
+        -> (bbox, start, end) of the items, None if there are no items
+    """
+
+    if not items:
+        return None
+
+    rootbounds = GeometryCollection([shape(s.geometry) for s in items]).bounds
+    roottimes = [t.datetime for t in items]
+
+    return rootbounds, min(roottimes), max(roottimes)
+
+def make_root_catalog(catalog_dir='Sentinel2-tileless'):
+    """
+        catalog_dir: Folder where the catalog is saved
+        -> (rootcatalog, rootcollection) with their hrefs set, so the hrefs of the items can be set as they are added
     """
 
     rootcollection = make_root_collection()
     rootcatalog = stac.Catalog(id='Sentinel-2 catalog', description='Sentinel 2 catalog.')
+    rootcatalog.set_self_href(os.path.join(os.path.abspath(catalog_dir), 'catalog.json'))
     rootcatalog.add_child(rootcollection)
-    
-    for bucket in buckets:
+    rootcollection.set_self_href(os.path.join(os.path.abspath(catalog_dir), rootcollection.id, 'collection.json'))
 
-        # Usual list_objects_v2 function only lists up to 1000 objects so pagination is needed when using a client
-        paginator = client.get_paginator('list_objects_v2')
-        pages = paginator.paginate(Bucket=bucket)
-        bucketcontents = [x['Key'] for page in pages for x in page['Contents']]
-
-        # Gather needed contents into different lists containing filenames
-        bucketcontent_jp2 = [x for x in bucketcontents if x.endswith('jp2')]
-        bucketcontent_mtd = [x for x in bucketcontents if x.endswith('MTD_MSIL2A.xml')]
-        bucketcontent_crs = [x for x in bucketcontents if x.endswith('MTD_TL.xml')]
-
-        exclude = {'index.html'}
-        listofsafes = list(set(list(map(lambda x: x.split('/')[0], bucketcontents))) - exclude)
-        # One project includes pseudofolders in the path representing the years, with this check, get the actual SAFEs instead
-        if any(re.match(r"\d{4}", safe) for safe in listofsafes):
-            listofsafes.clear()
-            listofsafes = list(set(list(map(lambda x: x.split('/')[1], bucketcontents))) - exclude)
-        print('Bucket:', bucket)
-
-        for safe in listofsafes:
-
-            # SAFE-filename without the subfix
-            safename = str(safe.split('.')[0])
-
-            metadatafile = ''.join((x for x in bucketcontent_mtd if safename in x))
-            crsmetadatafile = ''.join((x for x in bucketcontent_crs if safename in x))
-            if not metadatafile or not crsmetadatafile:
-                # If there is no metadatafile or CRS-metadatafile, the SAFE does not include data relevant to the script
-                continue
-            # THIS FAILS WITH FOLDER BUCKETS
-            safecrs_metadata = get_crs(get_metadata_content(bucket, crsmetadatafile, client))
-            
-            # only jp2 that are image bands
-            jp2images = [x for x in bucketcontent_jp2 if safe in x and 'IMG_DATA' in x]
-            # if there are no jp2 imagefiles in the bucket, continue to the next bucket
-            if not jp2images:
-                continue
-            # jp2 that are preview images
-            previewimage = next(x for x in bucketcontent_jp2 if safe in x and 'PVI' in x)
+    return rootcatalog, rootcollection
 
-            metadatacontent = get_metadata_content(bucket, metadatafile, client)
-            
-            for image in jp2images:
-
-                uri = 'https://a3s.fi/' + bucket + '/' + image
-
-                items = list(rootcollection.get_items())
-                # Check if the item in question is already added to the collection
-                if safename not in [x.id for x in items]:
-                    item = make_item(uri, metadatacontent, safecrs_metadata)
-                    rootcollection.add_item(item)
-                    # add preview image 
-                    add_asset(item, 'https://a3s.fi/' + bucket + '/' + previewimage, None, True)
-                else:
-                    item = [x for x in items if safename in x.id][0]
-                    add_asset(item, uri, safecrs_metadata)
-
-    rootcatalog.normalize_hrefs('Sentinel2-tileless')
-    rootcatalog.validate_all()
-
-    # Update the spatial and temporal extent
-    print('Updating collection extent')
-    rootbounds = [GeometryCollection([shape(s.geometry) for s in rootcollection.get_all_items()]).bounds]
-    roottimes = [t.datetime for t in rootcollection.get_all_items()]
-    roottemporal = [[min(roottimes), max(roottimes)]]
-    rootcollection.extent.spatial = stac.SpatialExtent(rootbounds)
-    rootcollection.extent.temporal = stac.TemporalExtent(roottemporal)
-
-    rootcatalog.save(catalog_type=CatalogType.RELATIVE_PUBLISHED)
+def add_to_layout(rootcollection, item, layout, subcatalogs):
+    """
+        rootcollection: stac.Collection from make_root_catalog()
+        item: stac.Item to add
+        layout: Layout of the saved catalog, one of catalog_layout.layouts
+        subcatalogs: dict of the sub-catalogs made so far by their hrefs, shared between the calls
+
+        Adds the item into its sub-catalog (made if needed) and sets its href right away, so no normalize_hrefs is needed.
+    """
+
+    parent = rootcollection
+    for catalog_id, folder, description in layout_levels(layout, tile_of(item.id), item.datetime.year):
+        href = os.path.join(os.path.dirname(parent.get_self_href()), folder, 'catalog.json')
+        if href not in subcatalogs:
+            subcatalog = stac.Catalog(id=catalog_id, description=description)
+            parent.add_child(subcatalog)
+            subcatalog.set_self_href(href)
+            subcatalogs[href] = subcatalog
+        parent = subcatalogs[href]
+
+    parent.add_item(item)
+    item.set_self_href(os.path.join(os.path.dirname(parent.get_self_href()), item.id, item.id + '.json'))
+    if parent is not rootcollection:
+        item.set_collection(rootcollection)
+
+def save_catalog(rootcatalog, rootcollection, extent, write_workers=16, compact=False, gzip_items=False, index_path=None):
+    """
+        rootcatalog: stac.Catalog from make_root_catalog()
+        rootcollection: stac.Collection with the items added with add_to_layout()
+        extent: (bbox, start, end) of all the items, None if there are no items
+        write_workers: Number of threads writing the catalog files
+        compact: If True, the catalog is written with the compact profile (see stac_io)
+        gzip_items: If True, the item files are written gzipped
+        index_path: SQLite file where the index of the items is written (see catalog_index), None to not write it
+    """
+
+    # The items are validated where they are built
+    rootcatalog.validate()
+    rootcollection.validate()
+
+    # Update the spatial and temporal extent, without items the collection keeps the extent of make_root_collection()
+    if extent:
+        print('Updating collection extent')
+        rootbounds, start, end = extent
+        rootcollection.extent.spatial = stac.SpatialExtent([list(rootbounds)])
+        rootcollection.extent.temporal = stac.TemporalExtent([[start, end]])
+    else:
+        print('No items, the collection extent is not updated')
+
+    # Written in parallel into a new folder that replaces the old catalog only when it is complete
+    with stage('write'):
+        write_catalog(rootcatalog, write_workers, compact, gzip_items)
 
     print('Catalog saved')
 
+    with stage('index'):
+        write_index(index_path, list(rootcollection.get_all_items()), os.path.dirname(rootcatalog.get_self_href()), gzip_items)
+
 def make_root_collection():
 
     # Preliminary apprx Finland, later with bbox of all tiles from bucketname
@@ -304,37 +590,49 @@ def make_root_collection():
 
     return rootcollection
 
-def make_item(uri, metadatacontent, crs_metadata):
+def make_item(uri, metadatacontent, crs_metadata, rasterinfo=None, tilegeometry=None, safe=None):
     """
         uri: The SAFE ID of the item (currently URL of the image, could be changes to SAFE later)
         metadatacontent: Metadata dict got from get_metadata_content()
         crs_metadata: CRS metadata dict containing CRS string and shapes for different resolutions from get_crs()
+        rasterinfo: Bounds and transform of the image from read_raster_info(), read from the uri if not given
+        tilegeometry: Cached geometry of the tile from tile_cache.lookup_tile_geometry(), used instead of the rasterinfo if given
+        safe: safe_names.SafeName of the item, parsed from the uri if not given
     """
 
     params = {}
 
-    if re.match(r".+?\d{4}/S2(A|B)", uri):
-        params['id'] = uri.split("/")[5].split('.')[0]
-    else:
-        params['id'] = uri.split('/')[4].split('.')[0]
+    if safe is None:
+        safe = safe_of_uri(uri)
+    if safe is None:
+        raise ValueError(f'No Sentinel-2 SAFE in the image URL {uri}')
+
+    params['id'] = safe.name
     
-    with rasterio.open(uri) as src:
-        item_transform = src.transform
+    if tilegeometry and tilegeometry['epsg'] == int(crs_metadata['CRS']):
+        # All SAFEs of the same tile have the same footprint
+        item_transform = tilegeometry['transform']
+        params['bbox'] = tilegeometry['bbox']
+        params['geometry'] = tilegeometry['geometry']
+    else:
+        if rasterinfo is None:
+            rasterinfo = read_raster_info(uri)
+        item_transform = rasterinfo['transform']
         # as lat,lon
-        params['bbox'] = transform_crs(list([src.bounds]),crs_metadata['CRS'])
+        params['bbox'] = transform_crs(list([rasterinfo['bounds']]),crs_metadata['CRS'])
         params['geometry'] = mapping(box(*params['bbox']))
             
-    mtddict = get_metadata_from_xml(metadatacontent)
-
     # Datetime from filename
-    params['datetime'] = datetime.strptime(uri.split('_')[2][0:8], '%Y%m%d')
+    params['datetime'] = datetime.strptime(safe.sensing[0:8], '%Y%m%d')
 
     params['properties'] = {}
+    mtddict = get_metadata_from_xml(metadatacontent)
     params['properties']['eo:cloud_cover'] = mtddict['cc_perc']
     #following are not part of eo extension
     params['properties']['data_cover'] = mtddict['data_cover']
-    params['properties']['orbit'] = mtddict['orbit']
-    params['properties']['baseline'] = mtddict['baseline']
+    # The relative orbit and processing baseline are the same in the SAFE name as in the metadata
+    params['properties']['orbit'] = str(safe.orbit)
+    params['properties']['baseline'] = baseline_version(safe)
     # following are part of general metadata hardcoded for Sentinel-2
     params['properties']['platform'] = 'sentinel-2'
     params['properties']['instrument'] = 'msi'
@@ -355,7 +653,7 @@ def make_item(uri, metadatacontent, crs_metadata):
 
     return stacItem
 
-def add_asset(stacItem, uri, crsmetadata=None, thumbnail=False):
+def add_asset(stacItem, uri, crsmetadata=None, thumbnail=False, thumbnailshape=None):
 
     """ 
         Adds an asset to the STAC Item based on whether the asset is a thumbnail or an image. 
@@ -363,61 +661,36 @@ def add_asset(stacItem, uri, crsmetadata=None, thumbnail=False):
         uri: Image URL
         crsmetadata: CRS metadata dict containing CRS string and shapes for different resolutions from get_crs()
         thumbnail: Boolean value indicating if the asset is a thumbnail or not
+        thumbnailshape: Shape of the thumbnail image, read from the uri if not given
     """
 
-    if uri.endswith('geo.jp2'): # A few special cases where there were differently named image files that contained different metadata
-        splitter = uri.split('/')[-1].split('.')[0].split('_')
-        full_bandname = '_'.join(splitter[-3:-1])
-        band = splitter[-3]
-        resolution = splitter[-2].split('m')[0]
-        asset = stac.Asset(
-            href=uri,
-            title=full_bandname,
-            media_type=stac.MediaType.JPEG2000,
-            roles=["data"],
-            extra_fields= {
-                'gsd': int(resolution),
-                'proj:shape': crsmetadata['shapes'][resolution],
-            }
-        )
-        if band in s2_bands:
-            asset_eo_ext = EOExtension.ext(asset)
-            asset_eo_ext.bands = [s2_bands[band]["band"]]
-        stacItem.add_asset(
-            key=full_bandname,
-            asset=asset
-        )
-        
-        return stacItem
-
     if not thumbnail: # If the asset is a standard image
-        splitter = uri.split('/')[-1].split('.')[0].split('_')
-        full_bandname = '_'.join(splitter[-2:])
-        band = splitter[-2]
-        resolution = splitter[-1].split('m')[0]
+        # Also the few differently named _geo.jp2 images get the key and title of their band and resolution, e.g. B02_10m
+        bandfile = parse_band_file(uri)
+        if bandfile is None:
+            print('No band in the image name, not added:', uri)
+            return stacItem
         asset = stac.Asset(
                 href=uri,
-                title=full_bandname,
+                title=bandfile.key,
                 media_type=stac.MediaType.JPEG2000,
                 roles=["data"],
                 extra_fields= {
-                    'gsd': int(resolution),
-                    'proj:shape': crsmetadata['shapes'][resolution],
+                    'gsd': int(bandfile.resolution),
+                    'proj:shape': crsmetadata['shapes'][bandfile.resolution],
                 }
         )
-        if band in s2_bands:
+        if bandfile.band in s2_bands:
             asset_eo_ext = EOExtension.ext(asset)
-            asset_eo_ext.bands = [s2_bands[band]["band"]]
+            asset_eo_ext.bands = [s2_bands[bandfile.band]["band"]]
         stacItem.add_asset(
-            key=full_bandname, 
+            key=bandfile.key, 
             asset=asset
         )
 
     else: # If the asset is a thumbnail image
-        with rasterio.open(uri) as src:
-            shape = src.shape
+        shape = thumbnailshape or read_raster_info(uri)['shape']
 
-        full_bandname = uri.split('/')[-1].split('_')[-1].split('.')[0]
         asset = stac.Asset(
                 href=uri,
                 title="Thumbnail image",
@@ -434,6 +707,36 @@ def add_asset(stacItem, uri, crsmetadata=None, thumbnail=False):
 
     return stacItem
 
+def read_raster_info(uri):
+    """
+        uri: Image URL
+        -> dict with the bounds, transform and shape of the image
+    """
+
+    with rasterio.open(uri) as src:
+        return {
+            'bounds': tuple(src.bounds),
+            'transform': src.transform,
+            'shape': src.shape,
+        }
+
+def raster_footprint(safename, crs_string, rasterinfo):
+    """
+        safename: SAFE name of the item
+        crs_string: EPSG code of the SAFE from get_crs()
+        rasterinfo: Bounds and transform of the image from read_raster_info()
+        -> Item dict with the bbox, geometry and projection the item gets in make_item(), for tile_cache.remember_tile_geometry()
+    """
+
+    bbox = transform_crs([rasterinfo['bounds']], crs_string)
+
+    return {
+        'id': safename,
+        'bbox': list(bbox),
+        'geometry': mapping(box(*bbox)),
+        'properties': {'proj:epsg': int(crs_string), 'proj:transform': list(rasterinfo['transform'])},
+    }
+
 def transform_crs(bounds, crs_string):
     
     """
@@ -441,9 +744,9 @@ def transform_crs(bounds, crs_string):
         crs_string: CRS string from CRS metadata
     """
 
-    # Transform the bounds according to the CRS
-    crs = CRS.from_epsg(4326)
-    safecrs = CRS.from_epsg(int(crs_string))
+    # Transform the bounds according to the CRS, the CRS objects are made once per EPSG code
+    crs = epsg_crs(4326)
+    safecrs = epsg_crs(int(crs_string))
     bounds_transformed = transform_bounds(safecrs, crs, bounds[0][0], bounds[0][1], bounds[0][2], bounds[0][3])
         
     return bounds_transformed
@@ -478,14 +781,20 @@ def get_xml_content(doc, tagname):
     content = doc.getElementsByTagName(tagname)[0].firstChild.data
     return content
 
-def get_metadata_content(bucket, metadatafile, client):
+def get_metadata_content(bucket, metadatafile, client, tags=None, first_range=crs_range):
 
     """
         bucket: The bucket where the metadatafile is located
         metadatafile: The name of the metadatafile
         client: boto3.client
+        tags: Names of the elements needed from the file, only the start of the file up to them is read (see metadata_reader).
+            None to read the whole file
+        first_range: Bytes asked in the first Range request when tags are given
     """
 
+    if tags:
+        return read_xml_head(client, bucket, metadatafile, tags, first_range)
+
     obj = client.get_object(Bucket = bucket, Key = metadatafile)['Body']
     metadatacontent = obj.read().decode()
     return metadatacontent
@@ -507,8 +816,24 @@ def get_metadata_from_xml(metadatabody):
 
     return metadatadict
 
-if __name__ == '__main__':
+def main(args):
+
+    """
+        args: Parsed arguments of the build or merge command from s2stac.build_parser()
+    """
+
+    if args.command == 'merge':
+        merge_shards(args.shard_dir, args.layout, args.write_workers, args.compact, args.gzip, args.index or None)
+        return
 
     s3 = init_client()
     buckets = get_buckets(s3)
-    create_collection(s3, buckets)
\ No newline at end of file
+    name_filter = safe_filter(args.since, args.until, args.tiles, args.missions, args.baseline)
+    create_collection(s3, buckets, args.discovery, args.shard, args.shard_by, args.shard_dir, args.io_workers, args.processes, args.tile_cache or None, args.layout, args.write_workers,
+        name_filter, year_filter(args.since, args.until), args.checkpoint_dir or None, args.resume,
+        args.compact, args.gzip, args.index or None, args.list_workers, not args.keep_duplicates, args.bucket_precedence)
+
+if __name__ == '__main__':
+
+    from s2stac import parse_args, call_main
+    call_main(main, parse_args('build'))
@@ -0,0 +1,141 @@
+"""
+    Splitting the catalog build into shards that can be run on separate nodes (e.g. as a Slurm array job)
+    and reading the shard outputs back for the merge.
+
+    A shard is (index, count) with 0 <= index < count. Every shard writes its items into
+    <shard_dir>/shard-<index>-of-<count>/items/ and the extent of those items into extent.json.
+    The output of an earlier run of the shard is removed when the shard starts, and the new one is written into a
+    temporary folder that is renamed into place with extent.json in it, so a shard without extent.json did not finish
+    and a shard that did has no items left from earlier runs.
+"""
+import os
+import json
+import zlib
+import shutil
+from pathlib import Path
+from datetime import datetime
+
+def in_shard(name, shard):
+    """
+        name: Bucket or SAFE name
+        shard: (index, count) tuple
+        -> True if the name belongs to the shard
+
+        crc32 is used instead of hash() so that every process partitions the names the same way.
+    """
+
+    index, count = shard
+    return zlib.crc32(name.encode()) % count == index
+
+def shard_folder(shard_dir, shard):
+    """
+        shard_dir: Folder where all the shards are written
+        shard: (index, count) tuple
+    """
+
+    index, count = shard
+    return Path(shard_dir) / f"shard-{index}-of-{count}"
+
+def clear_shard(shard_dir, shard):
+    """
+        shard_dir: Folder where all the shards are written
+        shard: (index, count) tuple
+
+        Removes the output of an earlier run of the shard, so the merge does not take it while the shard is run again.
+    """
+
+    folder = shard_folder(shard_dir, shard)
+    if folder.exists():
+        shutil.rmtree(folder)
+
+def write_shard(shard_dir, shard, item_dicts, extent):
+    """
+        shard_dir: Folder where all the shards are written
+        shard: (index, count) tuple
+        item_dicts: list of STAC Item dicts made by the shard
+        extent: (bbox, start, end) of the items from sentinel_to_stac.items_extent(), None if there are no items
+    """
+
+    folder = shard_folder(shard_dir, shard)
+    # Not matched by the shard-*-of-* pattern of read_shard_extents()
+    temporary = folder.with_name(f".{folder.name}.tmp")
+    if temporary.exists():
+        shutil.rmtree(temporary)
+    (temporary / "items").mkdir(parents=True)
+
+    for item_dict in item_dicts:
+        with open(temporary / "items" / f"{item_dict['id']}.json", "w") as f:
+            json.dump(item_dict, f)
+
+    aggregates = {
+        "shard": shard[0],
+        "count": shard[1],
+        "items": len(item_dicts),
+        "bbox": list(extent[0]) if extent else None,
+        "interval": [extent[1].isoformat(), extent[2].isoformat()] if extent else None,
+    }
+    with open(temporary / "extent.json", "w") as f:
+        json.dump(aggregates, f)
+
+    if folder.exists():
+        shutil.rmtree(folder)
+    os.replace(temporary, folder)
+
+    print(f"Shard {shard[0]}/{shard[1]} saved: {len(item_dicts)} items")
+
+def read_shard_extents(shard_dir):
+    """
+        shard_dir: Folder where all the shards are written
+        -> list of the extent.json dicts of all shards
+
+        Raises ValueError if some of the shards are missing or the shards are from runs with different shard counts.
+    """
+
+    extents = []
+    for extentfile in sorted(Path(shard_dir).glob("shard-*-of-*/extent.json")):
+        with open(extentfile) as f:
+            extents.append(json.load(f))
+
+    counts = {x["count"] for x in extents}
+    if len(counts) != 1:
+        raise ValueError(f"Expected the shards of one run in {shard_dir}, found shard counts {sorted(counts)}")
+    count = counts.pop()
+    missing = set(range(count)) - {x["shard"] for x in extents}
+    if missing:
+        raise ValueError(f"Shards {sorted(missing)} of {count} have not finished")
+
+    return extents
+
+def merge_extents(extents):
+    """
+        extents: list of the extent.json dicts of the shards
+        -> (bbox, start, end) covering all the shards, None if none of the shards has items
+    """
+
+    extents = [x for x in extents if x["bbox"]]
+    if not extents:
+        return None
+
+    bbox = [
+        min(x["bbox"][0] for x in extents),
+        min(x["bbox"][1] for x in extents),
+        max(x["bbox"][2] for x in extents),
+        max(x["bbox"][3] for x in extents),
+    ]
+    start = min(datetime.fromisoformat(x["interval"][0]) for x in extents)
+    end = max(datetime.fromisoformat(x["interval"][1]) for x in extents)
+
+    return bbox, start, end
+
+def iter_shard_items(shard_dir, extents):
+    """
+        shard_dir: Folder where all the shards are written
+        extents: list of the extent.json dicts of the shards from read_shard_extents()
+        -> yields the STAC Item dicts of the shards in shard order
+    """
+
+    for extent in sorted(extents, key=lambda x: x["shard"]):
+        folder = shard_folder(shard_dir, (extent["shard"], extent["count"]))
+        for itemfile in sorted((folder / "items").glob("*.json")):
+            with open(itemfile) as f:
+                yield json.load(f)
@@ -0,0 +1,80 @@
+"""
+    Reading and writing the STAC JSON of the catalog, and the compact output profile.
+
+    Every item repeats the 13 band definitions of eo:bands at the item level and once more per band asset, although
+    the collection has them all in its summaries. The compact profile leaves them out of the items and writes the
+    JSON without indentation. The item files can also be stored gzipped as <id>.json.gz, the links to them end in
+    .json.gz then. The catalog.json and collection.json files always stay plain JSON so the entry points do not change.
+
+    The uploads can be sent gzipped with Content-Encoding: gzip as well.
+"""
+import json
+import gzip
+
+def read_json(path):
+    """
+        path: Path of a .json or .json.gz file
+        -> the parsed JSON
+    """
+
+    opener = gzip.open if str(path).endswith('.gz') else open
+    with opener(path, 'rt') as f:
+        return json.load(f)
+
+def write_json(content, path, compact=False):
+    """
+        content: JSON dict to write
+        path: Path of the file, gzipped if it ends in .gz
+        compact: If True, the JSON is written without indentation and spaces
+    """
+
+    opener = gzip.open if str(path).endswith('.gz') else open
+    with opener(path, 'wt') as f:
+        if compact:
+            json.dump(content, f, separators=(',', ':'))
+        else:
+            json.dump(content, f, indent=2)
+
+def compact_item(item_dict):
+    """
+        item_dict: STAC Item dict
+        -> the item dict without the eo:bands of the item and its assets, the bands are in the collection summaries
+    """
+
+    properties = {k: v for k, v in item_dict['properties'].items() if k != 'eo:bands'}
+    assets = {
+        key: {k: v for k, v in asset.items() if k != 'eo:bands'}
+        for key, asset in item_dict.get('assets', {}).items()
+    }
+
+    return {**item_dict, 'properties': properties, 'assets': assets}
+
+def gzip_links(content):
+    """
+        content: STAC Catalog or Collection dict
+        -> the dict with the links to the items pointing to the gzipped item files
+    """
+
+    links = [
+        {**link, 'href': link['href'] + '.gz'} if link['rel'] == 'item' and link['href'].endswith('.json') else link
+        for link in content['links']
+    ]
+
+    return {**content, 'links': links}
+
+def json_request(payload, use_gzip=False, headers=None):
+    """
+        payload: JSON dict to send
+        use_gzip: If True, the body is sent gzipped with Content-Encoding: gzip
+        headers: Other headers of the request
+        -> keyword arguments for requests, e.g. session.post(url, **json_request(payload))
+    """
+
+    if not use_gzip:
+        return {'json': payload, 'headers': headers}
+
+    body = gzip.compress(json.dumps(payload, separators=(',', ':')).encode())
+    return {
+        'data': body,
+        'headers': {**(headers or {}), 'Content-Type': 'application/json', 'Content-Encoding': 'gzip'},
+    }
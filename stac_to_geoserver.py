@@ -1,11 +1,17 @@
 import json
 import getpass
-import argparse
 from pathlib import Path
 import requests
 import pystac_client
 from requests.auth import HTTPBasicAuth
 from urllib.parse import urljoin
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from catalog_layout import iter_item_files
+from sync_state import content_hash, load_sync_state, save_sync_state, plan_sync
+from adaptive_limit import AdaptiveLimiter, request_with_limit
+from stac_io import read_json, json_request
+from stage_profiler import stage
 
 def json_convert(jsonfile):
 
@@ -17,8 +23,8 @@ def json_convert(jsonfile):
         or of type "Feature" (=Item). A number of properties are hardcoded into Sentinel-2 metadata as these are not collected in the STAC jsonfiles.
     """
 
-    with open(jsonfile) as f:
-        content = json.load(f)
+    # The item files may be gzipped
+    content = read_json(jsonfile)
     
     if content["type"] == "Collection":
 
@@ -106,12 +112,12 @@ def json_convert(jsonfile):
 
     return json.loads(json.dumps(new_json))
 
-if __name__ == "__main__":
+def main(args):
+
+    """
+        args: Parsed arguments of the publish command from s2stac.build_parser()
+    """
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--host", type=str, help="Hostname of the selected STAC API", required=True)
-    
-    args = parser.parse_args()
     pwd = getpass.getpass()
 
     collection_name = "sentinel2-l2a"
@@ -127,51 +133,91 @@ if __name__ == "__main__":
         catalog = pystac_client.Client.open(f"{args.host}/geoserver/ogc/stac/v1/", headers={"User-Agent":"update-script"})
 
     # Convert the STAC collection json into json that GeoServer can handle
-    converted = json_convert(collection_folder / "collection.json")
-
-    # Additional code for changing collection data if the collection already exists
-    collections = catalog.get_collections()
-    col_ids = [col.id for col in collections]
-    if collection_name in col_ids:
-        r = requests.put(urljoin(app_host + "collections/", collection_name), json=converted, auth=HTTPBasicAuth("admin", pwd))
-        r.raise_for_status()
-        print(f"Updated {collection_name}")
-    else:
-        r = requests.post(urljoin(app_host, "collections/"), json=converted, auth=HTTPBasicAuth("admin", pwd))
-        r.raise_for_status()
-        print(f"Added new collection: {collection_name}")
+    with stage('collection'):
+        converted = json_convert(collection_folder / "collection.json")
+
+        # Additional code for changing collection data if the collection already exists
+        collections = catalog.get_collections()
+        col_ids = [col.id for col in collections]
+        if collection_name in col_ids:
+            r = requests.put(urljoin(app_host + "collections/", collection_name), auth=HTTPBasicAuth("admin", pwd), **json_request(converted, args.gzip_upload))
+            r.raise_for_status()
+            print(f"Updated {collection_name}")
+        else:
+            r = requests.post(urljoin(app_host, "collections/"), auth=HTTPBasicAuth("admin", pwd), **json_request(converted, args.gzip_upload))
+            r.raise_for_status()
+            print(f"Added new collection: {collection_name}")
 
     # Get the posted items from the specific collection
-    posted = catalog.search(collections=[collection_name]).item_collection()
-    posted_ids = [x.id for x in posted]
+    with stage('posted'):
+        posted = catalog.search(collections=[collection_name]).item_collection()
+        posted_ids = [x.id for x in posted]
     print(f"Number of items: {len(posted_ids)}")
 
     with open(collection_folder / "collection.json") as f:
         rootcollection = json.load(f)
 
-    items = [x['href'] for x in rootcollection["links"] if x["rel"] == "item"]
-   
-    print("Uploading items:")
-    for i, item in enumerate(items):
-        with open(collection_folder / item) as f:
-            payload = json.load(f)
-        # Convert the STAC item json into json that GeoServer can handle
-        converted = json_convert(collection_folder / item)
+    # The items are found from the sub-catalogs as well, whatever layout the catalog was saved with
+    items = {}
+    hashes = {}
+    with stage('convert'):
+        for item in iter_item_files(collection_folder / "collection.json"):
+            # Convert the STAC item json into json that GeoServer can handle
+            converted = json_convert(item)
+            item_id = converted["properties"]["eop:identifier"]
+            items[item_id] = item
+            hashes[item_id] = content_hash(converted)
+
+    # Only the items that are new or changed since they were last sent are uploaded
+    products_url = urljoin(app_host, f"collections/{rootcollection['id']}/products")
+    sent = load_sync_state(args.sync_state or None, products_url)
+    new, changed, unchanged = plan_sync(hashes, sent, posted_ids)
+    print(f"New items: {len(new)}, changed items: {len(changed)}, unchanged items: {len(unchanged)}")
+
+    to_send = [(x, False) for x in new] + [(x, True) for x in changed]
+
+    limiter = AdaptiveLimiter(maximum=args.max_workers, latency_target=args.latency_target)
+    session = requests.Session()
+    session.auth = HTTPBasicAuth("admin", pwd)
+    adapter = HTTPAdapter(pool_connections=args.max_workers, pool_maxsize=args.max_workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    def upload(item_id, exists):
+        converted = json_convert(items[item_id])
         request_point = f"collections/{rootcollection['id']}/products"
-        if payload["id"] in posted_ids:
-            request_point = f"collections/{rootcollection['id']}/products/{payload['id']}"
-            r = requests.put(urljoin(app_host, request_point), json=converted, auth=HTTPBasicAuth("admin", pwd))
+        if exists:
+            request_point = f"collections/{rootcollection['id']}/products/{item_id}"
+            r = request_with_limit(limiter, session.put, urljoin(app_host, request_point), **json_request(converted, args.gzip_upload))
             r.raise_for_status()
         else:
-            r = requests.post(urljoin(app_host, request_point), json=converted, auth=HTTPBasicAuth("admin", pwd))
+            r = request_with_limit(limiter, session.post, urljoin(app_host, request_point), idempotent=False, **json_request(converted, args.gzip_upload))
             r.raise_for_status()
-        if len(items) >= 5: # Just to keep track that the script is still running
-            if i == int(len(items) / 5):
-                print("~20% of items added")
-            elif i == int(len(items) / 5) * 2:
-                print("~40% of items added")
-            elif i == int(len(items) / 5) * 3:
-                print("~60% of items added")
-            elif i == int(len(items) / 5) * 4:
-                print("~80% of items added")
-    print("All items added.")
\ No newline at end of file
+        sent[item_id] = hashes[item_id]
+
+    print("Uploading items:")
+    with stage('upload'):
+        try:
+            # The number of uploads in flight adapts to how fast GeoServer answers
+            with ThreadPoolExecutor(args.max_workers) as pool:
+                futures = [pool.submit(upload, item_id, exists) for item_id, exists in to_send]
+                for i, future in enumerate(as_completed(futures)):
+                    future.result()
+                    if len(to_send) >= 5: # Just to keep track that the script is still running
+                        if i == int(len(to_send) / 5):
+                            print("~20% of items added")
+                        elif i == int(len(to_send) / 5) * 2:
+                            print("~40% of items added")
+                        elif i == int(len(to_send) / 5) * 3:
+                            print("~60% of items added")
+                        elif i == int(len(to_send) / 5) * 4:
+                            print("~80% of items added")
+        finally:
+            # What was sent is saved also when the upload fails, so the next run continues from there
+            save_sync_state(args.sync_state or None, products_url, sent)
+    print("All items added.")
+
+if __name__ == "__main__":
+
+    from s2stac import parse_args, call_main
+    call_main(main, parse_args("publish"))
@@ -0,0 +1,275 @@
+"""
+    Profiling the stages of a run, e.g. the listing, the item building and the uploads, without external tools.
+
+    With --profile <dir> the run is profiled and, when it ends, the results are written into the folder:
+
+        <dir>/<stage>.collapsed One line per distinct stack with its number of samples, 'stage;outer;...;inner count',
+                                for flamegraph.pl, speedscope or inferno
+        <dir>/<stage>.prof      pstats file of the stage, with --profile-mode cprofile
+        <dir>/summary.txt       The hottest functions of every stage, by the samples (or time) spent in the function
+                                itself and by the samples with the function anywhere in the stack
+
+    The default sampling mode takes the stacks of all the threads every --profile-interval seconds from a background
+    thread, so the thread pools fetching SAFEs and uploading items are included and the overhead stays small. The
+    cprofile mode traces every call of the main thread only. Work done in other processes (the item building of
+    `build` with --processes) is not seen, use --processes 0 to profile it.
+
+    The threads waiting for work or for a lock (e.g. an idle pool thread in Condition.wait or queue.get, or the
+    process pool manager in selector.select) are not sampled, so the summary lists the functions doing the work. The
+    number of idle samples left out is given in summary.txt.
+
+    The scripts mark their stages with `with stage('name'):`, which does nothing when the run is not profiled. The
+    time outside the stages goes into the stage 'run'.
+"""
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager, nullcontext
+from collections import Counter, defaultdict
+
+# The profiler of the run, None when the run is not profiled
+active = None
+
+# (file, function) of the innermost Python frames of threads that are waiting and not working
+idle_functions = {
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    ('queue.py', 'get'),
+    ('selectors.py', 'select'),
+    ('connection.py', 'wait'),
+    # An idle thread of a ThreadPoolExecutor waits in the C get() of its work queue
+    ('thread.py', '_worker'),
+}
+
+def is_idle(code):
+    """
+        code: Code object of the innermost frame of a thread
+        -> True if the thread is waiting in one of the idle_functions
+    """
+
+    return (os.path.basename(code.co_filename), code.co_name) in idle_functions
+
+def frame_name(code):
+    """
+        code: Code object of a frame
+        -> name of the frame in the collapsed stacks, e.g. 'make_item (sentinel_to_stac.py:530)'
+    """
+
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ':')
+
+class StageProfiler:
+    """
+        output_dir: Folder where the results are written
+        mode: 'sample' or 'cprofile'
+        interval: Seconds between the samples in the sample mode
+        top: Number of functions listed per stage in summary.txt
+    """
+
+    def __init__(self, output_dir, mode='sample', interval=0.005, top=25):
+        self.output_dir = output_dir
+        self.mode = mode
+        self.interval = interval
+        self.top = top
+        self.stages = ['run']
+        self.samples = defaultdict(Counter)
+        self.idle = Counter()
+        self.profiles = {}
+        self.seconds = Counter()
+        self.lock = threading.Lock()
+        self.running = threading.Event()
+        self.sampler = None
+        self.started = None
+        self.stage_started = None
+
+    def start(self):
+        """
+            -> self, profiling from now on
+        """
+
+        self.started = time.perf_counter()
+        self.stage_started = self.started
+        if self.mode == 'sample':
+            self.running.set()
+            self.sampler = threading.Thread(target=self.sample_loop, name='stage-profiler', daemon=True)
+            self.sampler.start()
+        else:
+            self.enable('run')
+
+        print(f" * Profiling the run into {self.output_dir}")
+        return self
+
+    def sample_loop(self):
+        own = threading.get_ident()
+        while self.running.is_set():
+            with self.lock:
+                stage_name = self.stages[-1]
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if is_idle(frame.f_code):
+                    self.idle[stage_name] += 1
+                    continue
+                names = []
+                while frame is not None:
+                    names.append(frame_name(frame.f_code))
+                    frame = frame.f_back
+                self.samples[stage_name][';'.join([stage_name, *reversed(names)])] += 1
+            time.sleep(self.interval)
+
+    def enable(self, stage_name):
+        profile = self.profiles.setdefault(stage_name, cProfile.Profile())
+        profile.enable()
+
+    def disable(self, stage_name):
+        self.profiles[stage_name].disable()
+
+    def switch(self, stage_name):
+        """
+            stage_name: Stage that starts or continues, the time until now goes to the stage that was running
+        """
+
+        now = time.perf_counter()
+        with self.lock:
+            previous = self.stages[-1]
+            self.seconds[previous] += now - self.stage_started
+            self.stage_started = now
+        if self.mode == 'cprofile':
+            self.disable(previous)
+            self.enable(stage_name)
+
+    @contextmanager
+    def stage(self, stage_name):
+        self.switch(stage_name)
+        with self.lock:
+            self.stages.append(stage_name)
+        try:
+            yield
+        finally:
+            outer = self.stages[-2]
+            self.switch(outer)
+            with self.lock:
+                self.stages.pop()
+
+    def stop(self):
+        """
+            Stops the profiling and writes the results.
+        """
+
+        self.switch('run')
+        if self.mode == 'sample':
+            self.running.clear()
+            self.sampler.join()
+        else:
+            self.disable('run')
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        lines = [f"Profile of {time.perf_counter() - self.started:.2f} s, {self.mode} mode"]
+        if self.mode == 'sample':
+            for stage_name, stacks in self.samples.items():
+                write_collapsed(os.path.join(self.output_dir, f"{stage_name}.collapsed"), stacks)
+                lines += sample_summary(stage_name, stacks, self.seconds[stage_name], self.top, self.idle[stage_name])
+        else:
+            for stage_name, profile in self.profiles.items():
+                profile.dump_stats(os.path.join(self.output_dir, f"{stage_name}.prof"))
+                lines += profile_summary(stage_name, profile, self.seconds[stage_name], self.top)
+
+        summary = '\n'.join(lines) + '\n'
+        with open(os.path.join(self.output_dir, 'summary.txt'), 'w') as f:
+            f.write(summary)
+        print(summary)
+
+def write_collapsed(path, stacks):
+    """
+        path: File to write
+        stacks: Counter of the samples by collapsed stack
+    """
+
+    with open(path, 'w') as f:
+        for stack, count in sorted(stacks.items()):
+            f.write(f"{stack} {count}\n")
+
+def sample_summary(stage_name, stacks, seconds, top, idle=0):
+    """
+        stage_name: Name of the stage
+        stacks: Counter of the samples by collapsed stack
+        seconds: Wall clock time of the stage
+        top: Number of functions listed
+        idle: Number of the samples of waiting threads left out of the stacks
+        -> lines of the summary of the stage
+    """
+
+    own = Counter()
+    anywhere = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(';')[1:]
+        if not frames:
+            continue
+        own[frames[-1]] += count
+        # A recursive function is counted once per sample
+        for name in set(frames):
+            anywhere[name] += count
+    total = sum(stacks.values()) or 1
+
+    lines = ['', f"Stage {stage_name}: {seconds:.2f} s, {sum(stacks.values())} samples of all threads, {idle} idle samples left out", f"  {'self':>6} {'total':>6}  function"]
+    for name, count in own.most_common(top):
+        lines.append(f"  {100 * count / total:5.1f}% {100 * anywhere[name] / total:5.1f}%  {name}")
+
+    return lines
+
+def profile_summary(stage_name, profile, seconds, top):
+    """
+        stage_name: Name of the stage
+        profile: cProfile.Profile of the stage
+        seconds: Wall clock time of the stage
+        top: Number of functions listed
+        -> lines of the summary of the stage
+    """
+
+    stats = pstats.Stats(profile).stats
+    # (file, line, function) -> (primitive calls, calls, own time, cumulative time, callers)
+    rows = sorted(stats.items(), key=lambda x: x[1][2], reverse=True)[:top]
+
+    lines = ['', f"Stage {stage_name}: {seconds:.2f} s in the main thread", f"  {'self s':>8} {'total s':>8} {'calls':>8}  function"]
+    for (filename, line, function), (_, calls, own, cumulative, _) in rows:
+        lines.append(f"  {own:8.3f} {cumulative:8.3f} {calls:8d}  {function} ({os.path.basename(filename)}:{line})")
+
+    return lines
+
+def stage(stage_name):
+    """
+        stage_name: Name of the stage, e.g. 'list'
+        -> context manager attributing the time inside it to the stage, nothing is done when the run is not profiled
+    """
+
+    if active is None:
+        return nullcontext()
+
+    return active.stage(stage_name)
+
+def start_profiler(args):
+    """
+        args: Parsed arguments with the profile options of s2stac.add_profile_arguments()
+        -> started StageProfiler, None if --profile was not given
+    """
+
+    global active
+
+    if not getattr(args, 'profile', None):
+        return None
+
+    active = StageProfiler(args.profile, args.profile_mode, args.profile_interval, args.profile_top).start()
+    return active
+
+def stop_profiler(profiler):
+    """
+        profiler: StageProfiler from start_profiler(), or None
+    """
+
+    global active
+
+    if profiler:
+        profiler.stop()
+    active = None
@@ -0,0 +1,79 @@
+"""
+    Keeping track of what has been sent to a server, so that only new and changed items are sent again.
+
+    The state file has a stable hash of every payload that was sent successfully, per target URL:
+
+        {"https://host/geoserver/rest/oseo/collections/sentinel2-l2a/products": {"<item id>": "<sha256>"}}
+
+    Before any requests are made the items are sorted into new, changed and unchanged by comparing the hashes
+    of the payloads to the state, and the unchanged ones are not sent.
+"""
+import os
+import json
+import hashlib
+
+def content_hash(payload):
+    """
+        payload: JSON dict that is sent to the server
+        -> sha256 hex digest of the payload, the same for equal dicts whatever the order of their keys
+    """
+
+    serialized = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+def load_sync_state(path, target):
+    """
+        path: JSON file of the sync state, None to not use a state (everything is sent)
+        target: URL the payloads are sent to
+        -> dict of the hashes sent to the target by the item ids
+    """
+
+    if not path or not os.path.exists(path):
+        return {}
+
+    with open(path) as f:
+        return json.load(f).get(target, {})
+
+def save_sync_state(path, target, hashes):
+    """
+        path: JSON file of the sync state, nothing is saved if None
+        target: URL the payloads were sent to
+        hashes: dict of the hashes sent to the target by the item ids
+    """
+
+    if not path:
+        return
+
+    state = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            state = json.load(f)
+    state[target] = hashes
+
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+def plan_sync(hashes, sent, existing_ids=None):
+    """
+        hashes: dict of the hashes of the current payloads by the item ids
+        sent: dict of the hashes sent earlier by the item ids, from load_sync_state()
+        existing_ids: Ids the server has, if known. Otherwise the ids in sent are taken to exist on the server
+        -> (new, changed, unchanged) lists of item ids
+    """
+
+    if existing_ids is None:
+        existing_ids = sent.keys()
+    existing_ids = set(existing_ids)
+
+    new, changed, unchanged = [], [], []
+    for item_id, payload_hash in hashes.items():
+        if item_id not in existing_ids:
+            new.append(item_id)
+        elif sent.get(item_id) == payload_hash:
+            unchanged.append(item_id)
+        else:
+            # Also the items that are on the server but were not sent with this state, as their content is not known
+            changed.append(item_id)
+
+    return new, changed, unchanged
@@ -0,0 +1,75 @@
+import time
+import threading
+from adaptive_limit import AdaptiveLimiter, parse_retry_after, request_with_limit
+
+def test_limit_grows_with_fast_requests():
+    limiter = AdaptiveLimiter(initial=2, maximum=4, latency_target=1.0)
+    for _ in range(20):
+        limiter.acquire()
+        limiter.release(0.01)
+    assert limiter.limit == 4
+
+def test_limit_is_halved_once_per_round_trip():
+    limiter = AdaptiveLimiter(initial=8, maximum=8, latency_target=1.0)
+    for _ in range(3):
+        limiter.acquire()
+    # Three requests of the same round trip fail, only the first lowers the limit
+    for _ in range(3):
+        limiter.release(0.5, ok=False)
+    assert limiter.limit == 4
+
+def test_slow_responses_lower_the_limit():
+    limiter = AdaptiveLimiter(initial=4, minimum=1, latency_target=0.1)
+    limiter.acquire()
+    limiter.release(0.5)
+    assert limiter.limit == 2
+
+def test_limit_stays_at_the_minimum():
+    limiter = AdaptiveLimiter(initial=1, minimum=1)
+    limiter.acquire()
+    limiter.release(0.0, ok=False)
+    assert limiter.limit == 1
+
+def test_acquire_waits_for_a_free_slot():
+    limiter = AdaptiveLimiter(initial=1)
+    limiter.acquire()
+    acquired = threading.Event()
+
+    def second():
+        limiter.acquire()
+        acquired.set()
+
+    thread = threading.Thread(target=second)
+    thread.start()
+    assert not acquired.wait(0.05)
+    limiter.release(0.01)
+    assert acquired.wait(1)
+    thread.join()
+
+def test_retry_after_pauses_new_requests():
+    limiter = AdaptiveLimiter(initial=4)
+    limiter.acquire()
+    limiter.release(0.01, ok=False, retry_after=0.2)
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.15
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+
+def test_failed_request_frees_its_slot():
+    limiter = AdaptiveLimiter(initial=1)
+
+    def method(url, **kwargs):
+        raise ValueError('body cannot be serialized')
+
+    try:
+        request_with_limit(limiter, method, 'http://geoserver/products')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('the error of the request was not raised')
+    assert limiter.in_flight == 0
@@ -0,0 +1,78 @@
+from datetime import date
+from catalog_index import open_index, index_row, add_items, query_index, index_item_dicts, write_metadata, published_metadata, check_published_index
+
+def item(safe, datetime, cloud_cover, bbox):
+    return {
+        'id': safe,
+        'bbox': bbox,
+        'properties': {'datetime': datetime, 'eo:cloud_cover': cloud_cover, 'baseline': '5.09'},
+    }
+
+items = [
+    item('S2A_MSIL2A_20230605T095031_N0509_R079_T34VEM_20230605T120000', '2023-06-05T00:00:00Z', 10.0, [22.0, 60.0, 24.0, 61.0]),
+    item('S2B_MSIL2A_20230610T095031_N0509_R036_T35VLG_20230610T120000', '2023-06-10T00:00:00Z', 55.0, [24.5, 62.0, 26.5, 63.0]),
+    item('S2A_MSIL2A_20230701T095031_N0509_R079_T34VEM_20230701T120000', '2023-07-01T00:00:00Z', 5.0, [22.0, 60.0, 24.0, 61.0]),
+]
+
+def index():
+    connection = open_index(':memory:')
+    add_items(connection, (index_row(x) for x in items))
+    return connection
+
+def ids(rows):
+    return [row['id'][:19] for row in rows]
+
+def test_index_row_from_the_safe_name():
+    row = dict(zip(['id', 'datetime', 'cloud_cover', 'orbit', 'tile', 'mission'], index_row(items[0])))
+    assert row['orbit'] == 79
+    assert row['tile'] == '34VEM'
+    assert row['mission'] == 'S2A'
+
+def test_query_everything_newest_first():
+    assert ids(query_index(index())) == ['S2A_MSIL2A_20230701', 'S2B_MSIL2A_20230610', 'S2A_MSIL2A_20230605']
+
+def test_query_bbox():
+    assert ids(query_index(index(), bbox=(25.0, 62.5, 25.5, 62.7))) == ['S2B_MSIL2A_20230610']
+    assert query_index(index(), bbox=(0.0, 0.0, 1.0, 1.0)) == []
+
+def test_query_dates_include_the_last_day():
+    assert ids(query_index(index(), since=date(2023, 6, 5), until=date(2023, 6, 10))) == ['S2B_MSIL2A_20230610', 'S2A_MSIL2A_20230605']
+
+def test_query_tile_cloud_orbit_and_limit():
+    connection = index()
+    assert ids(query_index(connection, tiles=['34VEM'], max_cloud=8)) == ['S2A_MSIL2A_20230701']
+    assert ids(query_index(connection, orbits=[36])) == ['S2B_MSIL2A_20230610']
+    assert len(query_index(connection, limit=1)) == 1
+
+def test_items_added_again_are_replaced():
+    connection = index()
+    add_items(connection, [index_row({**items[0], 'properties': {**items[0]['properties'], 'eo:cloud_cover': 90.0}})])
+    rows = query_index(connection, ids=[items[0]['id']])
+    assert len(rows) == 1
+    assert rows[0]['cloud_cover'] == 90.0
+    assert rows[0]['bbox'] == items[0]['bbox']
+
+def refused(path, host, collection):
+    try:
+        check_published_index(path, host, collection)
+    except ValueError:
+        return True
+    return False
+
+def test_published_index_is_tied_to_the_host_and_collection(tmp_path):
+    path = str(tmp_path / 'published.sqlite')
+    index_item_dicts(path, items, published_metadata('https://geoserver/geoserver/rest/oseo/', 'sentinel2-l2a'))
+    assert not refused(path, 'https://geoserver/geoserver/rest/oseo', 'sentinel2-l2a')
+    assert refused(path, 'https://other/geoserver/rest/oseo/', 'sentinel2-l2a')
+    assert refused(path, 'https://geoserver/geoserver/rest/oseo/', 'landsat')
+
+def test_build_index_is_not_taken_as_published(tmp_path):
+    path = str(tmp_path / 'Sentinel2-index.sqlite')
+    connection = open_index(path)
+    write_metadata(connection, {'source': 'build', 'catalog': 'Sentinel2-tileless'})
+    add_items(connection, (index_row(x) for x in items))
+    connection.close()
+    assert refused(path, 'https://geoserver/geoserver/rest/oseo/', 'sentinel2-l2a')
+    # An index without metadata is refused as well
+    index_item_dicts(str(tmp_path / 'old.sqlite'), items)
+    assert refused(str(tmp_path / 'old.sqlite'), 'https://geoserver/geoserver/rest/oseo/', 'sentinel2-l2a')
@@ -0,0 +1,65 @@
+from xml.dom import minidom
+from metadata_reader import XmlHead, read_xml_head, crs_tags
+
+document = (
+    b'<?xml version="1.0" encoding="UTF-8"?>\n'
+    b'<n1:Level-2A_Tile_ID xmlns:n1="https://psd-14.sentinel2.eo.esa.int/PSD/S2_PDI_Level-2A_Tile_Metadata.xsd">'
+    b'<n1:Geometric_Info><Tile_Geocoding>'
+    b'<HORIZONTAL_CS_CODE>EPSG:32634</HORIZONTAL_CS_CODE>'
+    b'<Size resolution="10"><NROWS>10980</NROWS><NCOLS>10980</NCOLS></Size>'
+    b'</Tile_Geocoding><Tile_Angles>' + b'<VALUES>1 2 3</VALUES>' * 2000 + b'</Tile_Angles>'
+    b'</n1:Geometric_Info></n1:Level-2A_Tile_ID>'
+)
+
+def feed_in_chunks(xmlhead, data, size):
+    for start in range(0, len(data), size):
+        if xmlhead.feed(data[start:start + size]):
+            return True
+    return False
+
+def test_head_ends_after_the_wanted_elements():
+    xmlhead = XmlHead(crs_tags)
+    assert feed_in_chunks(xmlhead, document, 64)
+    head = xmlhead.head()
+    assert '<VALUES>' not in head
+    # The open elements are closed, so the head parses
+    with minidom.parseString(head) as doc:
+        assert doc.getElementsByTagName('HORIZONTAL_CS_CODE')[0].firstChild.data == 'EPSG:32634'
+        assert len(doc.getElementsByTagName('Size')) == 1
+
+def test_whole_document_when_an_element_is_missing():
+    xmlhead = XmlHead(crs_tags + ('Cloud_Coverage_Assessment',))
+    assert not feed_in_chunks(xmlhead, document, 1000)
+    assert xmlhead.head() == document.decode()
+
+class RangeClient:
+    """
+        get_object of one document that honours the Range header like S3
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.ranges = []
+
+    def get_object(self, Bucket, Key, Range):
+        first, last = (int(x) for x in Range[len('bytes='):].split('-'))
+        self.ranges.append((first, last))
+        chunk = self.data[first:last + 1]
+
+        class Body:
+            def read(self):
+                return chunk
+
+        return {'Body': Body(), 'ContentRange': f'bytes {first}-{first + len(chunk) - 1}/{len(self.data)}'}
+
+def test_read_xml_head_asks_for_growing_ranges():
+    client = RangeClient(document)
+    head = read_xml_head(client, 'bucket', 'MTD_TL.xml', crs_tags, first_range=100)
+    assert 'EPSG:32634' in head
+    assert client.ranges[:3] == [(0, 99), (100, 299), (300, 699)]
+    assert client.ranges[-1][1] < len(document) - 1
+
+def test_read_xml_head_stops_at_the_end_of_the_file():
+    client = RangeClient(document)
+    head = read_xml_head(client, 'bucket', 'MTD_TL.xml', ('Missing',), first_range=4096)
+    assert head == document.decode()
@@ -0,0 +1,56 @@
+import json
+import pytest
+
+pytest.importorskip('requests')
+import post_stac
+
+class Response:
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise post_stac.requests.HTTPError(f'{self.status_code} Error')
+
+class UnchangedApi:
+    """
+        STAC FastAPI where every item exists and is unchanged: the POST answers 409 and the PUT 404
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    def post(self, url, json):
+        self.requests.append(('POST', url))
+        return Response(409)
+
+    def put(self, url, json):
+        self.requests.append(('PUT', url))
+        return Response(404)
+
+def write_collection(folder, ids):
+    links = [{'rel': 'item', 'href': f'{item_id}/{item_id}.json'} for item_id in ids]
+    with open(folder / 'collection.json', 'w') as f:
+        json.dump({'type': 'Collection', 'id': 'sentinel2-l2a', 'links': links}, f)
+    for item_id in ids:
+        (folder / item_id).mkdir()
+        with open(folder / item_id / f'{item_id}.json', 'w') as f:
+            json.dump({'type': 'Feature', 'id': item_id, 'properties': {}}, f)
+
+def test_unchanged_put_counts_as_stored():
+    api = UnchangedApi()
+    post_stac.post_or_put('http://api/collections/c/items', {'type': 'Feature', 'id': 'a'}, api)
+    assert api.requests == [('POST', 'http://api/collections/c/items'), ('PUT', 'http://api/collections/c/items/a')]
+
+def test_unchanged_items_are_not_sent_again(tmp_path, monkeypatch):
+    write_collection(tmp_path, ['a', 'b'])
+    api = UnchangedApi()
+    monkeypatch.setattr(post_stac, 'make_session', lambda workers: api)
+    state = str(tmp_path / 'sync_state.json')
+
+    post_stac.ingest_sentinel_data('http://api/', tmp_path, workers=1, bulk=False, sync_state=state)
+    assert len(api.requests) == 4
+    api.requests.clear()
+    post_stac.ingest_sentinel_data('http://api/', tmp_path, workers=1, bulk=False, sync_state=state)
+    assert api.requests == []
@@ -0,0 +1,128 @@
+from safe_listing import group_safes, list_partitions, iter_partitioned_keys, iter_safes, list_safes, safe_contents, iter_safe_objects
+
+safes = [
+    'S2A_MSIL2A_20180705T095031_N0208_R079_T34VEM_20180705T120000.SAFE',
+    'S2A_MSIL2A_20180706T095031_N0208_R079_T34VFN_20180706T120000.SAFE',
+    'S2B_MSIL2A_20180705T095031_N0208_R079_T35VLG_20180705T120000.SAFE',
+]
+
+def safe_keys(safe, folder=''):
+    return [f'{folder}{safe}/{name}' for name in ('GRANULE/L2A/MTD_TL.xml', 'MTD_MSIL2A.xml', 'manifest.safe')]
+
+class ListingClient:
+    """
+        list_objects_v2 pagination of a list of keys, with Prefix and Delimiter like S3
+    """
+
+    def __init__(self, keys, page_size=2):
+        self.keys = sorted(keys)
+        self.page_size = page_size
+        self.calls = 0
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, Prefix='', Delimiter=None):
+        entries = []
+        for key in self.keys:
+            if not key.startswith(Prefix):
+                continue
+            cut = key.find(Delimiter, len(Prefix)) if Delimiter else -1
+            if cut == -1:
+                entries.append(('Contents', {'Key': key}))
+            elif not entries or entries[-1] != ('CommonPrefixes', {'Prefix': key[:cut + 1]}):
+                entries.append(('CommonPrefixes', {'Prefix': key[:cut + 1]}))
+
+        for start in range(0, max(len(entries), 1), self.page_size):
+            self.calls += 1
+            page = {}
+            for kind, entry in entries[start:start + self.page_size]:
+                page.setdefault(kind, []).append(entry)
+            yield page
+
+def test_group_safes():
+    keys = ['index.html'] + [key for safe in safes for key in safe_keys(safe)]
+    grouped = list(group_safes(sorted(keys)))
+    assert [safe for safe, _ in grouped] == safes
+    assert all(contents == safe_keys(safe) for safe, contents in grouped)
+
+def test_group_safes_in_year_folders():
+    keys = [key for safe in safes for key in safe_keys(safe, '2018/')]
+    grouped = list(group_safes(sorted(keys)))
+    assert [safe for safe, _ in grouped] == safes
+    assert grouped[0][1] == safe_keys(safes[0], '2018/')
+
+def test_list_partitions():
+    keys = [key for safe in safes for key in safe_keys(safe, '2018/')] + safe_keys(safes[0], '2019/') + ['index.html']
+    client = ListingClient(keys)
+    assert list_partitions(client, 'bucket') == ['2018/S2A_', '2018/S2B_', '2019/S2A_']
+    assert list_partitions(client, 'bucket', skip_year=lambda year: year == 2018) == ['2019/S2A_']
+
+def test_partitioned_keys_are_merged_in_key_order():
+    keys = [key for safe in safes for key in safe_keys(safe)]
+    client = ListingClient(keys)
+    partitioned = list(iter_partitioned_keys(client, 'bucket', list_partitions(client, 'bucket'), list_workers=3, buffer_pages=1))
+    assert partitioned == sorted(keys)
+
+def test_partition_errors_are_raised_to_the_caller():
+    class FailingClient(ListingClient):
+        def paginate(self, Bucket, Prefix='', Delimiter=None):
+            if Prefix == 'S2B_':
+                raise ConnectionError('listing failed')
+            yield from super().paginate(Bucket, Prefix, Delimiter)
+
+    keys = [key for safe in safes for key in safe_keys(safe)]
+    client = FailingClient(keys)
+    listed = []
+    try:
+        for key in iter_partitioned_keys(client, 'bucket', ['S2A_', 'S2B_'], list_workers=2):
+            listed.append(key)
+    except ConnectionError:
+        pass
+    else:
+        raise AssertionError('the error of the partition was not raised')
+    assert listed == [key for safe in safes[:2] for key in safe_keys(safe)]
+
+def test_iter_safes_same_with_every_discovery():
+    keys = [key for safe in safes for key in safe_keys(safe, '2018/')] + safe_keys(safes[1], '2019/')
+    expected = list(group_safes(sorted(keys)))
+    for discovery in ('auto', 'delimiter', 'list'):
+        for list_workers in (1, 3):
+            assert list(iter_safes(ListingClient(keys), 'bucket', discovery, list_workers=list_workers)) == expected
+
+def test_iter_safes_skips_before_listing_the_keys():
+    keys = [key for safe in safes for key in safe_keys(safe)]
+    skip = lambda safename: safename.startswith('S2A')
+    client = ListingClient(keys, page_size=1000)
+    assert [safe for safe, _ in iter_safes(client, 'bucket', 'auto', skip)] == safes[2:]
+    # One call for the SAFE prefixes and one for the keys of the SAFE that was not skipped
+    assert client.calls == 2
+
+def test_list_safes_lists_the_keys_only_when_asked():
+    keys = [key for safe in safes for key in safe_keys(safe, '2018/')]
+    skip = lambda safename: safename.startswith('S2B')
+    client = ListingClient(keys, page_size=1000)
+    listed = list(list_safes(client, 'bucket', 'auto', skip))
+    assert listed == [(safe, f'2018/{safe}/') for safe in safes[:2]]
+    # The year pseudofolders and the SAFE prefixes, no keys yet
+    assert client.calls == 2
+    assert [(safe, safe_contents(client, 'bucket', listing)) for safe, listing in listed] == list(group_safes(sorted(keys)))[:2]
+    assert list(list_safes(ListingClient(keys), 'bucket', 'list', skip)) == list(group_safes(sorted(keys)))[:2]
+
+def test_iter_safe_objects_same_with_every_discovery():
+    keys = [key for safe in safes for key in safe_keys(safe, '2018/')] + safe_keys(safes[1], '2019/')
+    skip = lambda safename: safename.startswith('S2B')
+    expected = [(safe, [{'Key': key} for key in contents]) for safe, contents in group_safes(sorted(keys)) if not skip(safe)]
+    for discovery in ('auto', 'delimiter', 'list'):
+        for list_workers in (1, 3):
+            assert list(iter_safe_objects(ListingClient(keys), 'bucket', discovery, skip, list_workers=list_workers)) == expected
+
+def test_partitions_not_started_are_not_listed_after_an_early_stop():
+    partitions = [f'S2{chr(ord("A") + i)}_' for i in range(10)]
+    keys = [f'{partition}{n}' for partition in partitions for n in range(2)]
+    client = ListingClient(keys, page_size=1)
+    listed = iter_partitioned_keys(client, 'bucket', partitions, list_workers=2, buffer_pages=1)
+    assert next(listed) == keys[0]
+    listed.close()
+    # Only the two partitions being listed made requests, each of them at most its two pages
+    assert client.calls <= 4
@@ -0,0 +1,34 @@
+from safe_names import parse_safe_name, safe_of_uri, parse_band_file
+
+safe = 'S2A_MSIL2A_20180705T095031_N0208_R079_T34VEM_20180705T120000'
+
+def test_parse_safe_name():
+    parsed = parse_safe_name(safe + '.SAFE')
+    assert parsed.name == safe
+    assert parsed.mission == 'S2A'
+    assert parsed.level == 'L2A'
+    assert parsed.sensing == '20180705T095031'
+    assert parsed.baseline == '0208'
+    assert parsed.orbit == 79
+    assert parsed.tile == '34VEM'
+    assert parsed.product == '20180705T120000'
+
+def test_parse_safe_name_without_suffix_and_with_slash():
+    assert parse_safe_name(safe) == parse_safe_name(safe + '.SAFE/')
+
+def test_parse_safe_name_rejects_other_names():
+    assert parse_safe_name('index.html') is None
+    assert parse_safe_name('S2A_MSIL2A_20180705T095031_N0208_R079_T34VEM') is None
+    assert parse_safe_name('2018/' + safe + '.SAFE') is None
+
+def test_safe_of_uri_with_underscores_in_the_bucket():
+    uri = f'https://a3s.fi/Sentinel2_bucket_2018/{safe}.SAFE/GRANULE/L2A/IMG_DATA/R10m/T34VEM_20180705T095031_B02_10m.jp2'
+    assert safe_of_uri(uri).tile == '34VEM'
+
+def test_parse_band_file():
+    bandfile = parse_band_file('IMG_DATA/R20m/T34VEM_20180705T095031_B8A_20m_geo.jp2')
+    assert bandfile.key == 'B8A_20m'
+    assert bandfile.band == 'B8A'
+    assert bandfile.resolution == '20'
+    assert bandfile.geo
+    assert parse_band_file('QI_DATA/MSK_CLDPRB_20m.gml') is None
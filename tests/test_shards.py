@@ -0,0 +1,35 @@
+from datetime import datetime
+from shards import merge_extents, in_shard, shard_folder, write_shard, read_shard_extents, iter_shard_items
+from checkpoints import write_quarantine
+
+def extent(shard, bbox, interval):
+    return {'shard': shard, 'count': 3, 'items': 1 if bbox else 0, 'bbox': bbox, 'interval': interval}
+
+def test_merge_extents():
+    merged = merge_extents([
+        extent(0, [20, 60, 21, 61], ['2018-07-05T00:00:00', '2018-08-01T00:00:00']),
+        extent(1, None, None),
+        extent(2, [19, 62, 20.5, 63], ['2017-05-01T00:00:00', '2018-07-10T00:00:00']),
+    ])
+    assert merged == ([19, 60, 21, 63], datetime(2017, 5, 1), datetime(2018, 8, 1))
+
+def test_merge_extents_without_items():
+    assert merge_extents([extent(0, None, None), extent(1, None, None)]) is None
+    assert merge_extents([]) is None
+
+def test_every_name_is_in_one_shard():
+    names = [f'bucket-{i}' for i in range(100)]
+    for name in names:
+        assert sum(in_shard(name, (i, 4)) for i in range(4)) == 1
+
+def test_empty_shard_is_finished(tmp_path):
+    shard_dir = tmp_path / 'shards'
+    # A shard that got no buckets has no bucket checkpoints, so its checkpoint folder does not exist yet
+    for shard in [(0, 2), (1, 2)]:
+        assert write_quarantine(shard_folder(tmp_path / 'checkpoints', shard)) == []
+    write_shard(shard_dir, (0, 2), [], None)
+    write_shard(shard_dir, (1, 2), [{'id': 'item'}], ([20, 60, 21, 61], datetime(2018, 7, 5), datetime(2018, 7, 5)))
+    extents = read_shard_extents(shard_dir)
+    assert [x['items'] for x in extents] == [0, 1]
+    assert [x['id'] for x in iter_shard_items(shard_dir, extents)] == ['item']
+    assert merge_extents(extents) == ([20, 60, 21, 61], datetime(2018, 7, 5), datetime(2018, 7, 5))
@@ -0,0 +1,25 @@
+import time
+import threading
+from stage_profiler import StageProfiler
+
+def busy(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+
+def test_waiting_threads_are_not_sampled(tmp_path):
+    profiler = StageProfiler(str(tmp_path), interval=0.001).start()
+    release = threading.Event()
+    waiting = threading.Thread(target=release.wait)
+    waiting.start()
+    with profiler.stage('work'):
+        busy(0.2)
+    release.set()
+    waiting.join()
+    profiler.stop()
+
+    stacks = profiler.samples['work']
+    assert any(stack.split(';')[-1].startswith('busy ') for stack in stacks)
+    assert not any(stack.split(';')[-1].startswith('wait (threading.py') for stack in stacks)
+    assert profiler.idle['work'] > 0
+    assert 'idle samples left out' in (tmp_path / 'summary.txt').read_text()
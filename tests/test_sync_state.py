@@ -0,0 +1,18 @@
+from sync_state import plan_sync
+
+def test_plan_sync_from_the_sent_hashes():
+    hashes = {'a': '1', 'b': '2', 'c': '3'}
+    sent = {'a': '1', 'b': 'old'}
+    assert plan_sync(hashes, sent) == (['c'], ['b'], ['a'])
+
+def test_plan_sync_with_the_ids_on_the_server():
+    hashes = {'a': '1', 'b': '2', 'c': '3'}
+    sent = {'a': '1', 'b': '2'}
+    # b was removed from the server, c was put there by someone else
+    new, changed, unchanged = plan_sync(hashes, sent, existing_ids=['a', 'c'])
+    assert new == ['b']
+    assert changed == ['c']
+    assert unchanged == ['a']
+
+def test_plan_sync_without_state_sends_everything():
+    assert plan_sync({'a': '1'}, {}) == (['a'], [], [])
@@ -0,0 +1,142 @@
+"""
+    Cache of the geometries of the MGRS tiles.
+
+    Every SAFE of the same MGRS tile (34VEM, 35VLH, ...) has the same footprint and the same transform, so the
+    WGS84 bbox, polygon and proj:transform are computed with rasterio only for the first SAFE of each tile and
+    looked up from the cache for the rest. The cache is a JSON file so it is kept between the runs:
+
+        {"34VEM_32634": {"epsg": 32634, "bbox": [...], "geometry": {...}, "transform": {"10": [...]}}}
+
+    The transform depends on the resolution of the image the item is made from, so it is stored per resolution.
+
+    The cache is shared by the threads fetching the SAFEs. The first SAFE of a tile holds the lock of the tile from
+    tile_lock() while its image is read, so the SAFEs of the same tile fetched at the same time wait for it and find
+    the tile from the cache instead of all reading their images.
+"""
+import os
+import re
+import json
+import threading
+from functools import lru_cache
+from rasterio.crs import CRS
+from safe_names import parse_band_file
+
+# The tile in a SAFE name, e.g. S2A_MSIL2A_20180705T095031_N0208_R079_T34VEM_20180705T120000 -> 34VEM
+tile_pattern = re.compile(r"_T(\d{2}[C-X][A-Z]{2})_")
+
+# Guards the cache dicts and tile_locks
+lock = threading.Lock()
+tile_locks = {}
+
+@lru_cache(maxsize=None)
+def epsg_crs(epsg):
+    """
+        epsg: EPSG code as int
+        -> rasterio CRS, made only once per EPSG code
+    """
+
+    return CRS.from_epsg(epsg)
+
+def tile_of(safename):
+    """
+        safename: SAFE name with or without the .SAFE suffix
+        -> MGRS tile id, e.g. '34VEM', or None if the name has no tile
+    """
+
+    match = tile_pattern.search(safename + '_')
+    return match.group(1) if match else None
+
+def utm_epsg(tile):
+    """
+        tile: MGRS tile id, e.g. '34VEM'
+        -> EPSG code of the UTM zone of the tile, e.g. 32634. Latitude bands N and above are on the northern hemisphere
+    """
+
+    return (32600 if tile[2] >= 'N' else 32700) + int(tile[:2])
+
+def load_tile_cache(path):
+    """
+        path: JSON file of the cache, no file is read if None
+        -> cache dict, empty if the file does not exist yet
+    """
+
+    if not path or not os.path.exists(path):
+        return {}
+
+    with open(path) as f:
+        return json.load(f)
+
+def save_tile_cache(path, cache):
+    """
+        path: JSON file of the cache, nothing is saved if None
+        cache: cache dict
+
+        The file is written to a temporary file and renamed, so an interrupted run does not leave a broken cache.
+    """
+
+    if not path:
+        return
+
+    with open(path + '.tmp', 'w') as f, lock:
+        json.dump(cache, f)
+    os.replace(path + '.tmp', path)
+
+def tile_lock(safename):
+    """
+        safename: SAFE name
+        -> threading.Lock of the tile of the SAFE, held while the geometry of the tile is looked up and read
+    """
+
+    with lock:
+        return tile_locks.setdefault(tile_of(safename), threading.Lock())
+
+def lookup_tile_geometry(cache, safename, uri):
+    """
+        cache: cache dict
+        safename: SAFE name of the item
+        uri: URL of the image the item is made from
+        -> dict with the epsg, bbox, geometry and transform of the tile, or None if it is not cached yet
+    """
+
+    tile = tile_of(safename)
+    bandfile = parse_band_file(uri)
+    if not tile or not bandfile:
+        return None
+
+    epsg = utm_epsg(tile)
+    with lock:
+        entry = cache.get(f"{tile}_{epsg}")
+        if not entry or bandfile.resolution not in entry['transform']:
+            return None
+
+        return {
+            'epsg': entry['epsg'],
+            'bbox': entry['bbox'],
+            'geometry': entry['geometry'],
+            'transform': entry['transform'][bandfile.resolution],
+        }
+
+def remember_tile_geometry(cache, item_dict):
+    """
+        cache: cache dict
+        item_dict: STAC Item dict made with make_item()
+
+        Stores the geometry of the item for its tile, if the tile and resolution are not cached yet.
+    """
+
+    tile = tile_of(item_dict['id'])
+    if not tile:
+        return
+
+    epsg = item_dict['properties']['proj:epsg']
+    transform = list(item_dict['properties']['proj:transform'])
+    resolution = str(int(abs(transform[0])))
+
+    with lock:
+        entry = cache.setdefault(f"{tile}_{epsg}", {
+            'epsg': epsg,
+            'bbox': list(item_dict['bbox']),
+            'geometry': item_dict['geometry'],
+            'transform': {},
+        })
+        entry['transform'].setdefault(resolution, transform)
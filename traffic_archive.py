@@ -0,0 +1,476 @@
+"""
+    Recording the S3, image and HTTP traffic of a run, and replaying it without network.
+
+    With --record <dir> every exchange of the run with Allas and GeoServer is written into the folder:
+
+        <dir>/exchanges.jsonl   One line per exchange: {"service", "key", "request", "response", "blob", "seconds"}
+        <dir>/blobs/<sha256>.gz The gzipped bodies of the S3 objects and HTTP responses, stored once per content
+
+    The services are 's3' (every boto3 client call, the list_objects_v2 pages included), 'raster' (the bounds,
+    transform and shape read from the images with rasterio.open(), which GDAL reads with ranged HTTP requests that
+    cannot be recorded one by one) and 'http' (every request of requests, pystac_client included). Failed calls are
+    recorded as well and raised again in the replay.
+
+    With --replay <dir> the same calls are answered from the folder, so the run makes no connections at all. A request
+    is matched by its method, URL or key and body; a request made several times gets the recorded responses in the
+    order they were recorded, and the last one again after them. With --replay-latency every answer waits as long
+    as the recorded call took, so the replayed run can be profiled with the timing of production.
+
+    The hooks are on requests.Session.send, botocore's BaseClient._make_api_call, boto3.client, boto3.Session and
+    rasterio.open, so the scripts need no changes.
+"""
+import io
+import json
+import gzip
+import time
+import base64
+import hashlib
+import threading
+from pathlib import Path
+from datetime import datetime, timedelta
+from collections import defaultdict, deque
+
+class NotRecorded(LookupError):
+    """
+        Raised in the replay for a request that is not in the archive
+    """
+
+def encode(value):
+    """
+        value: Request or response content with datetimes and bytes, e.g. a boto3 response
+        -> JSON compatible copy of the value
+    """
+
+    if isinstance(value, dict):
+        return {key: encode(x) for key, x in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode(x) for x in value]
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, bytes):
+        return {'__bytes__': base64.b64encode(value).decode()}
+
+    return value
+
+def decode(value):
+    """
+        value: Value from encode()
+        -> the value with the datetimes and bytes restored
+    """
+
+    if isinstance(value, dict):
+        if '__datetime__' in value:
+            return datetime.fromisoformat(value['__datetime__'])
+        if '__bytes__' in value:
+            return base64.b64decode(value['__bytes__'])
+        return {key: decode(x) for key, x in value.items()}
+    if isinstance(value, list):
+        return [decode(x) for x in value]
+
+    return value
+
+def request_key(service, request):
+    """
+        service: 's3', 'raster' or 'http'
+        request: JSON compatible dict describing the request
+        -> key the request is matched with in the replay
+    """
+
+    return hashlib.sha256(json.dumps([service, request], sort_keys=True).encode()).hexdigest()
+
+def body_digest(body, headers):
+    """
+        body: Body of an HTTP request, bytes, str or None
+        headers: Headers of the request
+        -> sha256 of the body, of the uncompressed body if it was gzipped, None without a body
+
+        gzip writes the time into the compressed data, so the same payload gzipped in two runs differs.
+    """
+
+    if body is None:
+        return None
+    if isinstance(body, str):
+        body = body.encode()
+    if headers.get('Content-Encoding') == 'gzip':
+        body = gzip.decompress(body)
+
+    return hashlib.sha256(body).hexdigest()
+
+class TrafficArchive:
+    """
+        path: Folder of the archive
+        mode: 'record' or 'replay'
+        latency: If True, the replay waits as long as the recorded calls took
+    """
+
+    def __init__(self, path, mode, latency=False):
+        self.path = Path(path)
+        self.mode = mode
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.restore = []
+        self.exchanges = defaultdict(deque)
+        self.last = {}
+
+        if mode == 'record':
+            (self.path / 'blobs').mkdir(parents=True, exist_ok=True)
+            # A new recording replaces an old one in the same folder
+            (self.path / 'exchanges.jsonl').write_text('')
+        elif mode == 'replay':
+            with open(self.path / 'exchanges.jsonl') as f:
+                for line in f:
+                    exchange = json.loads(line)
+                    self.exchanges[exchange['key']].append(exchange)
+        else:
+            raise ValueError(f"mode must be 'record' or 'replay', not {mode!r}")
+
+    def write_blob(self, data):
+        """
+            data: bytes
+            -> sha256 the blob is stored by
+        """
+
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path / 'blobs' / f"{digest}.gz"
+        if not path.exists():
+            # Written under a temporary name, so the threads storing the same content do not see half a blob
+            temporary = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+            temporary.write_bytes(gzip.compress(data, mtime=0))
+            temporary.replace(path)
+
+        return digest
+
+    def read_blob(self, digest):
+        """
+            digest: sha256 from write_blob(), or None
+            -> the bytes of the blob, None without a digest
+        """
+
+        if digest is None:
+            return None
+
+        return gzip.decompress((self.path / 'blobs' / f"{digest}.gz").read_bytes())
+
+    def record(self, service, request, response, blob=None, seconds=0.0):
+        """
+            service: 's3', 'raster' or 'http'
+            request: JSON compatible dict describing the request
+            response: JSON compatible dict of the response, or {'error': {'type', 'message', ...}} for a failed call
+            blob: Body of the response as bytes, if any
+            seconds: Time the call took
+        """
+
+        exchange = {
+            'service': service,
+            'key': request_key(service, request),
+            'request': request,
+            'response': response,
+            'blob': self.write_blob(blob) if blob is not None else None,
+            'seconds': round(seconds, 6),
+        }
+        line = json.dumps(exchange) + '\n'
+        with self.lock:
+            with open(self.path / 'exchanges.jsonl', 'a') as f:
+                f.write(line)
+
+    def replay(self, service, request):
+        """
+            service: 's3', 'raster' or 'http'
+            request: JSON compatible dict describing the request
+            -> the recorded exchange dict, after the recorded time if latency is on
+        """
+
+        key = request_key(service, request)
+        with self.lock:
+            recorded = self.exchanges.get(key)
+            if recorded:
+                self.last[key] = recorded.popleft()
+            exchange = self.last.get(key)
+        if exchange is None:
+            raise NotRecorded(f"no recorded {service} response for {json.dumps(request, sort_keys=True)}")
+
+        if self.latency:
+            time.sleep(exchange['seconds'])
+
+        return exchange
+
+    def patch(self, owner, name, value):
+        """
+            owner: Module or class
+            name: Attribute to replace
+            value: The replacement, the original is put back by uninstall()
+        """
+
+        self.restore.append((owner, name, getattr(owner, name)))
+        setattr(owner, name, value)
+
+    def install(self):
+        """
+            -> self, with the hooks of the libraries that can be imported in place
+        """
+
+        try:
+            import requests
+            install_http(self, requests)
+        except ImportError:
+            pass
+        try:
+            import boto3
+            import botocore.client
+            install_s3(self, boto3, botocore.client)
+        except ImportError:
+            pass
+        try:
+            import rasterio
+            install_raster(self, rasterio)
+        except ImportError:
+            pass
+
+        print(f" * {'Recording' if self.mode == 'record' else 'Replaying'} the traffic of the run in {self.path}")
+        return self
+
+    def uninstall(self):
+        """
+            Puts the patched functions back.
+        """
+
+        while self.restore:
+            owner, name, value = self.restore.pop()
+            setattr(owner, name, value)
+
+def error_record(error):
+    """
+        error: Exception of a failed call
+        -> {'error': {...}} response for TrafficArchive.record()
+    """
+
+    details = {'type': type(error).__name__, 'message': str(error)}
+    # botocore's ClientError has the parsed error response
+    if hasattr(error, 'response') and hasattr(error, 'operation_name'):
+        details['response'] = encode(error.response)
+        details['operation'] = error.operation_name
+
+    return {'error': details}
+
+def install_http(archive, requests):
+    """
+        archive: TrafficArchive
+        requests: The requests module
+    """
+
+    send = requests.Session.send
+
+    def describe(request):
+        return {
+            'method': request.method,
+            'url': request.url,
+            'body': body_digest(request.body, request.headers),
+        }
+
+    def recording_send(session, request, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = send(session, request, **kwargs)
+            # Reading the content here keeps it for the caller as well
+            content = response.content
+        except requests.RequestException as error:
+            archive.record('http', describe(request), error_record(error), None, time.perf_counter() - start)
+            raise
+        # requests has already uncompressed the content
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in ('content-encoding', 'content-length', 'transfer-encoding')}
+        recorded = {'status': response.status_code, 'reason': response.reason, 'headers': headers, 'encoding': response.encoding}
+        archive.record('http', describe(request), recorded, content, time.perf_counter() - start)
+        return response
+
+    def replaying_send(session, request, **kwargs):
+        exchange = archive.replay('http', describe(request))
+        recorded = exchange['response']
+        if 'error' in recorded:
+            error_class = getattr(requests.exceptions, recorded['error']['type'], requests.RequestException)
+            raise error_class(recorded['error']['message'], request=request)
+
+        response = requests.Response()
+        response.status_code = recorded['status']
+        response.reason = recorded['reason']
+        response.headers = requests.structures.CaseInsensitiveDict(recorded['headers'])
+        response.encoding = recorded['encoding']
+        response._content = archive.read_blob(exchange['blob']) or b''
+        response.url = request.url
+        response.request = request
+        response.elapsed = timedelta(seconds=exchange['seconds'])
+        return response
+
+    archive.patch(requests.Session, 'send', recording_send if archive.mode == 'record' else replaying_send)
+
+def install_s3(archive, boto3, botocore_client):
+    """
+        archive: TrafficArchive
+        boto3: The boto3 module
+        botocore_client: The botocore.client module
+    """
+
+    from botocore.response import StreamingBody
+    from botocore.exceptions import ClientError
+
+    def describe(operation, params):
+        return {'operation': operation, 'params': encode(params)}
+
+    def split_body(response):
+        # The streaming body of get_object goes into a blob, a new stream over the same bytes is given to the caller
+        body = response.get('Body')
+        if body is None:
+            return response, None
+        data = body.read()
+        return {**response, 'Body': StreamingBody(io.BytesIO(data), len(data))}, data
+
+    if archive.mode == 'record':
+        make_api_call = botocore_client.BaseClient._make_api_call
+
+        def recording_call(client, operation, params):
+            # Described before the call, botocore's handlers add parameters to the dict during it
+            request = describe(operation, params)
+            start = time.perf_counter()
+            try:
+                response = make_api_call(client, operation, params)
+            except Exception as error:
+                archive.record('s3', request, error_record(error), None, time.perf_counter() - start)
+                raise
+            response, data = split_body(response)
+            recorded = encode({k: v for k, v in response.items() if k != 'Body'})
+            archive.record('s3', request, recorded, data, time.perf_counter() - start)
+            return response
+
+        archive.patch(botocore_client.BaseClient, '_make_api_call', recording_call)
+        return
+
+    def replay_call(operation, params):
+        exchange = archive.replay('s3', describe(operation, params))
+        recorded = exchange['response']
+        if 'error' in recorded:
+            error = recorded['error']
+            if 'response' in error:
+                raise ClientError(decode(error['response']), error['operation'])
+            raise OSError(f"{error['type']}: {error['message']}")
+        response = decode(recorded)
+        data = archive.read_blob(exchange['blob'])
+        if data is not None:
+            response['Body'] = StreamingBody(io.BytesIO(data), len(data))
+        return response
+
+    class ReplayPaginator:
+        """
+            Paginator of one operation, following the continuation tokens of the recorded pages
+        """
+
+        def __init__(self, operation):
+            self.operation = operation
+
+        def paginate(self, PaginationConfig=None, **params):
+            if PaginationConfig and PaginationConfig.get('PageSize'):
+                params['MaxKeys'] = PaginationConfig['PageSize']
+            while True:
+                page = replay_call(self.operation, params)
+                yield page
+                token = page.get('NextContinuationToken')
+                if not (page.get('IsTruncated') and token):
+                    return
+                params = {**params, 'ContinuationToken': token}
+
+    class ReplayClient:
+        """
+            S3 client answering every call from the archive, e.g. client.get_object(Bucket=..., Key=...)
+        """
+
+        def get_paginator(self, operation):
+            return ReplayPaginator(operation_name(operation))
+
+        def __getattr__(self, name):
+            if name.startswith('_'):
+                raise AttributeError(name)
+            return lambda **params: replay_call(operation_name(name), params)
+
+    class ReplaySession:
+        """
+            boto3.Session that needs no credentials and makes replay clients
+        """
+
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def client(self, *args, **kwargs):
+            return ReplayClient()
+
+    archive.patch(boto3, 'client', lambda *args, **kwargs: ReplayClient())
+    archive.patch(boto3, 'Session', ReplaySession)
+
+def operation_name(method):
+    """
+        method: boto3 client method, e.g. 'list_objects_v2'
+        -> the operation name botocore records, e.g. 'ListObjectsV2'
+    """
+
+    return ''.join(part.capitalize() for part in method.split('_'))
+
+class RecordedDataset:
+    """
+        bounds, transform and shape of an image as the scripts read them from rasterio.open()
+    """
+
+    def __init__(self, bounds, transform, shape):
+        self.bounds = bounds
+        self.transform = transform
+        self.shape = shape
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+def install_raster(archive, rasterio):
+    """
+        archive: TrafficArchive
+        rasterio: The rasterio module
+    """
+
+    from affine import Affine
+    from rasterio.coords import BoundingBox
+    from rasterio.errors import RasterioIOError
+
+    rasterio_open = rasterio.open
+
+    def recording_open(uri, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            with rasterio_open(uri, *args, **kwargs) as src:
+                dataset = RecordedDataset(src.bounds, src.transform, src.shape)
+        except Exception as error:
+            archive.record('raster', {'uri': str(uri)}, error_record(error), None, time.perf_counter() - start)
+            raise
+        recorded = {'bounds': list(dataset.bounds), 'transform': list(dataset.transform)[:6], 'shape': list(dataset.shape)}
+        archive.record('raster', {'uri': str(uri)}, recorded, None, time.perf_counter() - start)
+        return dataset
+
+    def replaying_open(uri, *args, **kwargs):
+        recorded = archive.replay('raster', {'uri': str(uri)})['response']
+        if 'error' in recorded:
+            raise RasterioIOError(recorded['error']['message'])
+        return RecordedDataset(BoundingBox(*recorded['bounds']), Affine(*recorded['transform']), tuple(recorded['shape']))
+
+    archive.patch(rasterio, 'open', recording_open if archive.mode == 'record' else replaying_open)
+
+def start_archive(args):
+    """
+        args: Parsed arguments with the record, replay and replay_latency options of s2stac.add_archive_arguments()
+        -> installed TrafficArchive, None if neither --record nor --replay was given
+    """
+
+    if getattr(args, 'record', None):
+        return TrafficArchive(args.record, 'record').install()
+    if getattr(args, 'replay', None):
+        return TrafficArchive(args.replay, 'replay', args.replay_latency).install()
+
+    return None
@@ -2,21 +2,141 @@ import boto3
 import pystac
 import rasterio
 import re
-import pandas as pd
 import getpass
-import argparse
 import requests
 import pystac_client
 import time
+import os
+import json
 from urllib.parse import urljoin
-from itertools import chain
-from datetime import datetime
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from xml.dom import minidom
 from shapely.geometry import box, mapping
 from pystac.extensions.eo import EOExtension, Band
 from pystac.extensions.projection import ProjectionExtension
 from rasterio.warp import transform_bounds
-from rasterio.crs import CRS
+from safe_listing import iter_safe_objects, list_safes, safe_contents, ordered_map
+from safe_names import safe_filter, year_filter, combine_skips, parse_safe_name, safe_of_uri, parse_band_file, baseline_version, schedule_safes, bucket_ranks, dedupe_safes
+from adaptive_limit import AdaptiveLimiter, request_with_limit
+from stac_io import compact_item, json_request
+from checkpoints import save_quarantine
+from tile_cache import epsg_crs, load_tile_cache, save_tile_cache, lookup_tile_geometry, remember_tile_geometry
+from catalog_index import indexed_ids, index_item_dicts, check_published_index, published_metadata
+from metadata_reader import read_xml_head, crs_tags, crs_range, product_tags, product_range
+from stage_profiler import stage
+
+# Band information in Band objects and as a dict
+s2_bands = {
+    "B01": {
+        "band": Band.create(name='B01', description='Coastal: 400 - 450 nm', common_name='coastal')
+    },
+    "B02": {
+        "band": Band.create(name='B02', description='Blue: 450 - 500 nm', common_name='blue')
+    },
+    "B03": {
+        "band": Band.create(name='B03', description='Green: 500 - 600 nm', common_name='green'),
+    },
+    "B04": {
+        "band": Band.create(name='B04', description='Red: 600 - 700 nm', common_name='red'),
+    },
+    "B05": {
+        "band": Band.create(name='B05', description='Vegetation Red Edge: 705 nm', common_name='rededge')
+    },
+    "B06": {
+        "band": Band.create(name='B06', description='Vegetation Red Edge: 740 nm', common_name='rededge')
+    },
+    "B07": {
+        "band": Band.create(name='B07', description='Vegetation Red Edge: 783 nm', common_name='rededge')
+    },
+    "B08": {
+        "band": Band.create(name='B08', description='Near-IR: 750 - 1000 nm', common_name='nir')
+    },
+    "B8A": {
+        "band": Band.create(name='B8A', description='Near-IR: 750 - 900 nm', common_name='nir08')
+    },
+    "B09": {
+        "band": Band.create(name='B09', description='Water vapour: 850 - 1050 nm', common_name='nir09')
+    },
+    "B10": {
+        "band": Band.create(name='B10', description='SWIR-Cirrus: 1350 - 1400 nm', common_name='cirrus')
+    },
+    "B11": {
+        "band": Band.create(name='B11', description='SWIR16: 1550 - 1750 nm', common_name='swir16')
+    },
+    "B12": {
+        "band": Band.create(name='B12', description='SWIR22: 2100 - 2300 nm', common_name='swir22')
+    }
+}
+
+s2_bands_as_dict = {
+    "B01": {
+        'name': 'B01', 
+        'description': 'Coastal: 400 - 450 nm', 
+        'common_name': 'coastal'
+    },
+    "B02": {
+        'name': 'B02', 
+        'description': 'Blue: 450 - 500 nm', 
+        'common_name': 'blue'
+    },
+    "B03": {
+        'name': 'B03', 
+        'description': 'Green: 500 - 600 nm', 
+        'common_name': 'green'
+    },
+    "B04": {
+        'name': 'B04', 
+        'description': 'Red: 600 - 700 nm', 
+        'common_name': 'red'
+    },
+    "B05": {
+        'name': 'B05', 
+        'description': 'Vegetation Red Edge: 705 nm', 
+        'common_name': 'rededge'
+    },
+    "B06": {
+        'name': 'B06', 
+        'description': 'Vegetation Red Edge: 740 nm', 
+        'common_name': 'rededge'
+    },
+    "B07": {
+        'name': 'B07', 
+        'description': 'Vegetation Red Edge: 783 nm',
+        'common_name': 'rededge'
+    },
+    "B08": {
+        'name': 'B08', 
+        'description': 'Near-IR: 750 - 1000 nm',
+        'common_name': 'nir'
+    },
+    "B8A": {
+        'name': 'B8A', 
+        'description': 'Near-IR: 750 - 900 nm',
+        'common_name': 'nir08'
+    },
+    "B09": {
+        'name': 'B09', 
+        'description': 'Water vapour: 850 - 1050 nm',
+        'common_name': 'nir09'
+    },
+    "B10": {
+        'name': 'B10', 
+        'description': 'SWIR-Cirrus: 1350 - 1400 nm',
+        'common_name': 'cirrus'
+    },
+    "B11": {
+        'name': 'B11', 
+        'description': 'SWIR16: 1550 - 1750 nm',
+        'common_name': 'swir16'
+    },
+    "B12": {
+        'name': 'B12', 
+        'description': 'SWIR22: 2100 - 2300 nm',
+        'common_name': 'swir22'
+    }
+}
 
 def init_client():
 
@@ -39,10 +159,10 @@ def get_buckets(client):
     buckets = [x['Name'] for x in bucket_information['Buckets'] if re.match(r"Sentinel2(?!.*segments)", x['Name'])]
 
     # Get Buckets from these two CSC projects
-    first_csv = pd.read_table("2000290_buckets.csv", header=None)
-    first_buckets = list(chain.from_iterable(first_csv.to_numpy()))
-    second_csv = pd.read_table("2001106_buckets.csv", header=None)
-    second_buckets = list(chain.from_iterable(second_csv.to_numpy()))
+    with open("2000290_buckets.csv") as f:
+        first_buckets = [line.strip() for line in f if line.strip()]
+    with open("2001106_buckets.csv") as f:
+        second_buckets = [line.strip() for line in f if line.strip()]
     
     buckets = [*buckets, *first_buckets, *second_buckets]
 
@@ -158,14 +278,20 @@ def get_xml_content(doc, tagname):
     content = doc.getElementsByTagName(tagname)[0].firstChild.data
     return content
 
-def get_metadata_content(bucket, metadatafile, client):
+def get_metadata_content(bucket, metadatafile, client, tags=None, first_range=crs_range):
 
     """
         bucket: The bucket where the metadatafile is located
         metadatafile: The name of the metadatafile
         client: boto3.client
+        tags: Names of the elements needed from the file, only the start of the file up to them is read (see metadata_reader).
+            None to read the whole file
+        first_range: Bytes asked in the first Range request when tags are given
     """
 
+    if tags:
+        return read_xml_head(client, bucket, metadatafile, tags, first_range)
+
     obj = client.get_object(Bucket = bucket, Key = metadatafile)['Body']
     metadatacontent = obj.read().decode()
     return metadatacontent
@@ -194,9 +320,9 @@ def transform_crs(bounds, crs_string):
         crs_string: CRS string from CRS metadata
     """
 
-    # Transform the bounds according to the CRS
-    crs = CRS.from_epsg(4326)
-    safecrs = CRS.from_epsg(int(crs_string))
+    # Transform the bounds according to the CRS, the CRS objects are made once per EPSG code
+    crs = epsg_crs(4326)
+    safecrs = epsg_crs(int(crs_string))
     bounds_transformed = transform_bounds(safecrs, crs, bounds[0][0], bounds[0][1], bounds[0][2], bounds[0][3])
         
     return bounds_transformed
@@ -221,36 +347,47 @@ def get_crs(crsmetadatafile):
 
     return crsmetadata
 
-def make_item(uri, metadatacontent, crs_metadata):
+def make_item(uri, metadatacontent, crs_metadata, tilegeometry=None, safe=None):
     """
         uri: The SAFE ID of the item (currently URL of the image, could be changes to SAFE later)
         metadatacontent: Metadata dict got from get_metadata_content()
         crs_metadata: CRS metadata dict containing CRS string and shapes for different resolutions from get_crs()
+        tilegeometry: Cached geometry of the tile from tile_cache.lookup_tile_geometry(), the image is read if not given
+        safe: safe_names.SafeName of the item, parsed from the uri if not given
     """
     params = {}
 
-    if re.match(r".+?\d{4}/S2(A|B)", uri):
-        params['id'] = uri.split("/")[5].split('.')[0]
-    else:
-        params['id'] = uri.split('/')[4].split('.')[0]
+    if safe is None:
+        safe = safe_of_uri(uri)
+    if safe is None:
+        raise ValueError(f'No Sentinel-2 SAFE in the image URL {uri}')
+
+    params['id'] = safe.name
     
-    with rasterio.open(uri) as src:
-        item_transform = src.transform
-        # as lat,lon
-        params['bbox'] = transform_crs(list([src.bounds]),crs_metadata['CRS'])
-        params['geometry'] = mapping(box(*params['bbox']))
+    if tilegeometry and tilegeometry['epsg'] == int(crs_metadata['CRS']):
+        # All SAFEs of the same tile have the same footprint
+        item_transform = tilegeometry['transform']
+        params['bbox'] = tilegeometry['bbox']
+        params['geometry'] = tilegeometry['geometry']
+    else:
+        with rasterio.open(uri) as src:
+            item_transform = src.transform
+            # as lat,lon
+            params['bbox'] = transform_crs(list([src.bounds]),crs_metadata['CRS'])
+            params['geometry'] = mapping(box(*params['bbox']))
             
     mtddict = get_metadata_from_xml(metadatacontent)
 
     # Datetime from filename
-    params['datetime'] = datetime.strptime(uri.split('_')[2][0:8], '%Y%m%d')
+    params['datetime'] = datetime.strptime(safe.sensing[0:8], '%Y%m%d')
 
     params['properties'] = {}
     params['properties']['eo:cloud_cover'] = mtddict['cc_perc']
     #following are not part of eo extension
     params['properties']['data_cover'] = mtddict['data_cover']
-    params['properties']['orbit'] = mtddict['orbit']
-    params['properties']['baseline'] = mtddict['baseline']
+    # The relative orbit and processing baseline are the same in the SAFE name as in the metadata
+    params['properties']['orbit'] = str(safe.orbit)
+    params['properties']['baseline'] = baseline_version(safe)
     # following are part of general metadata hardcoded for Sentinel-2
     params['properties']['platform'] = 'sentinel-2'
     params['properties']['instrument'] = 'msi'
@@ -279,51 +416,27 @@ def add_asset(stacItem, uri, crsmetadata=None, thumbnail=False):
         thumbnail: Boolean value indicating if the asset is a thumbnail or not
     """
 
-    if uri.endswith('geo.jp2'): # A few special cases where there were differently named image files that contained different metadata
-        splitter = uri.split('/')[-1].split('.')[0].split('_')
-        full_bandname = '_'.join(splitter[-3:-1])
-        band = splitter[-3]
-        resolution = splitter[-2].split('m')[0]
-        asset = pystac.Asset(
-            href=uri,
-            title=full_bandname,
-            media_type=pystac.MediaType.JPEG2000,
-            roles=["data"],
-            extra_fields= {
-                'gsd': int(resolution),
-                'proj:shape': crsmetadata['shapes'][resolution],
-            }
-        )
-        if band in s2_bands:
-            asset_eo_ext = EOExtension.ext(asset)
-            asset_eo_ext.bands = [s2_bands[band]["band"]]
-        stacItem.add_asset(
-            key=full_bandname,
-            asset=asset
-        )
-        
-        return stacItem
-
     if not thumbnail: # If the asset is a standard image
-        splitter = uri.split('/')[-1].split('.')[0].split('_')
-        full_bandname = '_'.join(splitter[-2:])
-        band = splitter[-2]
-        resolution = splitter[-1].split('m')[0]
+        # Also the few differently named _geo.jp2 images get the key and title of their band and resolution, e.g. B02_10m
+        bandfile = parse_band_file(uri)
+        if bandfile is None:
+            print('No band in the image name, not added:', uri)
+            return stacItem
         asset = pystac.Asset(
                 href=uri,
-                title=full_bandname,
+                title=bandfile.key,
                 media_type=pystac.MediaType.JPEG2000,
                 roles=["data"],
                 extra_fields= {
-                    'gsd': int(resolution),
-                    'proj:shape': crsmetadata['shapes'][resolution],
+                    'gsd': int(bandfile.resolution),
+                    'proj:shape': crsmetadata['shapes'][bandfile.resolution],
                 }
         )
-        if band in s2_bands:
+        if bandfile.band in s2_bands:
             asset_eo_ext = EOExtension.ext(asset)
-            asset_eo_ext.bands = [s2_bands[band]["band"]]
+            asset_eo_ext.bands = [s2_bands[bandfile.band]["band"]]
         stacItem.add_asset(
-            key=full_bandname, 
+            key=bandfile.key, 
             asset=asset
         )
 
@@ -331,7 +444,6 @@ def add_asset(stacItem, uri, crsmetadata=None, thumbnail=False):
         with rasterio.open(uri) as src:
             shape = src.shape
 
-        full_bandname = uri.split('/')[-1].split('_')[-1].split('.')[0]
         asset = pystac.Asset(
                 href=uri,
                 title="Thumbnail image",
@@ -348,227 +460,522 @@ def add_asset(stacItem, uri, crsmetadata=None, thumbnail=False):
 
     return stacItem
 
-def update_catalog(app_host, csc_collection):
+def add_safe_items(items_to_add, csc_collection, s3_client, bucket, safe, safecontents, tilecache):
 
-    s3_client = init_client()
-    buckets = get_buckets(s3_client)
-    session = requests.Session()
-    session.auth = ("admin", pwd)
-    log_headers = {"User-Agent": "update-script"} # Added for easy log-filtering
-    original_csc_collection_ids = {item.id for item in csc_collection.get_all_items()}
-    print(" * CSC Items collected.")
-    items_to_add = {}
+    """
+        items_to_add: dict of the items made so far by their ids, the item of the SAFE is added to it
+        csc_collection: Collection the new item is added to
+        s3_client: boto3.client
+        bucket: The bucket where the SAFE is located
+        safe: SAFE folder name
+        safecontents: list of the keys of the SAFE
+        tilecache: Tile geometry cache dict from tile_cache.load_tile_cache()
+
+        If the SAFE was already made from another bucket, its images are added as assets to the same item.
+    """
 
-    for bucket in buckets:
+    # The id, date, orbit and baseline of the item come from the SAFE name
+    safeinfo = parse_safe_name(safe)
+    if safeinfo is None:
+        print('Not a Sentinel-2 SAFE name, skipped:', safe)
+        return
+    safename = safeinfo.name
+
+    # Gather needed contents into different lists containing filenames
+    safecontent_jp2 = [x for x in safecontents if x.endswith('jp2')]
+    safecontent_mtd = [x for x in safecontents if x.endswith('MTD_MSIL2A.xml')]
+    safecontent_crs = [x for x in safecontents if x.endswith('MTD_TL.xml')]
+
+    metadatafile = ''.join((x for x in safecontent_mtd if safename in x))
+    crsmetadatafile = ''.join((x for x in safecontent_crs if safename in x))
+    if not metadatafile or not crsmetadatafile:
+        # If there is no metadatafile or CRS-metadatafile, the SAFE does not include data relevant to the script
+        return
+    # THIS FAILS WITH FOLDER BUCKETS
+    safecrs_metadata = get_crs(get_metadata_content(bucket, crsmetadatafile, s3_client, crs_tags, crs_range))
+    
+    # only jp2 that are image bands
+    jp2images = [x for x in safecontent_jp2 if safename in x and 'IMG_DATA' in x]
+    # if there are no jp2 imagefiles in the bucket, continue to the next bucket
+    if not jp2images:
+        return
+
+    # jp2 that are preview images
+    previewimage = next((x for x in safecontent_jp2 if safename in x and 'PVI' in x), None)
+    if previewimage is None:
+        raise ValueError(f'No preview image (PVI) in {safe}')
+    metadatacontent = get_metadata_content(bucket, metadatafile, s3_client, product_tags, product_range)
+    
+    for image in jp2images:
 
-        # Usual list_objects_v2 function only lists up to 1000 objects so pagination is needed when using a client
-        paginator = s3_client.get_paginator('list_objects_v2')
-        pages = paginator.paginate(Bucket=bucket)
-        bucketcontents = [x['Key'] for page in pages for x in page['Contents']]
+        uri = 'https://a3s.fi/' + bucket + '/' + image
 
-        # Gather needed contents into different lists containing filenames
-        bucketcontent_jp2 = [x for x in bucketcontents if x.endswith('jp2')]
-        bucketcontent_mtd = [x for x in bucketcontents if x.endswith('MTD_MSIL2A.xml')]
-        bucketcontent_crs = [x for x in bucketcontents if x.endswith('MTD_TL.xml')]
+        # Get the item if it's added during the update, if None, the item is made and preview image added
+        if safename not in items_to_add:
+            item = make_item(uri, metadatacontent, safecrs_metadata, lookup_tile_geometry(tilecache, safename, uri), safeinfo)
+            remember_tile_geometry(tilecache, {'id': item.id, 'bbox': item.bbox, 'geometry': item.geometry, 'properties': item.properties})
+            items_to_add[safename] = item
+            csc_collection.add_item(item)
+            add_asset(item, 'https://a3s.fi/' + bucket + '/' + previewimage, None, True)
+        else:
+            item = items_to_add[safename]
+            add_asset(item, uri, safecrs_metadata)
 
-        exclude = {'index.html'}
-        listofsafes = list(set(list(map(lambda x: x.split('/')[0], bucketcontents))) - exclude)
-        # One project includes pseudofolders in the path representing the years, with this check, get the actual SAFEs instead
-        if any(re.match(r"\d{4}", safe) for safe in listofsafes):
-            listofsafes.clear()
-            listofsafes = list(set(list(map(lambda x: x.split('/')[1], bucketcontents))) - exclude)
-        #print('Bucket:', bucket)
-        #print('SAFES:', listofsafes)
+def try_add_safe_items(items_to_add, csc_collection, s3_client, bucket, safe, safecontents, tilecache):
 
-        for safe in listofsafes:
-            
-            # SAFE-filename without the subfix
-            safename = str(safe.split('.')[0])
-
-            # IF safename is in Collection, the items are already added
-            if safename in original_csc_collection_ids:
-                continue
-
-            metadatafile = ''.join((x for x in bucketcontent_mtd if safename in x))
-            crsmetadatafile = ''.join((x for x in bucketcontent_crs if safename in x))
-            if not metadatafile or not crsmetadatafile:
-                # If there is no metadatafile or CRS-metadatafile, the SAFE does not include data relevant to the script
-                continue
-            # THIS FAILS WITH FOLDER BUCKETS
-            safecrs_metadata = get_crs(get_metadata_content(bucket, crsmetadatafile, s3_client))
-            
-            # only jp2 that are image bands
-            jp2images = [x for x in bucketcontent_jp2 if safename in x and 'IMG_DATA' in x]
-            # if there are no jp2 imagefiles in the bucket, continue to the next bucket
-            if not jp2images:
-                continue
-
-            # jp2 that are preview images
-            previewimage = next(x for x in bucketcontent_jp2 if safename in x and 'PVI' in x)
-            metadatacontent = get_metadata_content(bucket, metadatafile, s3_client)
-            
-            for image in jp2images:
+    """
+        The arguments are described in add_safe_items().
+        -> the exception if the SAFE failed, None otherwise
 
-                uri = 'https://a3s.fi/' + bucket + '/' + image
+        A SAFE that fails, e.g. without a preview image or a metadata tag, does not stop the others. An item made
+        from it before the failure is taken out again.
+    """
 
-                # Get the item if it's added during the update, if None, the item is made and preview image added
-                if safename not in items_to_add:
-                    item = make_item(uri, metadatacontent, safecrs_metadata)
-                    items_to_add[safename] = item
-                    csc_collection.add_item(item)
-                    add_asset(item, 'https://a3s.fi/' + bucket + '/' + previewimage, None, True)
-                else:
-                    item = items_to_add[safename]
-                    add_asset(item, uri, safecrs_metadata)
-
-    for item in items_to_add:
-        item_dict = items_to_add[item].to_dict()
+    safename = safe.split('.')[0]
+    new = safename not in items_to_add
+    try:
+        add_safe_items(items_to_add, csc_collection, s3_client, bucket, safe, safecontents, tilecache)
+    except Exception as error:
+        if new and safename in items_to_add:
+            del items_to_add[safename]
+            csc_collection.remove_item(safename)
+        return error
+
+    return None
+
+def mount_adapter(session, max_workers):
+
+    """
+        session: requests.Session used for the uploads
+        max_workers: Number of upload threads, the connection pool is made as large
+    """
+
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+def upload_item(app_host, session, limiter, csc_collection, item, log_headers, compact=False, gzip_upload=False):
+
+    """
+        limiter: adaptive_limit.AdaptiveLimiter shared by the uploads in flight
+        item: stac.Item to upload
+        The other arguments are described in upload_items().
+        -> (id, None) if the item was uploaded, (id, exception) if it failed
+    """
+
+    try:
+        item_dict = item.to_dict()
+        if compact:
+            item_dict = compact_item(item_dict)
         converted_item = json_convert(item_dict)
         request_point = f"collections/{csc_collection.id}/products"
-        r = session.post(urljoin(app_host, request_point), headers=log_headers, json=converted_item)
+        r = request_with_limit(limiter, session.post, urljoin(app_host, request_point), idempotent=False, **json_request(converted_item, gzip_upload, log_headers))
         r.raise_for_status()
-    
+    except Exception as error:
+        return item.id, error
+    return item.id, None
+
+def upload_items(app_host, session, csc_collection, items, log_headers, max_workers=16, latency_target=2.0, compact=False, gzip_upload=False):
+
+    """
+        app_host: URL of the GeoServer OSEO REST API
+        session: requests.Session with the GeoServer credentials
+        csc_collection: Collection the items belong to
+        items: list of stac.Item to upload
+        log_headers: Headers sent with every request
+        max_workers: Maximum number of uploads in flight, the actual number is adapted with adaptive_limit.AdaptiveLimiter
+        latency_target: Seconds, slower GeoServer responses lower the number of uploads in flight
+        compact: If True, the band definitions are left out of the items (see stac_io.compact_item)
+        gzip_upload: If True, the items are sent gzipped with Content-Encoding: gzip
+        -> list of the ids of the uploaded items and list of (id, exception) of the items that failed
+    """
+
+    limiter = AdaptiveLimiter(maximum=max_workers, latency_target=latency_target)
+
+    def upload(item):
+        return upload_item(app_host, session, limiter, csc_collection, item, log_headers, compact, gzip_upload)
+
+    # The number of uploads in flight adapts to how fast GeoServer answers
+    with ThreadPoolExecutor(max_workers) as pool:
+        results = list(pool.map(upload, items))
+
+    return split_results(results)
+
+def split_results(results):
+
+    """
+        results: list of (id, exception or None) from upload_item()
+        -> list of the ids of the uploaded items and list of (id, exception) of the items that failed
+    """
+
+    uploaded = [item_id for item_id, error in results if error is None]
+    failed = [(item_id, error) for item_id, error in results if error is not None]
+    return uploaded, failed
+
+def update_collection_extent(app_host, session, csc_collection, log_headers, gzip_upload=False):
+
+    """
+        app_host: URL of the GeoServer OSEO REST API
+        session: requests.Session with the GeoServer credentials
+        csc_collection: Collection with the new items added to it
+        log_headers: Headers sent with the request
+        gzip_upload: If True, the collection is sent gzipped with Content-Encoding: gzip
+    """
+
+    # Update the extents from the Allas Items
+    csc_collection.update_extent_from_items()
+    collection_dict = csc_collection.to_dict()
+    converted_collection = json_convert(collection_dict)
+    request_point = f"collections/{csc_collection.id}/"
+
+    r = session.put(urljoin(app_host, request_point), **json_request(converted_collection, gzip_upload, log_headers))
+    r.raise_for_status()
+    print(" + Updated Collection Extents.")
+
+def load_published_ids(app_host, csc_collection, index_path=None, rebuild_index=False):
+
+    """
+        app_host: URL of the GeoServer OSEO REST API, recorded in the index
+        csc_collection: pystac_client Collection of the published items
+        index_path: SQLite index of the published items (see catalog_index), None to list the items from GeoServer
+        rebuild_index: If True, the index is made again from the items listed from GeoServer
+        -> set of the ids of the published items
+
+        If the index does not exist yet, it is made from the items listed from GeoServer. An index made by the build
+        or for another host or collection is refused (see catalog_index.check_published_index).
+    """
+
+    if index_path and os.path.exists(index_path):
+        if not rebuild_index:
+            check_published_index(index_path, app_host, csc_collection.id)
+            ids = indexed_ids(index_path)
+            print(f" * {len(ids)} published items read from the index.")
+            return ids
+        os.remove(index_path)
+
+    items = list(csc_collection.get_all_items())
+    index_item_dicts(index_path, [item.to_dict() for item in items], published_metadata(app_host, csc_collection.id))
+    print(" * CSC Items collected.")
+
+    return {item.id for item in items}
+
+def update_catalog(app_host, csc_collection, pwd, discovery='auto', tile_cache_path='tile_geometry_cache.json', max_workers=16, latency_target=2.0, name_filter=None, skip_year=None, compact=False, gzip_upload=False, schedule='newest', index_path=None, list_workers=4, dedupe=True, precedence=None, quarantine_path='update_quarantine.json', rebuild_index=False):
+
+    """
+        app_host: URL of the GeoServer OSEO REST API
+        csc_collection: pystac_client Collection of the already published items
+        pwd: GeoServer admin password
+        discovery: How the SAFEs are found from the buckets, 'auto', 'delimiter' or 'list' (see safe_listing.iter_safes)
+        tile_cache_path: JSON file of the tile geometry cache (see tile_cache), None to not use the cache
+        max_workers: Maximum number of uploads in flight, the actual number is adapted with adaptive_limit.AdaptiveLimiter
+        latency_target: Seconds, slower GeoServer responses lower the number of uploads in flight
+        name_filter: Optional function taking a SAFE name, returning True for the SAFEs to skip (see safe_names.safe_filter)
+        skip_year: Optional function taking a year, returning True for the year pseudofolders to skip (see safe_names.year_filter)
+        compact: If True, the band definitions are left out of the items (see stac_io.compact_item)
+        gzip_upload: If True, the requests are sent gzipped with Content-Encoding: gzip
+        schedule: Order in which the new SAFEs of all the buckets are made and uploaded (see safe_names.schedule_safes)
+        index_path: SQLite index of the published items (see catalog_index), used instead of listing the items from
+            GeoServer and updated with the uploaded items. None to list the items from GeoServer
+        list_workers: Number of threads listing a bucket (see safe_listing.iter_safes)
+        dedupe: If True, a SAFE found in several buckets is made only from one of them, chosen by the precedence
+        precedence: list of regular expressions of bucket names, the SAFEs found in several buckets are taken from the
+            bucket matching the earliest pattern, and from the first such bucket in the list (see safe_names.bucket_ranks)
+        quarantine_path: JSON file where the SAFEs that failed are listed, None to not write it
+        rebuild_index: If True, the index is made again from the items listed from GeoServer (see load_published_ids())
+
+        The new SAFEs of all the buckets are listed first and then made into items in the order of the schedule, so
+        with 'newest' the latest acquisitions do not wait behind the older SAFEs of the buckets listed before them.
+        Every item is uploaded as soon as it is made.
+    """
+
+    s3_client = init_client()
+    buckets = get_buckets(s3_client)
+    session = requests.Session()
+    session.auth = ("admin", pwd)
+    log_headers = {"User-Agent": "update-script"} # Added for easy log-filtering
+    with stage('published'):
+        original_csc_collection_ids = load_published_ids(app_host, csc_collection, index_path, rebuild_index)
+    items_to_add = {}
+    tilecache = load_tile_cache(tile_cache_path)
+    # The SAFEs already in the Collection and the ones left out by the filters are skipped before their files are listed
+    skip = combine_skips(name_filter, lambda safename: safename in original_csc_collection_ids)
+
+    # Only the names of the SAFEs not yet in the Collection are collected, their keys are listed when they are made
+    # into items, so the listing of all the buckets stays small
+    with stage('list'):
+        candidates = [
+            (bucket, safe, listing)
+            for bucket in buckets
+            for safe, listing in list_safes(s3_client, bucket, discovery, skip, skip_year, list_workers)
+        ]
+    print(f" * {len(candidates)} new SAFEs listed.")
+    if dedupe:
+        candidates = dedupe_safes(candidates, bucket_ranks(buckets, precedence))
+
+    # The copies of a SAFE in several buckets are made one after the other, so its item is complete when it is uploaded
+    groups = {}
+    for candidate in schedule_safes(candidates, schedule):
+        groups.setdefault(candidate[1].split('.')[0], []).append(candidate)
+
+    def with_contents(group):
+        return [(bucket, safe, safe_contents(s3_client, bucket, listing)) for bucket, safe, listing in group]
+
+    mount_adapter(session, max_workers)
+    limiter = AdaptiveLimiter(maximum=max_workers, latency_target=latency_target)
+    quarantine = []
+    uploads = []
+    with ThreadPoolExecutor(max_workers) as pool:
+        with stage('items'):
+            # The keys of the next SAFEs are listed while the current one is read
+            for group in ordered_map(with_contents, groups.values(), list_workers):
+                for bucket, safe, safecontents in group:
+                    error = try_add_safe_items(items_to_add, csc_collection, s3_client, bucket, safe, safecontents, tilecache)
+                    if error:
+                        # Like in the build, the SAFE is left out and listed, it is tried again by the next update
+                        print('SAFE failed, quarantined:', safe, repr(error))
+                        quarantine.append({'bucket': bucket, 'safe': safe, 'error': repr(error)})
+                item = items_to_add.get(group[0][1].split('.')[0])
+                if item is not None:
+                    # Every item is uploaded as soon as it is made, while the next SAFEs are read
+                    uploads.append(pool.submit(upload_item, app_host, session, limiter, csc_collection, item, log_headers, compact, gzip_upload))
+        with stage('upload'):
+            uploaded, failed = split_results([upload.result() for upload in uploads])
+
+    save_tile_cache(tile_cache_path, tilecache)
+    save_quarantine(quarantine_path, quarantine)
+    if quarantine:
+        print(f" ! {len(quarantine)} SAFEs quarantined, listed in {quarantine_path}")
+
+    with stage('index'):
+        index_item_dicts(index_path, [items_to_add[item_id].to_dict() for item_id in uploaded])
+    if failed:
+        raise failed[0][1]
+
     if items_to_add:
         print(f" + Number of items added: {len(items_to_add)}")
-        # Update the extents from the Allas Items
-        csc_collection.update_extent_from_items()
-        collection_dict = csc_collection.to_dict()
-        converted_collection = json_convert(collection_dict)
-        request_point = f"collections/{csc_collection.id}/"
-
-        r = session.put(urljoin(app_host, request_point), headers=log_headers, json=converted_collection)
-        r.raise_for_status()
-        print(" + Updated Collection Extents.")
+        with stage('extent'):
+            update_collection_extent(app_host, session, csc_collection, log_headers, gzip_upload)
     else:
         print(" * All items present.")
 
-if __name__ == "__main__":
+def watch_catalog(app_host, csc_collection, pwd, interval=600, state_path='watch_state.json', latency_log='watch_latency.csv', tile_cache_path='tile_geometry_cache.json', max_workers=16, latency_target=2.0, name_filter=None, skip_year=None, compact=False, gzip_upload=False, schedule='newest', index_path=None, dedupe=True, precedence=None, max_failures=3, quarantine_path='update_quarantine.json', discovery='auto', list_workers=4, rebuild_index=False, polls=None):
 
     """
-    The first check for REST API password is from a password file. 
-    If a password file is not found, the script prompts the user to give a password through CLI
+        app_host: URL of the GeoServer OSEO REST API
+        csc_collection: pystac_client Collection of the already published items
+        pwd: GeoServer admin password
+        interval: Seconds from the start of one poll of the buckets to the next
+        state_path: JSON file of the per bucket listing state (see load_watch_state()), None to keep it only in memory
+        latency_log: CSV file where the arrival-to-visible latency of every published SAFE is appended, None to not log
+        tile_cache_path: JSON file of the tile geometry cache (see tile_cache), None to not use the cache
+        max_workers: Maximum number of uploads in flight, the actual number is adapted with adaptive_limit.AdaptiveLimiter
+        latency_target: Seconds, slower GeoServer responses lower the number of uploads in flight
+        name_filter: Optional function taking a SAFE name, returning True for the SAFEs to skip (see safe_names.safe_filter)
+        skip_year: Optional function taking a year, returning True for the year pseudofolders to skip (see safe_names.year_filter)
+        compact: If True, the band definitions are left out of the items (see stac_io.compact_item)
+        gzip_upload: If True, the requests are sent gzipped with Content-Encoding: gzip
+        schedule: Order in which the complete SAFEs of a poll are made and uploaded (see safe_names.schedule_safes)
+        index_path: SQLite index of the published items (see catalog_index), None to list the items from GeoServer
+        dedupe: If True, a SAFE complete in several buckets in the same poll is made only from one of them
+        precedence: list of regular expressions of bucket names choosing the bucket of a duplicate (see safe_names.bucket_ranks)
+        max_failures: Number of polls a SAFE can fail in before it is quarantined and not tried again
+        quarantine_path: JSON file where the quarantined SAFEs are listed after every poll, None to not write it
+        rebuild_index: If True, the index is made again from the items listed from GeoServer (see load_published_ids())
+        discovery: How the SAFEs are found from the buckets, 'auto', 'delimiter' or 'list' (see safe_listing.iter_safes)
+        list_workers: Number of threads listing a bucket (see safe_listing.iter_safes)
+        polls: Number of polls before returning, None to poll until the process is stopped
+
+        By default every poll lists only the SAFE prefixes of the buckets and the files of the SAFEs not yet published. A new SAFE may still be being uploaded, so it is published
+        when the number of its files is the same in two polls in a row, through the same make_item() and json_convert()
+        as update_catalog(). The arrival time of a SAFE is the last modification time of its newest file.
     """
 
-    # Band information in Band objects and as a dict
-    s2_bands = {
-        "B01": {
-            "band": Band.create(name='B01', description='Coastal: 400 - 450 nm', common_name='coastal')
-        },
-        "B02": {
-            "band": Band.create(name='B02', description='Blue: 450 - 500 nm', common_name='blue')
-        },
-        "B03": {
-            "band": Band.create(name='B03', description='Green: 500 - 600 nm', common_name='green'),
-        },
-        "B04": {
-            "band": Band.create(name='B04', description='Red: 600 - 700 nm', common_name='red'),
-        },
-        "B05": {
-            "band": Band.create(name='B05', description='Vegetation Red Edge: 705 nm', common_name='rededge')
-        },
-        "B06": {
-            "band": Band.create(name='B06', description='Vegetation Red Edge: 740 nm', common_name='rededge')
-        },
-        "B07": {
-            "band": Band.create(name='B07', description='Vegetation Red Edge: 783 nm', common_name='rededge')
-        },
-        "B08": {
-            "band": Band.create(name='B08', description='Near-IR: 750 - 1000 nm', common_name='nir')
-        },
-        "B8A": {
-            "band": Band.create(name='B8A', description='Near-IR: 750 - 900 nm', common_name='nir08')
-        },
-        "B09": {
-            "band": Band.create(name='B09', description='Water vapour: 850 - 1050 nm', common_name='nir09')
-        },
-        "B10": {
-            "band": Band.create(name='B10', description='SWIR-Cirrus: 1350 - 1400 nm', common_name='cirrus')
-        },
-        "B11": {
-            "band": Band.create(name='B11', description='SWIR16: 1550 - 1750 nm', common_name='swir16')
-        },
-        "B12": {
-            "band": Band.create(name='B12', description='SWIR22: 2100 - 2300 nm', common_name='swir22')
-        }
-    }
+    s3_client = init_client()
+    session = requests.Session()
+    session.auth = ("admin", pwd)
+    mount_adapter(session, max_workers)
+    log_headers = {"User-Agent": "update-script"} # Added for easy log-filtering
+    with stage('published'):
+        published_ids = load_published_ids(app_host, csc_collection, index_path, rebuild_index)
+    state = load_watch_state(state_path)
+    tilecache = load_tile_cache(tile_cache_path)
+
+    poll = 0
+    while polls is None or poll < polls:
+        poll += 1
+        poll_start = time.monotonic()
+        try:
+            published = watch_poll(app_host, session, csc_collection, s3_client, state, published_ids, tilecache, log_headers, latency_log,
+                max_workers, latency_target, name_filter, skip_year, compact, gzip_upload, schedule, index_path, dedupe, precedence, max_failures, discovery, list_workers)
+            print(f" * Poll {poll}: {published} items published")
+        except Exception as error:
+            # The daemon keeps running when Allas or GeoServer fails, the SAFEs are tried again on the next poll
+            print(f" ! Poll {poll} failed: {error!r}")
+
+        save_watch_state(state_path, state)
+        save_tile_cache(tile_cache_path, tilecache)
+        save_quarantine(quarantine_path, [
+            {'bucket': bucket, 'safe': safe, **entry} for bucket, safes in state['quarantine'].items() for safe, entry in safes.items()
+        ])
+
+        if polls is None or poll < polls:
+            time.sleep(max(0, interval - (time.monotonic() - poll_start)))
+
+def watch_poll(app_host, session, csc_collection, s3_client, state, published_ids, tilecache, log_headers, latency_log, max_workers, latency_target, name_filter, skip_year, compact, gzip_upload, schedule='newest', index_path=None, dedupe=True, precedence=None, max_failures=3, discovery='auto', list_workers=4):
 
-    s2_bands_as_dict = {
-        "B01": {
-            'name': 'B01', 
-            'description': 'Coastal: 400 - 450 nm', 
-            'common_name': 'coastal'
-        },
-        "B02": {
-            'name': 'B02', 
-            'description': 'Blue: 450 - 500 nm', 
-            'common_name': 'blue'
-        },
-        "B03": {
-            'name': 'B03', 
-            'description': 'Green: 500 - 600 nm', 
-            'common_name': 'green'
-        },
-        "B04": {
-            'name': 'B04', 
-            'description': 'Red: 600 - 700 nm', 
-            'common_name': 'red'
-        },
-        "B05": {
-            'name': 'B05', 
-            'description': 'Vegetation Red Edge: 705 nm', 
-            'common_name': 'rededge'
-        },
-        "B06": {
-            'name': 'B06', 
-            'description': 'Vegetation Red Edge: 740 nm', 
-            'common_name': 'rededge'
-        },
-        "B07": {
-            'name': 'B07', 
-            'description': 'Vegetation Red Edge: 783 nm',
-            'common_name': 'rededge'
-        },
-        "B08": {
-            'name': 'B08', 
-            'description': 'Near-IR: 750 - 1000 nm',
-            'common_name': 'nir'
-        },
-        "B8A": {
-            'name': 'B8A', 
-            'description': 'Near-IR: 750 - 900 nm',
-            'common_name': 'nir08'
-        },
-        "B09": {
-            'name': 'B09', 
-            'description': 'Water vapour: 850 - 1050 nm',
-            'common_name': 'nir09'
-        },
-        "B10": {
-            'name': 'B10', 
-            'description': 'SWIR-Cirrus: 1350 - 1400 nm',
-            'common_name': 'cirrus'
-        },
-        "B11": {
-            'name': 'B11', 
-            'description': 'SWIR16: 1550 - 1750 nm',
-            'common_name': 'swir16'
-        },
-        "B12": {
-            'name': 'B12', 
-            'description': 'SWIR22: 2100 - 2300 nm',
-            'common_name': 'swir22'
-        }
-    }
+    """
+        One poll of watch_catalog(), the arguments are described there.
+        state: Listing state from load_watch_state(), updated in place
+        published_ids: Set of the ids of the items in GeoServer, updated in place
+        -> number of the items published
+    """
+
+    items_to_add = {}
+    arrivals = {}
+    try:
+        # The complete SAFEs of all the buckets, made into items in the order of the schedule
+        ready = []
+        skipped = {}
+        buckets = get_buckets(s3_client)
+        with stage('list'):
+            for bucket in buckets:
+                # Number of files of the SAFEs that were not complete in the last poll, by SAFE folder name
+                pending = state['pending'].setdefault(bucket, {})
+                # SAFEs that were complete but have no data for an item, they are not listed again
+                skipped[bucket] = set(state['skipped'].get(bucket, []))
+                # SAFEs that failed in max_failures polls, they are not tried again
+                quarantined = state['quarantine'].get(bucket, {})
+                def skip(safename):
+                    safe = safename + '.SAFE'
+                    return safename in published_ids or safe in skipped[bucket] or safe in quarantined or bool(name_filter and name_filter(safename))
+
+                listed = set()
+                for safe, objects in iter_safe_objects(s3_client, bucket, discovery, skip, skip_year, list_workers):
+                    listed.add(safe)
+                    if pending.get(safe) != len(objects):
+                        # New or still growing, checked again on the next poll
+                        pending[safe] = len(objects)
+                        continue
+
+                    pending.pop(safe)
+                    ready.append((bucket, safe, objects))
+                # The SAFEs published, quarantined or removed since the last poll are not pending any more
+                for safe in set(pending) - listed:
+                    del pending[safe]
+
+        if dedupe:
+            ready = dedupe_safes(ready, bucket_ranks(buckets, precedence))
+
+        with stage('items'):
+            for bucket, safe, objects in schedule_safes(ready, schedule):
+                safename = safe.split('.')[0]
+                error = try_add_safe_items(items_to_add, csc_collection, s3_client, bucket, safe, [x['Key'] for x in objects], tilecache)
+                failures = state['failures'].setdefault(bucket, {})
+                if error:
+                    # A broken SAFE does not stop the others, it is tried again in the next polls until it has failed max_failures times
+                    failures[safe] = failures.get(safe, 0) + 1
+                    if failures[safe] >= max_failures:
+                        print(f" ! {safe} in {bucket} quarantined after {failures.pop(safe)} failed polls: {error!r}")
+                        state['quarantine'].setdefault(bucket, {})[safe] = {'error': repr(error), 'failed': datetime.now(timezone.utc).isoformat()}
+                    else:
+                        print(f" ! {safe} in {bucket} failed ({failures[safe]}/{max_failures}): {error!r}")
+                        # Taken as complete on the next poll if it has not changed, instead of waiting for two more polls
+                        state['pending'][bucket][safe] = len(objects)
+                    continue
+                failures.pop(safe, None)
+                if safename not in items_to_add:
+                    skipped[bucket].add(safe)
+                elif safename not in arrivals:
+                    arrivals[safename] = (bucket, max(x['LastModified'] for x in objects))
+
+        for bucket, safes in skipped.items():
+            state['skipped'][bucket] = sorted(safes)
+
+        if not items_to_add:
+            return 0
+
+        with stage('upload'):
+            uploaded, failed = upload_items(app_host, session, csc_collection, list(items_to_add.values()), log_headers, max_workers, latency_target, compact, gzip_upload)
+        visible = datetime.now(timezone.utc)
+        published_ids.update(uploaded)
+        with stage('index'):
+            index_item_dicts(index_path, [items_to_add[item_id].to_dict() for item_id in uploaded])
+        log_latencies(latency_log, [(item_id, *arrivals[item_id], visible) for item_id in uploaded])
+        for item_id, error in failed:
+            # Not in published_ids, so the SAFE is made again in the later polls
+            print(f" ! {item_id} not published: {error!r}")
+            csc_collection.remove_item(item_id)
+
+        if uploaded:
+            with stage('extent'):
+                update_collection_extent(app_host, session, csc_collection, log_headers, gzip_upload)
+
+        return len(uploaded)
+    finally:
+        # Only the items of this poll are in the collection, so the memory of the daemon does not grow with every poll
+        for item_id in items_to_add:
+            csc_collection.remove_item(item_id)
+
+def load_watch_state(path):
+    """
+        path: JSON file of the watch state, nothing is read if None
+        -> dict with 'pending': {bucket: {SAFE folder name: number of files seen in the last poll}},
+            'skipped': {bucket: [SAFE folder names without data for an item]},
+            'failures': {bucket: {SAFE folder name: number of polls it has failed in}}
+            and 'quarantine': {bucket: {SAFE folder name: {'error', 'failed'}}} of the SAFEs that are not tried again.
+            To try a quarantined SAFE again, remove it from the file
+    """
+
+    state = {'pending': {}, 'skipped': {}, 'failures': {}, 'quarantine': {}}
+    if path and os.path.exists(path):
+        with open(path) as f:
+            state.update(json.load(f))
+
+    return state
+
+def save_watch_state(path, state):
+    """
+        path: JSON file of the watch state, nothing is saved if None
+        state: dict from load_watch_state()
+    """
+
+    if not path:
+        return
+
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+def log_latencies(path, published):
+    """
+        path: CSV file the latencies are appended to, nothing is written if None
+        published: list of (item id, bucket, arrival datetime, visible datetime) tuples
+    """
+
+    if not path:
+        return
+
+    new_file = not os.path.exists(path)
+    with open(path, 'a') as f:
+        if new_file:
+            f.write('safe,bucket,arrived,visible,latency_seconds\n')
+        for item_id, bucket, arrived, visible in published:
+            f.write(f'{item_id},{bucket},{arrived.isoformat()},{visible.isoformat()},{(visible - arrived).total_seconds():.0f}\n')
+
+def main(args):
+
+    """
+    args: Parsed arguments of the update command from s2stac.build_parser()
+
+    The first check for REST API password is from a password file. 
+    If a password file is not found, the script prompts the user to give a password through CLI
+    """
 
     pw_filename = 'passwords.txt'
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--host", type=str, help="Hostname of the selected STAC API", required=True)
-    
-    args = parser.parse_args()
 
     try:
-        pw_file = pd.read_csv(pw_filename, header=None)
-        pwd = pw_file.at[0,0]
+        with open(pw_filename) as f:
+            pwd = f.readline().strip().split(',')[0]
     except FileNotFoundError:
         print("Password not given as an argument and no password file found")
         pwd = getpass.getpass()
@@ -579,7 +986,20 @@ if __name__ == "__main__":
     csc_catalog = pystac_client.Client.open(f"{args.host}/geoserver/ogc/stac/v1/", headers={"User-Agent":"update-script"})
     csc_collection = csc_catalog.get_collection("sentinel2-l2a")
     print(f"Updating STAC Catalog at {args.host}")
-    update_catalog(app_host, csc_collection)
+    name_filter = safe_filter(args.since, args.until, args.tiles, args.missions, args.baseline)
+    if args.watch:
+        watch_catalog(app_host, csc_collection, pwd, args.interval, args.watch_state or None, args.latency_log or None, args.tile_cache or None,
+            args.max_workers, args.latency_target, name_filter, year_filter(args.since, args.until), args.compact, args.gzip_upload, args.schedule, args.index,
+            not args.keep_duplicates, args.bucket_precedence, args.max_failures, args.quarantine or None, args.discovery, args.list_workers, args.rebuild_index)
+        return
+    update_catalog(app_host, csc_collection, pwd, args.discovery, args.tile_cache or None, args.max_workers, args.latency_target,
+        name_filter, year_filter(args.since, args.until), args.compact, args.gzip_upload, args.schedule, args.index, args.list_workers,
+        not args.keep_duplicates, args.bucket_precedence, args.quarantine or None, args.rebuild_index)
 
     end = time.time()
-    print(f"Script took {end-start:.2f} seconds")
\ No newline at end of file
+    print(f"Script took {end-start:.2f} seconds")
+
+if __name__ == "__main__":
+
+    from s2stac import parse_args, call_main
+    call_main(main, parse_args("update"))